@@ -0,0 +1,138 @@
+'''
+Options and fixtures of the benchmark suite in test_benchmarks.py.
+
+Benchmarks are timed only with --run-benchmarks. Otherwise tests marked benchmark are skipped
+and the others check their results on the smallest synthetic model without timing.
+Benchmarks run on synthetic models of configurable size (--benchmark-sizes, for scaling curves)
+and on the IO tables of a model built from the packaged data at the BEA levels given by
+--benchmark-levels. With --benchmark-json, all benchmark timings are written to a JSON file,
+e.g. to track nightly builds:
+
+    python -m pytest tests/test_benchmarks.py --run-benchmarks --benchmark-sizes=15,71,411,1000 --benchmark-json=bench.json
+'''
+import copy
+import datetime
+import json
+import logging
+import platform
+import timeit
+import numpy as np
+import pandas as pd
+import pytest
+from context import USEEIOModel, build_profiler, configuration_functions, load_io_tables
+from synthetic import make_synthetic_model
+
+# Number of sectors of synthetic models at the BEA Sector, Summary and Detail levels
+level_sizes = {"Sector": 15, "Summary": 71, "Detail": 411}
+# Model specs the packaged data benchmarks are built from, at each level
+benchmark_model = "USEEIOv2.1-422"
+
+# Timings recorded by the benchmark fixture in this session
+benchmark_results = []
+
+
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmarks", action = "store_true", default = False,
+                     help = "time the benchmarks and run the benchmarks on the packaged data")
+    parser.addoption("--benchmark-sizes", default = None,
+                     help = "comma separated numbers of sectors of the synthetic benchmark models, "
+                            f"defaults to {','.join(str(size) for size in level_sizes.values())} with --run-benchmarks "
+                            f"and {min(level_sizes.values())} otherwise")
+    parser.addoption("--benchmark-levels", default = ",".join(level_sizes),
+                     help = "comma separated BEA levels (Sector, Summary, Detail) of the packaged data benchmarks")
+    parser.addoption("--benchmark-json", default = None,
+                     help = "write the benchmark timings to this JSON file")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: benchmark on the packaged data, run only with --run-benchmarks")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("run_benchmarks"):
+        return
+    skip = pytest.mark.skip(reason = "benchmark, use --run-benchmarks to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_generate_tests(metafunc):
+    if "model_size" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("benchmark_sizes")
+        if sizes is None:
+            sizes = list(level_sizes.values()) if metafunc.config.getoption("run_benchmarks") else [min(level_sizes.values())]
+        else:
+            sizes = [int(size) for size in sizes.split(",")]
+        metafunc.parametrize("model_size", sizes, ids = [f"{size}-sectors" for size in sizes])
+    if "io_level" in metafunc.fixturenames:
+        levels = metafunc.config.getoption("benchmark_levels").split(",")
+        metafunc.parametrize("io_level", levels)
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("benchmark_json")
+    if path and benchmark_results:
+        report = {
+            "date": datetime.datetime.now().isoformat(),
+            "machine": platform.node(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "results": benchmark_results,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent = 2)
+
+
+@pytest.fixture
+def benchmark(request):
+    '''
+    Time a function: returns run(func, number = 1, repeat = 3, **params), which returns the
+    best time in seconds per call of func and records it with the test name and params.
+    Without --run-benchmarks, func is called once and not timed, and None is returned.
+    '''
+    def run(func, number = 1, repeat = 3, **params):
+        if not request.config.getoption("run_benchmarks"):
+            func()
+            return(None)
+        seconds = min(timeit.repeat(func, number = number, repeat = repeat)) / number
+        benchmark_results.append({"name": request.node.name, "params": params, "seconds": seconds,
+                                  "number": number, "repeat": repeat})
+        print(f"\n{request.node.name} {params}: {seconds*1e3:.3f} ms")
+        return(seconds)
+    return(run)
+
+
+@pytest.fixture
+def synthetic_model(model_size):
+    return(make_synthetic_model(model_size))
+
+
+@pytest.fixture(scope = "session")
+def io_models():
+    '''
+    Get the IO data (the io_data build stage) of the benchmark model at a BEA level, without
+    aggregation or disaggregation. Each level is loaded once per session; a copy is returned.
+    '''
+    models = {}
+
+    def get(level):
+        if level not in models:
+            model = USEEIOModel.__new__(USEEIOModel)
+            model._init_state(False)
+            specs = configuration_functions.get_configuration(benchmark_model, "model")
+            specs.update({"Model": f"{benchmark_model}-{level}", "BaseIOLevel": level,
+                          "AggregationSpecs": None, "DisaggregationSpecs": None})
+            model.specs = specs
+            with build_profiler.profile_build(model):
+                model.load_crosswalk()
+                load_io_tables.load_io_data(model)
+            models[level] = model
+        return(copy.deepcopy(models[level]))
+    return(get)
+
+
+@pytest.fixture
+def io_model(io_models, io_level):
+    return(io_models(io_level))
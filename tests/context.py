@@ -4,4 +4,6 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import useeio_py
 from useeio_py.useeio_model import USEEIOModel
-from useeio_py import load_io_tables, io_functions
+from useeio_py import load_io_tables, io_functions, aggregate_functions
+from useeio_py import calculation_functions, data_quality_functions, demand_functions, flowsa_functions, load_satellites, satellite_functions
+from useeio_py import build_profiler, configuration_functions, load_margins, utility_functions
@@ -0,0 +1,112 @@
+'''
+Synthetic matrices, tables and models shared by the tests and benchmarks.
+'''
+from context import USEEIOModel
+import numpy as np
+import pandas as pd
+
+# Approximate USEEIOv2.0 Detail shapes: sectors, flows in B, indicators in D
+SECTORS = 411
+FLOWS = 2700
+INDICATORS = 24
+
+
+def make_matrix(rows, cols, density, seed):
+    rng = np.random.default_rng(seed)
+    values = rng.random((rows, cols)) * (rng.random((rows, cols)) < density)
+    sectors = [f"{i:06d}/US" for i in range(cols)]
+    return(pd.DataFrame(values, index=[f"row{i}" for i in range(rows)], columns=sectors))
+
+
+def make_vector(matrix, density, seed):
+    rng = np.random.default_rng(seed)
+    values = rng.random(matrix.shape[1]) * (rng.random(matrix.shape[1]) < density)
+    return(pd.DataFrame(values, index=matrix.columns))
+
+
+def make_make_model(years, sectors = SECTORS):
+    '''Model with a Make table and multi-year industry output and CPI'''
+    V = make_matrix(sectors, sectors, 0.05, 8)
+    V = V + pd.DataFrame(np.identity(sectors), index=V.index, columns=V.columns)
+    V.index = [f"i{c}" for c in V.columns]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.specs = {}
+    model.MakeTransactions = V
+    model.IndustryOutput = V.sum(axis=1)
+    model.CommodityOutput = V.sum(axis=0)
+    model.MultiYearIndustryOutput = pd.DataFrame({str(year): model.IndustryOutput * (1 + (year - 2012)/100) for year in years})
+    model.MultiYearIndustryCPI = pd.DataFrame({str(year): pd.Series(100 + year - 2012, index=V.index, dtype=float) for year in years})
+    return(model)
+
+
+def make_lazy_model(sectors = SECTORS):
+    '''Model with Make, Use, B and C tables that builds its other matrices on access'''
+    model = make_make_model([2012], sectors)
+    model.specs = {"CommodityorIndustryType": "Commodity", "ModelType": "EEIO"}
+    U = make_matrix(sectors, sectors, 0.05, 19) * 0.2
+    U.columns = model.MakeTransactions.index
+    U.index = model.MakeTransactions.columns
+    model.UseTransactions = U
+    model.DomesticUseTransactions = U * 0.8
+    # B and C are given, so their satellite tables and indicators are not needed
+    model.B = make_matrix(500, sectors, 0.2, 20)
+    model.C = make_matrix(INDICATORS, 500, 0.2, 21)
+    model.C.columns = model.B.index
+    # Build matrices on access, as USEEIOModel(..., lazy = True) does
+    model._lazy_matrices = True
+    return(model)
+
+
+def make_synthetic_model(sectors, seed = 0):
+    '''
+    Make a model of the given number of sectors with random Make and Use tables, B and C
+    (about 6.5 flows per sector and 24 indicators, like USEEIOv2.0 Detail). Its other
+    matrices are built on access.
+    '''
+    rng = np.random.default_rng(seed)
+    flows = int(sectors * 6.5)
+    commodities = [f"{i:06d}/US" for i in range(sectors)]
+    industries = [f"i{code}" for code in commodities]
+    V = rng.random((sectors, sectors)) * (rng.random((sectors, sectors)) < 0.05) + np.identity(sectors)
+    U = rng.random((sectors, sectors)) * (rng.random((sectors, sectors)) < 0.05)
+    model = USEEIOModel.__new__(USEEIOModel)
+    model._init_state(True)
+    model.specs = {"Model": f"Synthetic-{sectors}", "CommodityorIndustryType": "Commodity", "ModelType": "EEIO"}
+    model.MakeTransactions = pd.DataFrame(V, index=industries, columns=commodities)
+    model.IndustryOutput = model.MakeTransactions.sum(axis=1)
+    model.CommodityOutput = model.MakeTransactions.sum(axis=0)
+    # Keep the column sums of A well below 1
+    U = U / U.sum(axis=0).max() * model.IndustryOutput.min() * 0.5
+    model.UseTransactions = pd.DataFrame(U, index=commodities, columns=industries)
+    model.DomesticUseTransactions = model.UseTransactions * 0.8
+    model.B = pd.DataFrame(rng.random((flows, sectors)) * (rng.random((flows, sectors)) < 0.3),
+                           index=[f"flow{i}" for i in range(flows)], columns=commodities)
+    model.C = pd.DataFrame(rng.random((24, flows)) * (rng.random((24, flows)) < 0.2),
+                           index=[f"indicator{i}" for i in range(24)], columns=model.B.index)
+    return(model)
+
+
+def make_tbs(rows, sectors, seed):
+    '''Totals by sector table of random flows of the given sectors'''
+    rng = np.random.default_rng(seed)
+    flows = rng.integers(0, 20, rows)
+    tbs = pd.DataFrame({
+        "Flowable": [f"flow{i}" for i in flows],
+        "Context": np.where(flows % 2 == 0, "emission/air", "resource/water"),
+        "FlowUUID": [f"uuid{i}" for i in flows],
+        "Sector": [sectors[i] for i in rng.integers(0, len(sectors), rows)],
+        "Location": rng.choice(["US", "US-GA"], rows),
+        "Unit": "kg",
+        "Year": 2012,
+        "DistributionType": "NORMAL",
+        "FlowAmount": rng.random(rows),
+        "Min": rng.random(rows),
+        "Max": rng.random(rows) + 1,
+        "DataReliability": np.where(rng.random(rows) < 0.1, np.nan, rng.integers(1, 6, rows)),
+        "TemporalCorrelation": rng.integers(1, 6, rows).astype(float),
+        "GeographicalCorrelation": rng.integers(1, 6, rows).astype(float),
+        "TechnologicalCorrelation": rng.integers(1, 6, rows).astype(float),
+        "DataCollection": rng.integers(1, 6, rows).astype(float),
+        "MetaSources": rng.choice(["EPA_GHGI", "EPA_GHGI.T_3_7", "EIA_MECS"], rows),
+    })
+    return(tbs)
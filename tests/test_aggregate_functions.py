@@ -0,0 +1,59 @@
+from context import aggregate_functions, utility_functions, USEEIOModel
+from synthetic import SECTORS, make_matrix
+import numpy as np
+import pandas as pd
+
+
+def loop_aggregate(table, agg):
+    '''Add each aggregated row and column to the main sector, then drop it'''
+    table = table.copy()
+    for sector in agg[1:]:
+        for axis in (0, 1):
+            codes = list(table.axes[axis])
+            if agg[0] in codes and sector in codes:
+                main, remove = codes.index(agg[0]), codes.index(sector)
+                if axis == 0:
+                    table.iloc[main, :] = table.iloc[main, :] + table.iloc[remove, :]
+                else:
+                    table.iloc[:, main] = table.iloc[:, main] + table.iloc[:, remove]
+    return(table.drop(agg[1:], axis = 0, errors = "ignore").drop(agg[1:], axis = 1, errors = "ignore"))
+
+
+def test_aggregate_table():
+    V = make_matrix(SECTORS, SECTORS, 0.05, 9)
+    V.index = V.columns
+    spec = {"Sectors": list(V.columns[10:310:2])}
+    expected = loop_aggregate(V, spec["Sectors"])
+    pd.testing.assert_frame_equal(aggregate_functions.aggregate_table(V, spec), expected)
+    pd.testing.assert_frame_equal(utility_functions.to_dense_matrix(
+        aggregate_functions.aggregate_table(utility_functions.to_sparse_matrix(V), spec)), expected)
+    # Rows without the main sector (e.g. value added) are only removed, columns are unchanged
+    va = V.iloc[:, :3].copy()
+    va.index = [f"va{i}" if i != 20 else V.columns[20] for i in range(SECTORS)]
+    pd.testing.assert_frame_equal(aggregate_functions.aggregate_table(va, spec), va.drop(V.columns[20]))
+
+
+def test_aggregate_multi_year_cpi():
+    V = make_matrix(SECTORS, SECTORS, 0.05, 9)
+    V.index = V.columns
+    group = list(V.columns[10:310:2])
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.MultiYearIndustryCPI = pd.DataFrame({"2012": 100.0, "2013": np.linspace(90, 110, SECTORS)}, index=V.index)
+    model.MultiYearIndustryOutput = pd.DataFrame({"2012": V.sum(axis=1), "2013": V.sum(axis=1) * 2}, index=V.index)
+    cpi = aggregate_functions.aggregate_multi_year_cpi(model, {"Sectors": group}, "Industry")
+    output = model.MultiYearIndustryOutput.loc[group]
+    expected_main = (model.MultiYearIndustryCPI.loc[group] * output).sum() / output.sum()
+    pd.testing.assert_series_equal(cpi.loc[group[0]], expected_main, check_names = False)
+    assert len(cpi) == SECTORS - len(group) + 1
+
+
+def test_get_index():
+    codes = [f"{i:06d}/US" for i in range(SECTORS)]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.Industries = pd.DataFrame({"Code": [c[:6] for c in codes], "Code_Loc": codes})
+    assert aggregate_functions.get_index(model, "Industries", codes[5]) == 5
+    assert aggregate_functions.get_index(model, "Industries", "missing") == -1
+    # Replacing the list (e.g. in aggregation) rebuilds its index
+    model.Industries = aggregate_functions.remove_rows_by_position(
+        model.Industries, aggregate_functions.get_indices(model, "Industries", codes[:5] + ["missing"]))
+    assert aggregate_functions.get_index(model, "Industries", codes[5]) == 0
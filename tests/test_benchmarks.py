@@ -0,0 +1,91 @@
+'''
+Benchmarks of the model build and calculation hot paths.
+Run with `py.test tests/test_benchmarks.py --run-benchmarks -s` to see timings. Synthetic model
+sizes and the BEA levels of the packaged data benchmarks are set with the options in conftest.py.
+'''
+from context import aggregate_functions, calculation_functions, io_functions, load_io_tables, load_margins
+import pytest
+import numpy as np
+import pandas as pd
+
+
+def test_leontief_solver_scaling(synthetic_model, model_size, benchmark):
+    A = synthetic_model.A
+    y = np.random.default_rng(22).random((model_size, 10))
+    solver = io_functions.LeontiefSolver(A)
+    np.testing.assert_allclose(solver.solve(y), np.linalg.solve(np.identity(model_size) - A.to_numpy(), y))
+    benchmark(lambda: io_functions.LeontiefSolver(A), operation = "factorize", sectors = model_size)
+    benchmark(lambda: solver.solve(y), number = 10, operation = "solve 10 demands", sectors = model_size)
+    benchmark(lambda: solver.left_multiply(synthetic_model.B), operation = "B L", sectors = model_size)
+
+
+@pytest.mark.parametrize("perspective", ["DIRECT", "FINAL", "BOTH"])
+def test_calculate_EEIO_model_scaling(synthetic_model, model_size, perspective, benchmark):
+    model = synthetic_model
+    demand = pd.DataFrame(np.random.default_rng(23).random(model_size), index=model.A.index)
+    result = calculation_functions.calculate_EEIO_model(model, perspective, demand)
+    if perspective != "DIRECT":
+        np.testing.assert_allclose(result['LCIA_f'].to_numpy().sum(axis=0), model.N.to_numpy() @ demand.iloc[:, 0].to_numpy())
+    if perspective != "FINAL":
+        # Direct and final perspective totals agree
+        np.testing.assert_allclose(result['LCIA_d'].to_numpy().sum(axis=0),
+                                   model.N.to_numpy() @ demand.iloc[:, 0].to_numpy())
+    benchmark(lambda: calculation_functions.calculate_EEIO_model(model, perspective, demand),
+              perspective = perspective, sectors = model_size)
+
+
+def test_normalize_io_transactions_scaling(synthetic_model, model_size, benchmark):
+    model = synthetic_model
+    benchmark(lambda: io_functions.normalize_io_transactions(model.UseTransactions, model.IndustryOutput),
+              backend = "dense", sectors = model_size)
+    benchmark(lambda: io_functions.normalize_io_transactions(model.UseTransactions, model.IndustryOutput, sparse = True),
+              backend = "sparse", sectors = model_size)
+
+
+@pytest.mark.benchmark
+def test_load_bea_tables(io_model, io_level, benchmark):
+    io_codes = load_io_tables.load_io_codes(io_model)
+    bea = load_io_tables.load_bea_tables(io_model.specs, io_codes)
+    assert bea["UseTransactions"].shape == io_model.UseTransactions.shape
+    benchmark(lambda: load_io_tables.load_bea_tables(io_model.specs, io_codes), level = io_level)
+
+
+@pytest.mark.benchmark
+def test_generate_domestic_use(io_model, io_level, benchmark):
+    # Use and final demand with BEA codes, as load_national_io_data() passes them
+    bea = load_io_tables.load_bea_tables(io_model.specs, load_io_tables.load_io_codes(io_model))
+    imp = io_functions.load_import_matrix(io_model)
+    use = pd.concat([bea["UseTransactions"], bea["FinalDemand"]], axis=1)
+    domestic_use = io_functions.generate_domestic_use(use, io_model, imp)
+    assert domestic_use.shape == use.shape
+    benchmark(lambda: io_functions.generate_domestic_use(use, io_model, imp), level = io_level)
+    benchmark(lambda: io_functions.normalize_io_transactions(io_model.UseTransactions, io_model.IndustryOutput,
+                                                            zero_output = "zero"),
+              level = io_level, operation = "normalize_io_transactions")
+
+
+@pytest.mark.benchmark
+def test_get_margins_table(io_model, io_level, benchmark):
+    margins = load_margins.get_margins_table(io_model)
+    assert len(margins) == len(io_model.Industries)
+    benchmark(lambda: load_margins.get_margins_table(io_model), repeat = 1, level = io_level)
+
+
+@pytest.mark.benchmark
+def test_electricity_aggregation(io_models, pytestconfig, benchmark):
+    if "Detail" not in pytestconfig.getoption("benchmark_levels").split(","):
+        pytest.skip("ElectricityAggregationDetail aggregates Detail sectors")
+    def aggregate(model):
+        model.specs['AggregationSpecs'] = ["ElectricityAggregationDetail"]
+        aggregate_functions.get_aggregation_specs(model)
+        aggregate_functions.aggregate_model(model)
+        return(model)
+
+    model = io_models("Detail")
+    aggregated = aggregate(io_models("Detail"))
+    # S00101/US and S00202/US are industries only
+    assert len(aggregated.Industries) == len(model.Industries) - 2
+    assert aggregated.MakeTransactions.shape == (len(model.Industries) - 2, len(model.Commodities))
+    np.testing.assert_allclose(aggregated.UseTransactions.to_numpy().sum(), model.UseTransactions.to_numpy().sum())
+    models = [io_models("Detail") for _ in range(3)]
+    benchmark(lambda: aggregate(models.pop()), level = "Detail", spec = "ElectricityAggregationDetail")
@@ -0,0 +1,33 @@
+from context import io_functions
+from synthetic import SECTORS, make_make_model
+from useeio_py.build_cache import BuildCache, get_build_key
+import os
+import numpy as np
+import pandas as pd
+
+
+def test_build_cache(tmp_path):
+    model = make_make_model(range(2012, 2023))
+    model.specs = {"Model": "Synthetic", "BaseIOSchema": 2012, "AggregationSpecs": None}
+    model.A = io_functions.generate_commodity_mix_matrix(model)
+    model.L = pd.DataFrame(np.linalg.inv(np.identity(SECTORS) - model.A.to_numpy() / 2), index=model.A.index, columns=model.A.columns)
+    key = get_build_key(model.specs)
+    assert key == get_build_key(dict(model.specs))
+    assert key != get_build_key({**model.specs, "BaseIOSchema": 2017})
+
+    cache = BuildCache(tmp_path)
+    assert cache.load(key) is None
+    cache.store(key, model)
+    state = cache.load(key)
+    assert "_derived_matrices" not in state
+    pd.testing.assert_frame_equal(state["L"], model.L)
+    pd.testing.assert_frame_equal(state["MakeTransactions"], model.MakeTransactions)
+
+    # Least recently used entries go first when over size, and entries past max_age always go
+    size = os.path.getsize(cache.get_path(key))
+    cache.store("other", model)
+    os.utime(cache.get_path(key), (0, 0))
+    cache.max_bytes = size
+    assert cache.evict() == [key]
+    cache.max_age = 0
+    assert cache.evict(now = os.path.getmtime(cache.get_path("other")) + 1) == ["other"]
@@ -0,0 +1,54 @@
+from context import USEEIOModel, build_profiler, configuration_functions, load_io_tables
+from synthetic import SECTORS, INDICATORS, make_lazy_model
+import json
+import os
+
+
+def test_build_profiler(tmp_path):
+    model = make_lazy_model()
+    with build_profiler.span("not_profiled") as span:
+        model.V_n
+    assert build_profiler.get_build_profiles(model) == [] and span.wall > 0
+
+    with build_profiler.profile_build(model, "synthetic"):
+        model.N
+    profile = build_profiler.get_build_profiles(model)[-1]
+    assert [child.name for child in profile.children] == ["matrix_U_n", "matrix_A", "matrix_M", "matrix_N"]
+    matrix_M = profile.children[2]
+    assert [child.name for child in matrix_M.children] == ["factorize_A"]
+    assert matrix_M.shapes == {"matrix_M": [500, SECTORS]}
+    U_n = profile.children[0].children[0]
+    assert U_n.name == "generate_direct_requirements_from_use"
+    assert U_n.children[0].name == "normalize_io_transactions"
+    assert profile.wall >= sum(child.wall for child in profile.children) and profile.cpu > 0
+
+    path = os.path.join(tmp_path, "profile.json")
+    build_profiler.write_build_profile(profile, path)
+    with open(path) as f:
+        report = json.load(f)
+    assert report["name"] == "synthetic" and report["children"][3]["shapes"] == {"matrix_N": [INDICATORS, SECTORS]}
+    path = os.path.join(tmp_path, "profile.folded")
+    build_profiler.write_build_profile(profile, path, format = "folded")
+    with open(path) as f:
+        stacks = dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+    assert "synthetic;matrix_M;factorize_A" in stacks
+    assert abs(sum(int(us) for us in stacks.values()) - profile.wall * 1e6) < len(stacks)
+
+
+def test_national_io_data_spans():
+    model = USEEIOModel.__new__(USEEIOModel)
+    model._init_state(False)
+    specs = configuration_functions.get_configuration("USEEIOv2.1-422", "model")
+    specs.update({"BaseIOLevel": "Sector", "AggregationSpecs": None, "DisaggregationSpecs": None})
+    model.specs = specs
+    with build_profiler.profile_build(model, "national_io_data"):
+        model.load_crosswalk()
+        load_io_tables.load_io_meta(model)
+        load_io_tables.load_national_io_data(model, load_io_tables.load_io_codes(model))
+    profile = build_profiler.get_build_profiles(model)[-1]
+    steps = {child.name: child for child in profile.children}
+    assert list(steps) == ["load_bea_tables", "load_import_matrix", "generate_domestic_use"]
+    # The Import matrix is loaded once and shared by domestic Use and the trade adjustment
+    assert [child.name for child in steps["generate_domestic_use"].children] == \
+        ["generate_domestic_use", "generate_international_trade_adjustment_vector"]
+    assert steps["load_import_matrix"].children[0].shapes["load_import_matrix"][0] == len(model.Commodities)
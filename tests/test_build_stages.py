@@ -0,0 +1,76 @@
+from context import USEEIOModel
+from synthetic import make_lazy_model
+import numpy as np
+import pandas as pd
+
+
+def test_run_build_stages(monkeypatch):
+    from useeio_py import build_stages, useeio_model
+    tables = make_lazy_model()
+    stages_run = []
+    matrices_built = []
+
+    def io_data(model, config_paths):
+        for name in ["MakeTransactions", "UseTransactions", "DomesticUseTransactions", "IndustryOutput", "CommodityOutput"]:
+            setattr(model, name, getattr(tables, name))
+        model.FinalDemand = pd.DataFrame({"F01000/US": tables.CommodityOutput * 0.1})
+        model.DomesticFinalDemand = model.FinalDemand * 0.9
+        model.UseValueAdded = pd.DataFrame([tables.IndustryOutput.to_numpy() * 0.3], index=["V00100/US"],
+                                           columns=tables.UseTransactions.columns)
+        model.InternationalTradeAdjustment = pd.Series(0.0, index=tables.CommodityOutput.index)
+
+    # Synthetic stages and satellite/indicator based builders stand in for the packaged data
+    stage_functions = {
+        "io_data": io_data,
+        "satellites": lambda model, config_paths: setattr(model, "SatelliteTables", dict(model.specs["SatelliteTable"])),
+        "indicators": lambda model, config_paths: setattr(model, "Indicators", dict(model.specs["Indicators"])),
+        "demand_vectors": lambda model, config_paths: setattr(model, "DemandVectors", {}),
+        "matrices": build_stages.run_matrices_stage,
+    }
+    builders = dict(useeio_model.matrix_builders)
+    builders.update({
+        "TbS": lambda model: model.SatelliteTables, "CbS": lambda model: model.TbS,
+        "B": lambda model: tables.B * model.CbS["GHG"],
+        "C": lambda model: tables.C * model.Indicators["GWP"],
+        "Rho": lambda model: None, "Phi": lambda model: None,
+    })
+
+    def record(function, runs, name):
+        def run(*args):
+            runs.append(name)
+            return(function(*args))
+        return(run)
+
+    monkeypatch.setattr(build_stages, "stage_functions",
+                        {name: record(function, stages_run, name) for name, function in stage_functions.items()})
+    monkeypatch.setattr(useeio_model, "matrix_builders",
+                        {name: record(function, matrices_built, name) for name, function in builders.items()})
+
+    specs = {"Model": "Synthetic", "CommodityorIndustryType": "Commodity", "ModelType": "EEIO", "IOYear": 2012,
+             "SatelliteTable": {"GHG": 1.0}, "Indicators": {"GWP": 1.0}, "DemandVectors": {}}
+    model = USEEIOModel.__new__(USEEIOModel)
+    model._init_state(False)
+    model.specs = dict(specs)
+    assert build_stages.run_build_stages(model) == list(build_stages.build_stages)
+    assert not model.is_materialized("L")
+    B, L, N = model.B, model.L, model.N
+
+    # Swapping the LCIA method only reloads the indicators and rebuilds C, D, N and N_d
+    stages_run.clear()
+    matrices_built.clear()
+    assert model.rebuild({**specs, "Indicators": {"GWP": 2.0}}) == ["indicators", "matrices"]
+    assert sorted(matrices_built) == ["C", "D", "N", "N_d"]
+    assert model.B is B and model.L is L
+    np.testing.assert_allclose(model.N.to_numpy(), 2 * N.to_numpy())
+    assert model.rebuild() == []
+
+    # A satellite spec change rebuilds B and what is built from it, but not A or L
+    matrices_built.clear()
+    assert model.rebuild({**model.specs, "SatelliteTable": {"GHG": 3.0}}) == ["satellites", "indicators", "matrices"]
+    assert "A" not in matrices_built and "B" in matrices_built and model.L is L
+    np.testing.assert_allclose(model.N.to_numpy(), 6 * N.to_numpy())
+
+    # IO data spec changes rebuild everything
+    stages_run.clear()
+    assert model.rebuild({**model.specs, "IOYear": 2017}) == list(build_stages.build_stages)
+    assert not model.is_materialized("L")
@@ -0,0 +1,87 @@
+from context import calculation_functions, utility_functions
+from synthetic import SECTORS, FLOWS, INDICATORS, make_matrix, make_vector, make_synthetic_model
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_perspective_column_scaling():
+    B = make_matrix(FLOWS, SECTORS, 0.3, 0)
+    D = make_matrix(INDICATORS, SECTORS, 0.9, 1)
+    s = make_vector(B, 1.0, 2)
+    y = make_vector(B, 0.05, 3)
+    cases = [
+        (calculation_functions.calculate_direct_perspective_LCI, B, s),
+        (calculation_functions.calculate_final_perspective_LCI, B, y),
+        (calculation_functions.calculate_direct_perspective_LCIA, D, s),
+        (calculation_functions.calculate_final_perspective_LCIA, D, y),
+    ]
+    for func, X, v in cases:
+        # t(X %*% diag(v))
+        expected = pd.DataFrame(np.transpose(X.to_numpy() @ np.diag(v.iloc[:, 0])), index=v.index, columns=X.index)
+        pd.testing.assert_frame_equal(func(X, v), expected)
+        pd.testing.assert_frame_equal(func(X, v, nonzero_only = True), expected.loc[v.iloc[:, 0] != 0])
+
+
+def merge_groupby_rows(matrix, crosswalk, to_code):
+    '''Remove the location from the row codes, merge with the crosswalk and sum by the to-level code, as useeior does'''
+    df = matrix.copy()
+    df.insert(0, "USEEIO", df.index.str.replace("/.*", "", regex = True))
+    df = pd.merge(df, crosswalk[["USEEIO", to_code]].drop_duplicates(), on = "USEEIO")
+    return(df.groupby(to_code)[list(matrix.columns)].sum())
+
+
+def get_summary_crosswalk():
+    crosswalk = utility_functions.get_named_dataset('useeio_py.data', "MasterCrosswalk2012.parquet")
+    crosswalk = crosswalk.rename(columns = lambda x: x.replace("_2012", "").replace("_Code", ""))
+    crosswalk["USEEIO"] = crosswalk["BEA_Detail"]
+    return(crosswalk)
+
+
+@pytest.mark.parametrize("locations", [["US"], ["US-GA", "RoUS"]], ids = ["national", "two-region"])
+def test_aggregate_result_matrix(locations):
+    crosswalk = get_summary_crosswalk()
+    codes = [f"{code}/{location}" for location in locations for code in crosswalk["USEEIO"].dropna().unique()]
+    matrix = make_matrix(len(codes), len(codes), 0.05, 10)
+    matrix.index = codes
+    matrix.columns = codes
+
+    rows = merge_groupby_rows(matrix, crosswalk, "BEA_Summary")
+    by_row = calculation_functions.aggregate_result_matrix_by_row(matrix, "Summary", crosswalk)
+    pd.testing.assert_frame_equal(by_row, rows, check_names = False)
+    # All regions of a sector are summed into the bare BEA code
+    assert by_row.index.is_unique and "111CA" in by_row.index and not by_row.index.str.contains("/").any()
+
+    expected = merge_groupby_rows(rows.T, crosswalk, "BEA_Summary").T
+    result = calculation_functions.aggregate_result_matrix(matrix, "Summary", crosswalk)
+    pd.testing.assert_frame_equal(result, expected, check_names = False)
+    np.testing.assert_allclose(result.to_numpy().sum(), matrix.to_numpy().sum())
+    assert utility_functions.get_crosswalk_index(crosswalk, "USEEIO", "BEA_Summary") is \
+        utility_functions.get_crosswalk_index(crosswalk, "USEEIO", "BEA_Summary")
+
+
+@pytest.mark.parametrize("use_domestic_requirements", [False, True], ids = ["complete", "domestic"])
+@pytest.mark.parametrize("perspective", ["DIRECT", "FINAL", "BOTH"])
+def test_calculate_EEIO_model_batch(perspective, use_domestic_requirements):
+    model = make_synthetic_model(40, seed = 27)
+    rng = np.random.default_rng(27)
+    sectors = model.A.index
+    demands = {f"demand{i}": pd.DataFrame({"demand": rng.random(10)}, index=sectors[rng.choice(40, 10, replace = False)])
+               for i in range(5)}
+    totals = calculation_functions.calculate_EEIO_model_batch(model, perspective, demands, use_domestic_requirements)
+    detail = calculation_functions.calculate_EEIO_model_batch(model, perspective, demands, use_domestic_requirements,
+                                                              detail = True)
+    keys = {"DIRECT": ["LCI_d", "LCIA_d"], "FINAL": ["LCI_f", "LCIA_f"], "BOTH": ["LCI_d", "LCIA_d", "LCI_f", "LCIA_f"]}
+    assert sorted(totals) == sorted(detail) == sorted(keys[perspective])
+    for name, demand in demands.items():
+        expected = calculation_functions.calculate_EEIO_model(model, perspective, demand, use_domestic_requirements)
+        for key, result in expected.items():
+            np.testing.assert_allclose(detail[key].loc[name].to_numpy(), result.to_numpy(), atol = 1e-12)
+            assert list(detail[key].loc[name].index) == list(result.index)
+            assert list(detail[key].columns) == list(result.columns)
+            np.testing.assert_allclose(totals[key].loc[name].to_numpy(), result.sum().to_numpy(), atol = 1e-12)
+
+    # Results by sector larger than max_detail_bytes are refused
+    with pytest.raises(SystemExit):
+        calculation_functions.calculate_EEIO_model_batch(model, perspective, demands, use_domestic_requirements,
+                                                         detail = True, max_detail_bytes = 1000)
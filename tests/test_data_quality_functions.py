@@ -0,0 +1,48 @@
+from context import data_quality_functions
+from synthetic import SECTORS, make_tbs
+import datetime
+import numpy as np
+import pandas as pd
+
+
+def loop_dq_bound_score(raw_score, dqi, scoring_bounds):
+    '''Compare a single raw score with the bounds one at a time'''
+    if np.isnan(raw_score):
+        return(np.nan)
+    for i in range(4):
+        if dqi in scoring_bounds["lower"] and raw_score >= scoring_bounds[dqi][i]:
+            return(i + 1)
+        if dqi in scoring_bounds["upper"] and raw_score <= scoring_bounds[dqi][i]:
+            return(i + 1)
+    return(5)
+
+
+def test_lookup_dq_bound_score():
+    bounds = data_quality_functions.set_dq_scoring_bounds()
+    rng = np.random.default_rng(16)
+    ages = np.append(rng.integers(-2, 30, 1000).astype(float), [np.nan, 3, 6, 10, 15, 16])
+    shares = np.append(rng.random(1000), [np.nan, 0.8, 0.6, 0.4, 0, -0.1])
+    for dqi, raw in (("TemporalCorrelation", ages), ("DataCollection", shares)):
+        expected = [loop_dq_bound_score(value, dqi, bounds) for value in raw]
+        np.testing.assert_array_equal(data_quality_functions.lookup_dq_bound_score(raw, dqi, bounds), expected)
+    assert data_quality_functions.lookup_dq_bound_score(7, "TemporalCorrelation", bounds) == 3
+    assert data_quality_functions.lookup_dq_bound_score(np.nan, "DataCollection", bounds) is None
+    assert data_quality_functions.score_temporal_dq(2010, bounds, target_year = 2020) == 3
+
+
+def test_score_contextual_dq():
+    bounds = data_quality_functions.set_dq_scoring_bounds()
+    rng = np.random.default_rng(16)
+    tbs = make_tbs(20000, [f"{i:06d}" for i in range(SECTORS)], 16)
+    tbs["Year"] = rng.choice([2012, 2014, 2016, 2017], len(tbs))
+    tbs.loc[::1000, "Year"] = np.nan
+    # Rows without a year are scored NA, as in useeior
+    scores = {year: loop_dq_bound_score(2020 - year, "TemporalCorrelation", bounds) for year in [2012, 2014, 2016, 2017]}
+    tbs = tbs.assign(Year = tbs["Year"] + (datetime.date.today().year - 2020))
+    original = tbs.copy()
+    scored = data_quality_functions.score_contextual_dq(tbs)
+    expected = (tbs["Year"] - (datetime.date.today().year - 2020)).map(scores)
+    np.testing.assert_array_equal(scored["TemporalCorrelation"].to_numpy(), expected.to_numpy())
+    assert scored["TemporalCorrelation"].isna().sum() == tbs["Year"].isna().sum()
+    # The table passed in is not changed
+    pd.testing.assert_frame_equal(tbs, original)
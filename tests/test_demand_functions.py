@@ -0,0 +1,35 @@
+from context import demand_functions, USEEIOModel
+from synthetic import SECTORS
+import numpy as np
+import pandas as pd
+
+
+def test_format_demand_vector():
+    codes = [f"{i:06d}/US" for i in range(SECTORS)]
+    L = pd.DataFrame(np.identity(SECTORS), index=codes, columns=codes)
+    dv = pd.DataFrame({"demand": [1.0, np.nan, 3.0]}, index=[codes[7], codes[3], codes[100]])
+    assert demand_functions.is_demand_vector_valid(dv, L)
+    assert not demand_functions.is_demand_vector_valid(pd.DataFrame({"demand": [1.0]}, index=["missing"]), L)
+    d = demand_functions.format_demand_vector(dv.copy(), L)
+    assert d.shape == (SECTORS, 1) and d.iloc[7, 0] == 1.0 and d.iloc[100, 0] == 3.0 and d[0].sum() == 4.0
+
+
+def test_format_demand_vector_with_model_code_index():
+    codes = [f"{i:06d}/US" for i in range(SECTORS)]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.specs = {"CommodityorIndustryType": "Commodity"}
+    model.Commodities = pd.DataFrame({"Code": [c[:6] for c in codes], "Code_Loc": codes})
+    L = pd.DataFrame(np.identity(SECTORS), index=codes, columns=codes)
+    dv = pd.DataFrame({"demand": [1.0, 2.0]}, index=[codes[9], codes[4]])
+    assert demand_functions.is_demand_vector_valid(dv, L, model)
+    d = demand_functions.format_demand_vector(dv, L, model)
+    assert d.iloc[9, 0] == 1.0 and d.iloc[4, 0] == 2.0 and d[0].sum() == 3.0
+    # The lookups use the code index kept on the model
+    assert "Commodities" in model._code_indices
+    assert not demand_functions.is_demand_vector_valid(pd.DataFrame({"demand": [1.0]}, index=["missing"]), L, model)
+
+    # L of the same size in another order is looked up by its own index
+    reordered = L.iloc[::-1, ::-1]
+    assert not model.is_code_index_of("Commodities", reordered.index)
+    d = demand_functions.format_demand_vector(dv, reordered, model)
+    assert d.iloc[SECTORS - 10, 0] == 1.0 and d.iloc[SECTORS - 5, 0] == 2.0 and d[0].sum() == 3.0
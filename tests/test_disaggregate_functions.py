@@ -0,0 +1,21 @@
+from context import USEEIOModel
+from useeio_py import disaggregate_functions
+import numpy as np
+import pandas as pd
+
+
+def test_disaggregate_multi_year_output(monkeypatch):
+    codes = [f"{i:06d}/US" for i in range(10)]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.Commodities = pd.DataFrame({"Code": [c[:6] for c in codes], "Code_Loc": codes})
+    model.MultiYearCommodityOutput = pd.DataFrame({"2012": np.arange(10.0), "2013": np.arange(10.0) * 2}, index=codes)
+    disagg = {"OriginalSectorCode": codes[4], "DisaggregatedSectorCodes": ["A/US", "B/US"]}
+    monkeypatch.setattr(disaggregate_functions, "disaggregated_ratios", lambda model, disagg, output_type: [0.25, 0.75])
+
+    output = disaggregate_functions.disaggregate_multi_year_output(model, disagg)
+    assert list(output.index) == codes[:4] + ["A/US", "B/US"] + codes[5:]
+    np.testing.assert_allclose(output.loc[["A/US", "B/US"], "2013"], [2.0, 6.0])
+    # The position of the original sector may be looked up before the sector lists are disaggregated
+    model.Commodities = model.Commodities.iloc[5:]
+    pd.testing.assert_frame_equal(disaggregate_functions.disaggregate_multi_year_output(model, disagg, original_position = 4),
+                                  output)
@@ -0,0 +1,60 @@
+from context import flowsa_functions, satellite_functions, USEEIOModel
+from synthetic import SECTORS, make_tbs
+import os
+import numpy as np
+import pandas as pd
+
+
+def ifelse_collapse(fbs):
+    '''Chained ifelse passes over the sector columns, as in useeior'''
+    fbs = fbs.copy()
+    spb, scb, flow_type = fbs['SectorProducedBy'], fbs['SectorConsumedBy'], fbs['FlowType']
+    fbs['Sector'] = None
+    fbs['Sector'] = np.where(flow_type == 'TECHNOSPHERE_FLOW', scb, fbs['Sector'])
+    fbs['Sector'] = np.where(flow_type == 'WASTE_FLOW', spb, fbs['Sector'])
+    fbs['Sector'] = np.where((flow_type == 'WASTE_FLOW') & spb.isna(), scb, fbs['Sector'])
+    fbs['Sector'] = np.where((flow_type == 'ELEMENTARY_FLOW') & spb.isna(), scb, fbs['Sector'])
+    fbs['Sector'] = np.where((flow_type == 'ELEMENTARY_FLOW') & scb.isna(), spb, fbs['Sector'])
+    fbs['Sector'] = np.where((flow_type == 'ELEMENTARY_FLOW') & scb.isin(['F010', 'F0100', 'F01000'])
+                             & spb.isin(['22', '221', '2213', '22131', '221310']), scb, fbs['Sector'])
+    return(fbs.drop(columns = ['SectorProducedBy', 'SectorConsumedBy']))
+
+
+def test_flow_by_sector_batches(tmp_path):
+    codes = [f"{i:06d}" for i in range(0, SECTORS, 7)] + ["F01000"]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.specs = {"BaseIOLevel": "Detail"}
+    model.Industries = pd.DataFrame({"Code": codes, "Name": codes})
+    rows = 20000
+    rng = np.random.default_rng(14)
+    fbs = make_tbs(rows, codes, 14).drop(columns = ["Sector"])
+    sectors = np.array(codes + ["221310", None], dtype = object)
+    fbs["SectorProducedBy"] = sectors[rng.integers(0, len(sectors), rows)]
+    fbs["SectorConsumedBy"] = sectors[rng.integers(0, len(sectors), rows)]
+    fbs["FlowType"] = rng.choice(["ELEMENTARY_FLOW", "WASTE_FLOW", "TECHNOSPHERE_FLOW"], rows)
+    fbs["Comments"] = "not needed for satellite tables"
+    file = os.path.join(tmp_path, "fbs.parquet")
+    fbs.to_parquet(file, row_group_size = 2000)
+
+    expected = ifelse_collapse(fbs)
+    collapsed = flowsa_functions.collapse_sector_columns(fbs)
+    assert (collapsed["Sector"].fillna("NA") == expected["Sector"].fillna("NA")).all()
+
+    # Batches hold only the projected columns and the requested flow types
+    batches = list(flowsa_functions.read_flow_by_sector_batches(file, flowsa_functions.acceptable_flow_types,
+                                                                batch_size = 3000))
+    assert max(len(batch) for batch in batches) <= 3000 and "Comments" not in batches[0].columns
+    streamed = pd.concat(batches, ignore_index = True)
+    kept = expected[expected["FlowType"].isin(flowsa_functions.acceptable_flow_types)].reset_index(drop = True)
+    assert len(streamed) == len(kept)
+    assert (streamed["Sector"].fillna("NA") == kept["Sector"].fillna("NA")).all()
+
+    # Collapsing batch by batch gives the same totals as collapsing the whole table
+    tbs = kept[kept["Sector"].notna()]
+    whole = satellite_functions.collapse_tbs(tbs, model)
+    batched = satellite_functions.collapse_tbs_batches((tbs.iloc[i:i + 3000] for i in range(0, len(tbs), 3000)),
+                                                       model, max_rows = 500)
+    assert len(batched) == len(whole)
+    value_fields = ["FlowAmount", "Min", "Max", "DataReliability", "TechnologicalCorrelation"]
+    np.testing.assert_allclose(batched[value_fields].to_numpy(), whole[value_fields].to_numpy())
+    assert (batched["MetaSources"].to_numpy() == whole["MetaSources"].to_numpy()).all()
@@ -0,0 +1,86 @@
+from context import io_functions, utility_functions
+from synthetic import SECTORS, FLOWS, make_matrix, make_make_model
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("sparse", [False, True], ids = ["dense", "sparse"])
+def test_leontief_solver(sparse):
+    rng = np.random.default_rng(24)
+    A = make_matrix(SECTORS, SECTORS, 0.05, 25)
+    A = A / (A.sum().max() * 1.5)
+    A.index = A.columns
+    B = make_matrix(FLOWS, SECTORS, 0.3, 26)
+    y = rng.random((SECTORS, 10))
+    L = np.linalg.inv(np.identity(SECTORS) - A.to_numpy())
+    solver = io_functions.LeontiefSolver(utility_functions.to_sparse_matrix(A) if sparse else A)
+    assert solver.sparse == sparse
+    np.testing.assert_allclose(solver.solve(y), L @ y)
+    s = solver.solve(pd.DataFrame(y[:, :1], index=A.index, columns=["demand"]))
+    assert list(s.index) == list(A.index) and list(s.columns) == ["demand"]
+    np.testing.assert_allclose(s.to_numpy(), L @ y[:, :1])
+    M = solver.left_multiply(utility_functions.to_sparse_matrix(B) if sparse else B)
+    assert list(M.index) == list(B.index) and list(M.columns) == list(A.columns)
+    np.testing.assert_allclose(M.to_numpy(), B.to_numpy() @ L, atol=1e-12)
+    np.testing.assert_allclose(solver.inverse().to_numpy(), L, atol=1e-12)
+    assert solver.inverse() is solver.inverse()
+    np.testing.assert_allclose(io_functions.calculate_leontif_inverse(A).to_numpy(), L, atol=1e-12)
+
+
+def test_sparse_backend():
+    rng = np.random.default_rng(4)
+    A = make_matrix(SECTORS, SECTORS, 0.05, 5)
+    A = A / (A.sum().max() * 1.5)
+    A.index = A.columns
+    B = make_matrix(FLOWS, SECTORS, 0.3, 6)
+    y = rng.random((SECTORS, 10))
+    dense = io_functions.LeontiefSolver(A)
+    sparse = io_functions.LeontiefSolver(utility_functions.to_sparse_matrix(A))
+    assert sparse.sparse
+    np.testing.assert_allclose(sparse.solve(y), dense.solve(y))
+    np.testing.assert_allclose(sparse.left_multiply(utility_functions.to_sparse_matrix(B)).to_numpy(),
+                               dense.left_multiply(B).to_numpy())
+
+
+def test_normalize_io_transactions():
+    Z = make_matrix(SECTORS, SECTORS, 0.3, 7)
+    x = pd.Series(Z.sum().to_numpy() + 1, index=Z.columns)
+    expected = np.matmul(Z.to_numpy(), np.linalg.inv(np.diag(x)))
+    A = io_functions.normalize_io_transactions(Z, x)
+    pd.testing.assert_frame_equal(A, pd.DataFrame(expected, index=Z.index, columns=Z.columns))
+    A_sparse = io_functions.normalize_io_transactions(Z, x, sparse = True)
+    assert utility_functions.is_sparse_matrix(A_sparse)
+    np.testing.assert_allclose(utility_functions.to_dense_matrix(A_sparse).to_numpy(), expected)
+
+    # Zero output is replaced with 1E-3 by default, as in useeior
+    x.iloc[0] = 0
+    np.testing.assert_allclose(io_functions.normalize_io_transactions(Z, x).iloc[:, 0], Z.iloc[:, 0] / 1E-3)
+    assert (io_functions.normalize_io_transactions(Z, x, zero_output = "zero").iloc[:, 0] == 0).all()
+    assert io_functions.normalize_io_transactions(Z, x, zero_output = "nan").iloc[:, 0].isna().all()
+    with pytest.raises(SystemExit):
+        io_functions.normalize_io_transactions(Z, x, zero_output = "error")
+
+
+def test_derived_matrix_cache():
+    model = make_make_model(range(2012, 2023))
+    mix = io_functions.generate_commodity_mix_matrix(model)
+    assert io_functions.generate_commodity_mix_matrix(model) is mix
+    # Replacing a source table regenerates the derived matrix
+    model.MakeTransactions = model.MakeTransactions * 2
+    model.IndustryOutput = model.IndustryOutput * 2
+    regenerated = io_functions.generate_commodity_mix_matrix(model)
+    assert regenerated is not mix
+    np.testing.assert_allclose(regenerated, mix)
+
+
+def test_multi_year_transforms():
+    years = range(2002, 2023)
+    model = make_make_model(years)
+    output = pd.DataFrame(index=model.MakeTransactions.columns)
+    cpi = pd.DataFrame(index=model.MakeTransactions.columns)
+    for year in years:
+        output[str(year)] = io_functions.transform_industry_output_to_commodity_output_for_year(year, model)
+        cpi[str(year)] = io_functions.transform_industry_cpi_to_commodity_cpi_for_year(year, model)
+    pd.testing.assert_frame_equal(io_functions.transform_industry_output_to_commodity_output_for_years(years, model), output)
+    pd.testing.assert_frame_equal(io_functions.transform_industry_cpi_to_commodity_cpi_for_years(years, model), cpi)
@@ -0,0 +1,103 @@
+from context import flowsa_functions, load_satellites, satellite_functions, utility_functions, USEEIOModel
+from synthetic import SECTORS, make_tbs
+import os
+import numpy as np
+import pandas as pd
+
+
+def build_synthetic_satellite(sat_spec, model):
+    '''Satellite table build of synthetic totals by sector, picklable for worker processes'''
+    tbs = make_tbs(sat_spec["Rows"], list(model.Industries["Code"]), sat_spec["Seed"])
+    return(satellite_functions.collapse_tbs(tbs, model))
+
+
+def test_build_satellite_tables(monkeypatch, caplog):
+    codes = [f"{i:06d}" for i in range(SECTORS)]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.Industries = pd.DataFrame({"Code": codes, "Name": codes})
+    model.specs = {"BaseIOLevel": "Detail", "SatelliteTable": {
+        name: {"Abbreviation": name, "Rows": 5000, "Seed": seed}
+        for seed, name in enumerate(["WAT", "CHAIR", "GHG", "LAND", "MINE", "EMP"])}}
+
+    sequential = load_satellites.build_satellite_tables(model, build_synthetic_satellite, workers = 1)
+    assert list(sequential) == list(model.specs["SatelliteTable"])
+    assert set(model.get_build_timings()) == {f"satellite_{name}" for name in sequential}
+    for executor in ("process", "thread"):
+        built = load_satellites.build_satellite_tables(model, build_synthetic_satellite, workers = 3, executor = executor)
+        assert list(built) == list(sequential)
+        assert all(built[name].equals(sequential[name]) for name in built)
+
+    # Builds run in worker processes unless threads are asked for, and record the peak memory
+    # of each table: a table of ten times the rows takes more
+    model.specs["SatelliteTable"]["WAT"]["Rows"] = 50000
+    model._build_memory = {}
+    def no_threads(*args, **kwargs):
+        raise AssertionError("threads are opt-in")
+    monkeypatch.setattr(load_satellites.concurrent.futures, "ThreadPoolExecutor", no_threads)
+    load_satellites.build_satellite_tables(model, build_synthetic_satellite, workers = 3)
+    memory = model.get_build_memory()
+    assert set(memory) == {f"satellite_{name}" for name in sequential}
+    assert memory["satellite_WAT"] > 2 * max(memory[f"satellite_{name}"] for name in sequential if name != "WAT")
+    assert "satellite_WAT took" in caplog.text and "with peak memory" in caplog.text
+
+def test_streamed_flow_by_sector(tmp_path, monkeypatch):
+    crosswalk = utility_functions.get_named_dataset('useeio_py.data', "MasterCrosswalk2012.parquet")
+    crosswalk = crosswalk.rename(columns = lambda x: x.replace("_2012", "").replace("_Code", ""))
+    crosswalk = crosswalk[["NAICS", "BEA_Detail"]].dropna().drop_duplicates()
+    crosswalk["USEEIO"] = crosswalk["BEA_Detail"]
+    codes = list(crosswalk["USEEIO"].unique())
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.specs = {"BaseIOLevel": "Detail", "BaseIOSchema": 2012, "ModelRegionAcronyms": ["US"], "IODataSource": "BEA"}
+    model.crosswalk = crosswalk
+    model.Industries = pd.DataFrame({"Code": codes, "Name": codes})
+    rng = np.random.default_rng(17)
+    model.MultiYearIndustryOutput = pd.DataFrame({"2012": rng.random(len(codes)) * 1e6}, index = [f"{code}/US" for code in codes])
+
+    # A FlowBySector file of NAICS codes in many row groups
+    rows = 20000
+    naics = np.array(list(crosswalk["NAICS"].unique()) + [None], dtype = object)
+    fbs = make_tbs(rows, naics, 17).drop(columns = ["Sector"])
+    fbs["SectorProducedBy"] = naics[rng.integers(0, len(naics), rows)]
+    fbs["SectorConsumedBy"] = naics[rng.integers(0, len(naics), rows)]
+    fbs["FlowType"] = rng.choice(["ELEMENTARY_FLOW", "WASTE_FLOW", "TECHNOSPHERE_FLOW"], rows)
+    fbs["Location"] = "00000"
+    fbs["LocationSystem"] = "FIPS_2015"
+    file = os.path.join(tmp_path, "fbs.parquet")
+    fbs.to_parquet(file, row_group_size = 2000)
+    monkeypatch.setattr(flowsa_functions, "load_data_commons_file", lambda static_file: file)
+    sat_spec = {"FullName": "Synthetic", "Abbreviation": "SYN", "StaticSource": True, "StaticFile": "fbs.parquet",
+                "FileLocation": "DataCommons", "DataYears": [2012], "SectorListSource": "NAICS",
+                "OriginalFlowSource": "FEDEFLv1.0.6", "ScriptFunctionCall": "getFlowbySectorCollapsed"}
+    assert load_satellites.is_streamed_flow_by_sector(sat_spec)
+    assert not load_satellites.is_streamed_flow_by_sector({**sat_spec, "StaticSource": False})
+
+    # Mapping the whole file at once
+    tbs = satellite_functions.conform_tbs_to_standard_sat_table(flowsa_functions.get_flow_by_sector_collapsed(sat_spec))
+    expected = load_satellites.conform_tbs_to_io_schema(tbs, sat_spec, model)
+
+    # Streaming maps each batch, and the table is not mapped again when conformed to the model schema
+    mapped_rows = []
+    map_to_bea = satellite_functions.map_flow_totals_by_sector_and_location_from_naics_to_bea
+    def map_batch(tbs, year, model):
+        mapped_rows.append(len(tbs))
+        return(map_to_bea(tbs, year, model))
+    monkeypatch.setattr(satellite_functions, "map_flow_totals_by_sector_and_location_from_naics_to_bea", map_batch)
+    streamed = load_satellites.generate_bea_tbs_from_flow_by_sector(sat_spec, model, batch_size = 3000)
+    streamed = satellite_functions.conform_tbs_to_standard_sat_table(streamed)
+    streamed = load_satellites.conform_tbs_to_io_schema(streamed, sat_spec, model, streamed = True)
+    assert len(mapped_rows) > 1 and max(mapped_rows) <= 3000
+    keys = ["Flowable", "Context", "Sector", "Location"]
+    streamed, expected = [df.astype({key: object for key in keys}).sort_values(keys).reset_index(drop = True)
+                          for df in (streamed, expected)]
+    assert len(streamed) == len(expected)
+    for field in keys:
+        assert (streamed[field].fillna("NA").to_numpy() == expected[field].fillna("NA").to_numpy()).all()
+    value_fields = ["FlowAmount", "Min", "Max", "DataReliability", "TechnologicalCorrelation"]
+    np.testing.assert_allclose(streamed[value_fields].to_numpy(dtype = float), expected[value_fields].to_numpy(dtype = float))
+
+    # Satellite table builds take the streaming path
+    def whole_file(sat_spec):
+        raise AssertionError("static NAICS FlowBySector files are streamed")
+    monkeypatch.setitem(load_satellites.script_functions, "getFlowbySectorCollapsed", whole_file)
+    built, _ = load_satellites.build_satellite_table(sat_spec, model)
+    np.testing.assert_allclose(built["FlowAmount"].sum(), expected.loc[expected["Sector"].notna(), "FlowAmount"].sum())
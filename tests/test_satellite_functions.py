@@ -0,0 +1,87 @@
+from context import satellite_functions, utility_functions, USEEIOModel
+from synthetic import SECTORS, make_tbs
+import numpy as np
+import pandas as pd
+
+dq_fields = ["DataReliability", "TemporalCorrelation", "GeographicalCorrelation", "TechnologicalCorrelation", "DataCollection"]
+
+
+def test_collapse_tbs():
+    codes = [f"{i:06d}" for i in range(SECTORS)]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.specs = {"BaseIOLevel": "Detail"}
+    model.Industries = pd.DataFrame({"Code": codes, "Name": [f"Sector {code}" for code in codes]})
+    tbs = make_tbs(5000, codes[::7] + ["F01000"], 13)
+    keys = satellite_functions.tbs_key_fields
+
+    # Merge sector names, then sum amounts and take flow amount weighted means of the DQ scores per group
+    names = pd.concat([model.Industries.rename(columns = {"Code": "Sector", "Name": "SectorName"}),
+                       pd.DataFrame({"Sector": ["F01000"], "SectorName": ["Household"]})])
+    expected = pd.merge(tbs, names, on = "Sector", how = "left")
+    expected[dq_fields] = expected[dq_fields].fillna(5)
+    values = ["FlowAmount", "Min", "Max"] + dq_fields + ["MetaSources"]
+    expected = expected.groupby(keys)[values].apply(lambda g: pd.Series({
+        "FlowAmount": g["FlowAmount"].sum(), "Min": g["Min"].min(), "Max": g["Max"].max(),
+        **{f: np.average(g[f], weights = g["FlowAmount"]) for f in dq_fields},
+        "MetaSources": max(g["MetaSources"], key = len)})).reset_index()
+
+    tbs_agg = satellite_functions.collapse_tbs(tbs, model)
+    assert list(tbs_agg.columns) == keys + values
+    assert (tbs_agg.loc[tbs_agg["Sector"] == "F01000", "SectorName"] == "Household").all()
+    for field in keys + ["MetaSources"]:
+        assert (tbs_agg[field].astype(object).to_numpy() == expected[field].to_numpy()).all()
+    np.testing.assert_allclose(tbs_agg[values[:-1]].to_numpy(), expected[values[:-1]].to_numpy().astype(float))
+    # Already columnar tables give the same result
+    pd.testing.assert_frame_equal(satellite_functions.collapse_tbs(satellite_functions.to_columnar_tbs(tbs), model), tbs_agg)
+
+    # Aggregating to fewer sectors keeps all flows
+    model.crosswalk = pd.DataFrame({"BEA_Detail": codes, "USEEIO": [code[:4] for code in codes]})
+    sat_agg = satellite_functions.aggregate_satellite_table(tbs[tbs["Sector"] != "F01000"], "Detail", model)
+    assert sat_agg["Sector"].nunique() == len(set(code[:4] for code in codes[::7]))
+    np.testing.assert_allclose(sat_agg["FlowAmount"].sum(), tbs.loc[tbs["Sector"] != "F01000", "FlowAmount"].sum())
+
+
+def test_map_flow_totals_by_sector_and_location_from_naics_to_bea():
+    crosswalk = utility_functions.get_named_dataset('useeio_py.data', "MasterCrosswalk2012.parquet")
+    crosswalk = crosswalk.rename(columns = lambda x: x.replace("_2012", "").replace("_Code", ""))
+    crosswalk = crosswalk[["NAICS", "BEA_Detail"]].dropna().drop_duplicates()
+    crosswalk["USEEIO"] = crosswalk["BEA_Detail"]
+    codes = list(crosswalk["USEEIO"].unique())
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.specs = {"BaseIOLevel": "Detail", "BaseIOSchema": 2012}
+    model.crosswalk = crosswalk
+    model.Industries = pd.DataFrame({"Code": codes, "Name": codes})
+    rng = np.random.default_rng(15)
+    output_index = [f"{code}/{location}" for location in ["US", "GA"] for code in codes]
+    model.MultiYearIndustryOutput = pd.DataFrame({"2012": rng.random(len(output_index)) * 1e6}, index = output_index)
+    naics = np.array(list(crosswalk["NAICS"].unique()) + ["999999"], dtype = object)
+    tbs = make_tbs(20000, naics, 15)
+    tbs["Location"] = rng.choice(["US", "GA"], len(tbs))
+    tbs.loc[:9, "Sector"] = "999999"
+
+    # Merge with the crosswalk and the allocation table
+    naics_to_bea = crosswalk[["NAICS", "USEEIO"]].drop_duplicates()
+    duplicates = naics_to_bea.loc[naics_to_bea["NAICS"].duplicated(), "NAICS"].unique()
+    merged = pd.merge(tbs, naics_to_bea, left_on = "Sector", right_on = "NAICS", how = "left")
+    adjustment = merged["Sector"].isin(duplicates) & merged["USEEIO"].notna()
+    merged["USEEIO"] = merged["USEEIO"].fillna(merged["Sector"])
+    allocation = satellite_functions.get_naics_to_bea_allocation(2012, model)
+    merged = pd.merge(merged, allocation, left_on = ["Sector", "USEEIO", "Location"],
+                      right_on = ["NAICS_Code", "BEA_Code", "Location"], how = "left")
+    merged["FlowAmount"] = merged["FlowAmount"] * merged["allocation_factor"].fillna(1)
+    merged["TechnologicalCorrelation"] = merged["TechnologicalCorrelation"] + adjustment
+    merged["Sector"] = merged["USEEIO"]
+    expected = satellite_functions.collapse_tbs(merged[tbs.columns], model)
+
+    mapped = satellite_functions.map_flow_totals_by_sector_and_location_from_naics_to_bea(tbs, 2012, model)
+    assert (mapped["Sector"].astype(object).to_numpy() == expected["Sector"].to_numpy()).all()
+    value_fields = ["FlowAmount", "Min", "Max", "TechnologicalCorrelation", "DataReliability"]
+    np.testing.assert_allclose(mapped[value_fields].to_numpy(), expected[value_fields].to_numpy())
+    # Unmapped NAICS codes keep their code
+    assert "999999" in set(mapped["Sector"])
+
+    # The index is built once per year and location and rebuilt when the crosswalk is replaced
+    index = satellite_functions.get_naics_to_bea_allocation_index(model, 2012, "US")
+    assert satellite_functions.get_naics_to_bea_allocation_index(model, 2012, "US") is index
+    model.crosswalk = crosswalk.copy()
+    assert satellite_functions.get_naics_to_bea_allocation_index(model, 2012, "US") is not index
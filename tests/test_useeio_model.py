@@ -0,0 +1,45 @@
+from context import USEEIOModel, io_functions
+from synthetic import SECTORS, make_lazy_model
+import numpy as np
+import pandas as pd
+
+
+def test_code_index():
+    codes = [f"{i:06d}/US" for i in range(SECTORS)]
+    model = USEEIOModel.__new__(USEEIOModel)
+    model.Industries = pd.DataFrame({"Code": [c[:6] for c in codes], "Code_Loc": codes})
+    assert model.get_code_index("Industries") is model.get_code_index("Industries")
+    sectors = [codes[i] for i in range(5, SECTORS, 3)]
+    np.testing.assert_array_equal(model.get_code_positions("Industries", sectors), list(range(5, SECTORS, 3)))
+    # Replacing the list rebuilds its index
+    model.Industries = model.Industries.iloc[5:].reset_index(drop = True)
+    assert model.get_code_positions("Industries", [codes[5]])[0] == 0
+
+
+def test_lazy_model():
+    model = make_lazy_model()
+    assert model.get_matrix_dependencies("N", missing = True) == ["V_n", "U_n", "A", "M", "N"]
+    assert "SatelliteTables" in model.get_matrix_dependencies("N")
+    N = model.N
+    for matrix in ["M_d", "A_d", "U_d_n", "L", "Phi", "SatelliteTables", "TbS"]:
+        assert not model.is_materialized(matrix)
+    V_n = model.MakeTransactions / model.CommodityOutput
+    U_n = model.UseTransactions / model.IndustryOutput
+    A = U_n.to_numpy() @ V_n.to_numpy()
+    expected = model.C.to_numpy() @ model.B.to_numpy() @ np.linalg.inv(np.identity(SECTORS) - A)
+    np.testing.assert_allclose(N.to_numpy(), expected, atol = 1e-10)
+    assert list(N.index) == list(model.C.index) and list(N.columns) == list(model.MakeTransactions.columns)
+
+    # Replacing a component drops the matrices built from it, which are rebuilt on access
+    model.B = model.B * 2
+    assert not model.is_materialized("M") and not model.is_materialized("N") and model.is_materialized("A")
+    np.testing.assert_allclose(model.N.to_numpy(), 2 * expected, atol = 1e-10)
+    model.UseTransactions = model.UseTransactions * 1.1
+    assert model.get_matrix_dependencies("N", missing = True) == ["U_n", "A", "M", "N"]
+    assert "N" not in model.get_elements()
+    assert not np.allclose(model.N.to_numpy(), 2 * expected)
+    assert model.get_build_timings()["matrix_N"] >= 0
+
+    # Model matrices are not shared with the derived matrices cached on the model
+    model.V_n.iloc[0, 0] = 2.0
+    assert io_functions.generate_market_shares_from_make(model).iloc[0, 0] != 2.0
@@ -0,0 +1,160 @@
+from context import utility_functions
+from synthetic import SECTORS, make_matrix
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+
+def test_reference_data_cache():
+    cache = utility_functions.ReferenceDataCache(maxsize = 2)
+    loads = []
+    def loader(key):
+        return(lambda: loads.append(key) or pd.DataFrame({"Code": [key]}))
+
+    first = cache.get("a", loader("a"))
+    first.loc[0, "Code"] = "changed"
+    assert cache.get("a", loader("a")).loc[0, "Code"] == "a"
+    cache.get("b", loader("b"))
+    cache.get("a", loader("a"))
+    cache.get("c", loader("c"))   # evicts b, the least recently used table
+    cache.get("b", loader("b"))
+    assert loads == ["a", "b", "c", "b"]
+    assert cache.info() == {"hits": 2, "misses": 4, "evictions": 2, "size": 2, "maxsize": 2}
+
+    threads = [threading.Thread(target = lambda: [cache.get(k, loader(k)) for k in "bcbc" * 50]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    info = cache.info()
+    assert info["hits"] + info["misses"] == 6 + 8 * 200 and info["size"] == 2
+
+    # Threads that miss on the same table at the same time read it once
+    loads.clear()
+    def slow_loader():
+        time.sleep(0.05)
+        return(loader("d")())
+    threads = [threading.Thread(target = lambda: cache.get("d", slow_loader)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == ["d"]
+
+
+def test_get_named_dataset():
+    utility_functions.reference_data_cache.clear()
+    codes = utility_functions.get_vector_of_codes(2012, "Detail", "Commodity")
+    assert list(utility_functions.get_vector_of_codes(2012, "Detail", "Commodity")) == list(codes)
+    assert utility_functions.get_named_dataset_cache_info()["hits"] == 1
+
+    # List and dict arguments of read_csv() are part of the cache key
+    kwargs = {"usecols": ["Code", "Commodity"], "dtype": {"Code": str}, "na_values": ["", "NA"]}
+    schema = utility_functions.get_named_dataset('useeio_py.inst.extdata', "2012_Detail_Schema_Info.csv", **kwargs)
+    assert list(schema.columns) == ["Code", "Commodity"]
+    pd.testing.assert_frame_equal(
+        utility_functions.get_named_dataset('useeio_py.inst.extdata', "2012_Detail_Schema_Info.csv", **kwargs), schema)
+    assert utility_functions.get_named_dataset_cache_info()["hits"] == 2
+    other = utility_functions.get_named_dataset('useeio_py.inst.extdata', "2012_Detail_Schema_Info.csv", usecols = ["Code"])
+    assert list(other.columns) == ["Code"]
+    # Arguments that aren't hashable even so are read without the cache
+    usecols = np.array(["Code"])
+    utility_functions.get_named_dataset('useeio_py.inst.extdata', "2012_Detail_Schema_Info.csv", usecols = usecols)
+    assert utility_functions.get_named_dataset_cache_info()["misses"] == 3
+
+
+def test_ras():
+    rng = np.random.default_rng(11)
+    m0 = make_matrix(SECTORS, SECTORS, 0.1, 11).to_numpy() + np.identity(SECTORS)
+    target = m0 * rng.uniform(0.8, 1.2, size=m0.shape)
+    t_r, t_c = target.sum(axis=1), target.sum(axis=0)
+
+    m, metrics = utility_functions.ras(m0, t_r, t_c, 1e-10, return_metrics = True)
+    assert metrics["converged"] and metrics["stop_reason"] == "converged"
+    assert len(metrics["row_residuals"]) == metrics["iterations"] + 1
+    np.testing.assert_allclose(m.sum(axis=1), t_r, rtol=1e-8)
+    np.testing.assert_allclose(m.sum(axis=0), t_c, rtol=1e-8)
+
+    # Sparse backend frames stay sparse and give the same result
+    frame = pd.DataFrame(m0, index=[f"r{i}" for i in range(SECTORS)], columns=[f"c{i}" for i in range(SECTORS)])
+    balanced = utility_functions.ras(utility_functions.to_sparse_matrix(frame), t_r, t_c, 1e-10)
+    assert utility_functions.is_sparse_matrix(balanced)
+    np.testing.assert_allclose(balanced.sparse.to_dense().to_numpy(), m, rtol=1e-9)
+
+    # GRAS keeps the signs of negative entries
+    signed = m0.copy()
+    signed[rng.random(m0.shape) < 0.02] *= -1
+    signed_target = signed * rng.uniform(0.8, 1.2, size=m0.shape)
+    m, metrics = utility_functions.ras(signed, signed_target.sum(axis=1), signed_target.sum(axis=0), 1e-9,
+                                       return_metrics = True)
+    assert metrics["converged"] and (np.sign(m) == np.sign(signed)).all()
+    np.testing.assert_allclose(m.sum(axis=0), signed_target.sum(axis=0), rtol=1e-6, atol=1e-9)
+
+    # Infeasible targets stop on max_itr or time_budget instead of blocking
+    _, metrics = utility_functions.ras(m0, t_r * 2, t_c, 1e-12, max_itr = 50, return_metrics = True)
+    assert not metrics["converged"] and metrics["stop_reason"] == "max_itr" and metrics["iterations"] == 50
+    _, metrics = utility_functions.ras(m0, t_r * 2, t_c, 1e-12, time_budget = 0.05, return_metrics = True)
+    assert metrics["stop_reason"] == "time_budget"
+
+
+def test_ras_batch():
+    rng = np.random.default_rng(12)
+    years = 10
+    m0 = make_matrix(SECTORS, SECTORS, 0.1, 12).to_numpy() + np.identity(SECTORS)
+    stack = np.stack([m0 * (1 + 0.02 * year) for year in range(years)])
+    # Year-on-year changes share a trend plus some noise
+    targets = stack * rng.uniform(0.8, 1.2, size=m0.shape) * rng.uniform(0.999, 1.001, size=stack.shape)
+    t_rs, t_cs = targets.sum(axis=2), targets.sum(axis=1)
+
+    balanced, metrics = utility_functions.ras_batch(stack, t_rs, t_cs, 1e-10, return_metrics = True)
+    assert metrics["converged"].all() and metrics["failed"] == []
+    for year in range(years):
+        np.testing.assert_allclose(balanced[year], utility_functions.ras(stack[year], t_rs[year], t_cs[year], 1e-10), rtol=1e-6)
+    # Each year starts from the factors of the year before
+    r, s = None, None
+    for year in range(years):
+        r, s, year_metrics = utility_functions.ras_factors(stack[year], t_rs[year], t_cs[year], 1e-10, r = r, s = s)
+        assert metrics["iterations"][year] == year_metrics["iterations"]
+    _, cold = utility_functions.ras_batch(stack, t_rs, t_cs, 1e-10, warm_start = False, return_metrics = True)
+    assert metrics["iterations"][1:].sum() < cold["iterations"][1:].sum()
+
+    # A slice with inconsistent margins is reported instead of holding up the others
+    t_rs[3] *= 1.5
+    balanced, metrics = utility_functions.ras_batch(stack, t_rs, t_cs, 1e-10, max_itr = 200, return_metrics = True)
+    assert metrics["failed"] == [3] and metrics["stop_reason"] == "max_itr"
+    np.testing.assert_allclose(balanced[4].sum(axis=1), t_rs[4], rtol=1e-8)
+    t_rs[3] /= 1.5
+
+    frames = [pd.DataFrame(m) for m in stack[:2]]
+    assert isinstance(utility_functions.ras_batch(frames, t_rs[:2], t_cs[:2], 1e-10)[1], pd.DataFrame)
+
+    # Rebalancing after a small revision of the targets warm-starts from the previous factors
+    revised = t_cs * rng.uniform(0.999, 1.001, size=t_cs.shape)
+    revised *= (t_rs.sum(axis=1) / revised.sum(axis=1))[:, None]
+    _, cold = utility_functions.ras_batch(stack, t_rs, revised, 1e-10, warm_start = False, return_metrics = True)
+    _, warm = utility_functions.ras_batch(stack, t_rs, revised, 1e-10, r = metrics["r"], s = metrics["s"], return_metrics = True)
+    assert warm["converged"].all() and warm["iterations"].max() < cold["iterations"].max()
+
+
+def test_bin_matrix_store(tmp_path):
+    matrix = make_matrix(SECTORS, SECTORS, 0.3, 17)
+    path = os.path.join(tmp_path, "M.bin")
+    utility_functions.write_matrix_as_bin_file(matrix, path, block_bytes = 100000)
+    # Header of row and column counts, then the values in column-major order, as the API files have
+    with open(path, "rb") as f:
+        content = f.read()
+    assert content[:8] == int(SECTORS).to_bytes(4, "little") * 2
+    assert content[8:] == matrix.to_numpy().astype(np.float64).tobytes(order = "F")
+
+    M = utility_functions.read_matrix_from_bin_file(path)
+    assert isinstance(M, np.memmap) and M.shape == matrix.shape and not M.flags.writeable
+    np.testing.assert_array_equal(M[:, 7], matrix.iloc[:, 7].to_numpy())
+    np.testing.assert_array_equal(utility_functions.read_matrix_from_bin_file(path, mmap = False), matrix.to_numpy())
+
+    # Sparse backend matrices and vectors
+    utility_functions.write_matrix_as_bin_file(utility_functions.to_sparse_matrix(matrix), path)
+    np.testing.assert_array_equal(utility_functions.read_matrix_from_bin_file(path), matrix.to_numpy())
+    utility_functions.write_matrix_as_bin_file(matrix.iloc[:, 0], path)
+    assert utility_functions.read_matrix_from_bin_file(path).shape == (SECTORS, 1)
@@ -3,7 +3,8 @@
 import pandas as pd
 import numpy as np
 import logging
-from . import (load_io_tables, configuration_functions)
+import scipy.sparse
+from . import (load_io_tables, configuration_functions, utility_functions)
 import sys
 
 
@@ -27,10 +28,12 @@ def aggregate_model(model: "USEEIOModel"):
         model.DomesticUseTransactions = aggregate_use_table(model, aggSpec, domestic = True)
         logging.debug("calling func...")
         model.UseValueAdded = aggregate_va(model, aggSpec)
+        logging.debug("calling func...")
+        model.FinalDemand = aggregate_fd(model, aggSpec)
+        logging.debug("calling func...")
+        model.DomesticFinalDemand = aggregate_fd(model, aggSpec, domestic = True)
 
         ### These lines all marked as todo in R code...###
-        # model.FinalDemand = aggregate_fd(model, aggSpec) #TODO
-        # model.DomesticFinalDemand = aggregate_fd(model, aggSpec, domestic = True) #TODO
         # model.MarginSectors = aggregate_margin_sectors(model, aggSpec) #TODO
         # model.Margins = aggregate_margins(model, aggSpec) #TODO
 
@@ -41,33 +44,24 @@ def aggregate_model(model: "USEEIOModel"):
         # aggregating Crosswalk
         logging.debug("calling func...")
         model.crosswalk = aggregate_master_crosswalk(model, aggSpec)
-        # obtaining indices to aggregate sectors in remaining model objects
+
+        # aggregating (i.e. removing) sectors from model lists, and MultiYear CPI and output.
+        # CPI is weighted by the output of the aggregated sectors, so it is aggregated first.
         agg = aggSpec['Sectors']
-        logging.debug("calling func...")
-        mainComIndex = get_index(model.Commodities['Code_Loc'], agg[0]) # first item in Aggregation is the sector to aggregate to, not to be removed
-        logging.debug("calling func...")
-        mainIndIndex = get_index(model.Industries['Code_Loc'], agg[0])
-        comIndicesToAggregate_bool = model.Commodities['Code_Loc'].isin(agg[1:]) # find com indeces containing references to the sectors to be aggregated
-        indIndicesToAggregate_bool = model.Industries['Code_Loc'].isin(agg[1:]) # find ind indeces containing references to the sectors to be aggregated
-        indIndicesToAggregate = model.Industries.loc[indIndicesToAggregate_bool,"Code_Loc"]
-        comIndicesToAggregate = model.Commodities.loc[comIndicesToAggregate_bool,"Code_Loc"]
-
-        # aggregating (i.e. removing) sectors from model lists
-        # aggregate Industry lists
-        if(sum(indIndicesToAggregate_bool) > 0):
-            model.Industries = model.Industries.loc[~indIndicesToAggregate_bool]
+        indIndicesToAggregate = get_indices(model, "Industries", agg[1:])
+        comIndicesToAggregate = get_indices(model, "Commodities", agg[1:])
+        if len(indIndicesToAggregate) > 0:
+            model.Industries = remove_rows_by_position(model.Industries, indIndicesToAggregate)
             logging.debug("calling func...")
-            model.MultiYearIndustryCPI = aggregate_multi_year_cpi(model, mainIndIndex, indIndicesToAggregate, "Industry")
+            model.MultiYearIndustryCPI = aggregate_multi_year_cpi(model, aggSpec, "Industry")
             logging.debug("calling func...")
-            model.MultiYearIndustryOutput = aggregate_multi_year_output(model.MultiYearIndustryOutput, mainIndIndex, indIndicesToAggregate)
-        
-        # aggregate Commodity lists
-        if(sum(comIndicesToAggregate_bool) > 0):
-            model.Commodities = model.Commodities.loc[~comIndicesToAggregate_bool]
+            model.MultiYearIndustryOutput = aggregate_multi_year_output(model.MultiYearIndustryOutput, aggSpec)
+        if len(comIndicesToAggregate) > 0:
+            model.Commodities = remove_rows_by_position(model.Commodities, comIndicesToAggregate)
             logging.debug("calling func...")
-            model.MultiYearCommodityCPI = aggregate_multi_year_cpi(model, mainIndIndex, indIndicesToAggregate, "Commodity")
+            model.MultiYearCommodityCPI = aggregate_multi_year_cpi(model, aggSpec, "Commodity")
             logging.debug("calling func...")
-            model.MultiYearCommodityOutput = aggregate_multi_year_output(model.MultiYearIndustryOutput, mainComIndex, comIndicesToAggregate)
+            model.MultiYearCommodityOutput = aggregate_multi_year_output(model.MultiYearCommodityOutput, aggSpec)
             #model.ImportCosts = aggregate_import_costs(model.Commodities, comIndicesToAggregate) #TODO: marked as todo in useeior code
 
         logging.debug("calling func...")
@@ -108,13 +102,80 @@ def aggregate_sectors_in_tbs(model: "USEEIOModel", aggregation_specs: dict, sat_
     logging.debug("Function not implemented")
     sys.exit()
 
+def get_aggregation_matrix(codes, aggregation_specs: dict):
+    '''
+    Compile an aggregation spec into a sparse 0/1 aggregation matrix S for one axis of a table.
+    Sectors listed after the first in aggregation_specs['Sectors'] are added to the first sector
+    and removed; all other codes are kept in their original order.
+
+    Parameters
+    ----------
+    codes : Index
+        Sector codes (Code_Loc) along one axis of a table
+    aggregationSpecs : dict
+        Specifications for aggregation
+
+    Returns
+    -------
+    tuple
+        (S, kept_codes), where S is a scipy.sparse CSR matrix of shape (len(kept_codes), len(codes)),
+        or (None, codes) if none of the codes are aggregated.
+    '''
+    agg = aggregation_specs['Sectors']
+    codes = pd.Index(codes)
+    removed = np.asarray(codes.isin(agg[1:]))
+    if not removed.any():
+        return(None, codes)
+    kept_codes = codes[~removed]
+    rows = np.cumsum(~removed) - 1 # position of each kept code in kept_codes
+    cols = np.arange(len(codes))
+    main = kept_codes.get_indexer([agg[0]])[0]
+    if main == -1:
+        # No sector to aggregate to on this axis, aggregated sectors are only removed
+        rows, cols = rows[~removed], cols[~removed]
+    else:
+        rows[removed] = main
+    S = scipy.sparse.csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(kept_codes), len(codes)))
+    return(S, kept_codes)
+
+
+def aggregate_table(table: "DataFrame", aggregation_specs: dict):
+    '''
+    Aggregate the rows and columns of a table in one pass as S_r * table * t(S_c),
+    where S_r and S_c are the aggregation matrices of its index and columns.
+
+    Parameters
+    ----------
+    table : DataFrame
+        A table labeled by sector codes (Code_Loc) on one or both axes
+    aggregationSpecs : dict
+        Specifications for aggregation
+
+    Returns
+    -------
+    DataFrame
+        The aggregated table. Sparse backend tables stay sparse.
+    '''
+    S_r, index = get_aggregation_matrix(table.index, aggregation_specs)
+    S_c, columns = get_aggregation_matrix(table.columns, aggregation_specs)
+    if S_r is None and S_c is None:
+        return(table)
+    values = utility_functions.matrix_values(table)
+    if S_r is not None:
+        values = S_r @ values
+    if S_c is not None:
+        values = values @ S_c.T
+    if utility_functions.is_sparse_matrix(table):
+        return(utility_functions.to_sparse_matrix(values, index, columns))
+    return(pd.DataFrame(values, index=index, columns=columns))
+
+
 #DONE
-def aggregate_multi_year_cpi(model: "USEEIOModel", main_index:int, indices_to_aggregate:"Series", cpi_type:str):
+def aggregate_multi_year_cpi(model: "USEEIOModel", aggregation_specs: dict, cpi_type:str):
     '''
     #' Aggregate MultiYear CPI model objects
     #' @param model An EEIO model object with model specs and IO tables loaded.
-    #' @param mainIndex Index to aggregate the others to.
-    #' @param indecesToAggregate List of indeces to aggregate.
+    #' @param aggregationSpecs Specifications for aggregation
     #' @param type String to designate either commodity or industry
     #' @return newCPI A dataframe with the aggregatded CPI values by year.
     '''
@@ -125,17 +186,18 @@ def aggregate_multi_year_cpi(model: "USEEIOModel", main_index:int, indices_to_ag
     else:
         originalCPI = model.MultiYearCommodityCPI
         originalOutput = model.MultiYearCommodityOutput
-    
-    newCPI = originalCPI.copy(deep=True)
-    aggOutputs = originalOutput.iloc[main_index] + originalOutput.loc[indices_to_aggregate].sum(axis=0)
-
-    mainIndexOutputRatios = originalOutput.iloc[main_index] / aggOutputs
-    aggIndecesOutputRatios = originalOutput.loc[indices_to_aggregate]/aggOutputs
 
-    newCPI.iloc[main_index] = newCPI.iloc[main_index]*mainIndexOutputRatios + \
-        (newCPI.loc[indices_to_aggregate]*aggIndecesOutputRatios).sum(axis=0)
-    logging.debug("calling func...")
-    newCPI = remove_rows_from_list(newCPI, indices_to_aggregate)
+    S, codes = get_aggregation_matrix(originalCPI.index, aggregation_specs)
+    if S is None:
+        return(originalCPI)
+    newCPI = originalCPI.loc[codes].copy(deep=True)
+    main_index = codes.get_indexer([aggregation_specs['Sectors'][0]])[0]
+    if main_index != -1:
+        # Output-weighted average CPI of the main sector and the sectors aggregated into it
+        output = originalOutput.reindex(index=originalCPI.index, columns=originalCPI.columns).to_numpy(dtype=float)
+        weighted = S[main_index] @ (originalCPI.to_numpy(dtype=float) * output)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newCPI.iloc[main_index] = weighted / (S[main_index] @ output)
     return(newCPI)
 
 
@@ -157,16 +219,7 @@ def aggregate_make_table(model: "USEEIOModel", aggregation_specs: dict):
         An aggregated MakeTable.
     '''
     logging.debug("check")
-    agg = aggregation_specs['Sectors']
-    for sector in agg[1:]: # First sector in list is the one we are aggregating to, so skip
-        logging.debug("calling func...")
-        model.MakeTransactions = aggregate_sector(model, agg[0], sector, "Make")
-    
-    agg = agg[1:]
-    model.MakeTransactions = model.MakeTransactions.drop(agg, axis = 0, errors = "ignore")
-    model.MakeTransactions = model.MakeTransactions.drop(agg, axis = 1, errors = "ignore")
-
-    return(model.MakeTransactions)
+    return(aggregate_table(model.MakeTransactions, aggregation_specs))
 
 
 #DONE
@@ -180,6 +233,8 @@ def aggregate_use_table(model: "USEEIOModel", aggregation_specs, domestic = Fals
         An EEIO model object with model specs and IO tables loaded.
     aggregationSpecs : dict
         Specifications for aggregation
+    domestic : bool, default=False
+        Boolean to indicate whether to aggregate the UseTransactions or DomesticUseTransactions table 
     
     Returns
     -------
@@ -187,26 +242,8 @@ def aggregate_use_table(model: "USEEIOModel", aggregation_specs, domestic = Fals
         An aggregated UseTable.
     '''
     logging.debug("check")
-    agg = aggregation_specs['Sectors']
-    for sector in agg[1:]: # First sector in list is the one we are aggregating to, so skip
-        logging.debug("calling func...")
-        if domestic:
-            model.DomesticUseTransactions = aggregate_sector(model, agg[0], sector, "Use", domestic=domestic)
-        else:
-            model.UseTransactions = aggregate_sector(model, agg[0], sector, "Use", domestic=domestic)
-
-    agg = agg[1:]
-
-    if domestic:
-        model.DomesticUseTransactions = model.DomesticUseTransactions.drop(agg, axis = 0, errors = "ignore")
-        model.DomesticUseTransactions = model.DomesticUseTransactions.drop(agg, axis = 1, errors = "ignore")
-
-        return(model.DomesticUseTransactions)
-    else:
-        model.UseTransactions = model.UseTransactions.drop(agg, axis = 0, errors = "ignore")
-        model.UseTransactions = model.UseTransactions.drop(agg, axis = 1, errors = "ignore")
-
-        return(model.UseTransactions)
+    table = model.DomesticUseTransactions if domestic else model.UseTransactions
+    return(aggregate_table(table, aggregation_specs))
 
 #DONE
 def aggregate_va(model: "USEEIOModel", aggregation_specs):
@@ -226,109 +263,79 @@ def aggregate_va(model: "USEEIOModel", aggregation_specs):
         An aggregated UseValueAddedTable.
     '''
     logging.debug("check")
-    agg = aggregation_specs['Sectors']
-    for sector in agg[1:]: # First sector in list is the one we are aggregating to, so skip
-        logging.debug("calling func...")
-        model.UseValueAdded = aggregate_sector(model, agg[0], sector, "VA")
-
-    agg = agg[1:]
-    
-    model.UseValueAdded = model.UseValueAdded.drop(agg, axis = 0, errors = "ignore")
-    model.UseValueAdded = model.UseValueAdded.drop(agg, axis = 1, errors = "ignore")
-
-    return(model.UseValueAdded)
+    return(aggregate_table(model.UseValueAdded, aggregation_specs))
 
-#DONE
-def aggregate_sector(model: "USEEIOModel", main_sector:str, sector_to_remove:str, table_type:str, domestic:bool = False):
+def aggregate_fd(model: "USEEIOModel", aggregation_specs, domestic = False):
     '''
-    Aggregate a sector in a table
+    Aggregate the FinalDemand based on specified source file.
 
     Parameters
     ----------
     model : USEEIOModel
-        An EEIO model object with model specs and IO tables loaded
-    main_sector : str
-        Sector to aggregate to
-    sector_to_remove : str
-        Sector to be aggregated into mainSector, then removed from table
-    table_type : {'Use', 'Make', 'VA'}
-        String to designate either Make, Use, or Value Added table
+        An EEIO model object with model specs and IO tables loaded.
+    aggregationSpecs : dict
+        Specifications for aggregation
     domestic : bool, default=False
-        Boolean to indicate whether to aggregate the UseTransactions or DomesticUseTransactions table 
+        Boolean to indicate whether to aggregate the FinalDemand or DomesticFinalDemand table 
     
     Returns
     -------
-    type
-        aggregated table 
+    DataFrame
+        An aggregated FinalDemand table.
     '''
     logging.debug("check")
-    if table_type == "Use":
-        logging.debug("calling func...")
-        mainRowIndex = get_index(model.Commodities['Code_Loc'], main_sector)
-        logging.debug("calling func...")
-        mainColIndex = get_index(model.Industries['Code_Loc'], main_sector)
-
-        logging.debug("calling func...")
-        removeRowIndex = get_index(model.Commodities['Code_Loc'], sector_to_remove)
-        logging.debug("calling func...")
-        removeColIndex = get_index(model.Industries['Code_Loc'], sector_to_remove)
-        table = model.DomesticUseTransactions if domestic else model.UseTransactions
-    elif table_type == "Make":
-        logging.debug("calling func...")
-        mainRowIndex = get_index(model.Industries['Code_Loc'], main_sector)
-        logging.debug("calling func...")
-        mainColIndex = get_index(model.Commodities['Code_Loc'], main_sector)
-        logging.debug("calling func...")
-        removeRowIndex = get_index(model.Industries['Code_Loc'], sector_to_remove)
-        logging.debug("calling func...")
-        removeColIndex = get_index(model.Commodities['Code_Loc'], sector_to_remove)
-        table = model.MakeTransactions
-    elif table_type == "VA":
-        logging.debug("calling func...")
-        mainRowIndex = get_index(model.ValueAddedMeta['Code_Loc'], main_sector)
-        logging.debug("calling func...")
-        mainColIndex = get_index(model.Industries['Code_Loc'], main_sector)
-        logging.debug("calling func...")
-        removeRowIndex = get_index(model.ValueAddedMeta['Code_Loc'], sector_to_remove)
-        logging.debug("calling func...")
-        removeColIndex = get_index(model.Industries['Code_Loc'], sector_to_remove)
-        table = model.UseValueAdded
-    else:
-        sys.exit("Invalid table_type")
-
-    if(removeRowIndex != -1 and mainRowIndex != -1): # If there is a row to remove and merge with main sector
-        table.iloc[mainRowIndex,:] = table.iloc[mainRowIndex,:] + table.iloc[removeRowIndex,:] # add rows together
-        table.iloc[removeRowIndex,:] = 0
-    
-    if(removeColIndex != -1 and mainColIndex != -1): # If there is a row to remove and merge with main sector
-        table.iloc[:,mainColIndex] = table.iloc[:,mainColIndex] + table.iloc[:,removeColIndex] # add rows together
-        table.iloc[:,removeColIndex] = 0
-
-    return(table)
+    table = model.DomesticFinalDemand if domestic else model.FinalDemand
+    return(aggregate_table(table, aggregation_specs))
 
 #DONE
-def get_index(sector_list:pd.DataFrame, sector:str):
+def get_index(model: "USEEIOModel", list_type:str, sector:str):
     '''
-    Return the index where a sector occurrs in a sectorList
+    Return the index where a sector occurrs in a model sector list
 
     Parameters
     ----------
-    sector_list : pandas.DataFrame
-        Dataframe (of strings) to match the index of the sector param
+    model : USEEIOModel
+        An EEIO model object with model specs and IO tables loaded
+    list_type : {'Commodities', 'Industries', 'ValueAddedMeta', 'FinalDemandMeta'}
+        Name of the model list to look the sector up in
     sector : str
         String of the sector to look the index for
     
     Returns
     -------
     int
-        Index of sector in sectorList
+        Index of sector in the list, -1 if it is not in the list
     '''
-    logging.debug("check")
-    try:
-        index = list(sector_list).index(sector)
-    except:
-        index = -1
-    return(index)
+    return(int(model.get_code_positions(list_type, [sector])[0]))
+
+def get_indices(model: "USEEIOModel", list_type:str, sectors:list):
+    '''
+    Return the indices where sectors occur in a model sector list, skipping sectors not in the list
+
+    Parameters
+    ----------
+    model : USEEIOModel
+        An EEIO model object with model specs and IO tables loaded
+    list_type : {'Commodities', 'Industries', 'ValueAddedMeta', 'FinalDemandMeta'}
+        Name of the model list to look the sectors up in
+    sectors : list
+        Sectors to look the indices for
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the sectors in the list
+    '''
+    positions = model.get_code_positions(list_type, sectors)
+    return(positions[positions != -1])
+
+def remove_rows_by_position(sector_list: "DataFrame", positions):
+    '''
+    Remove the rows at the given positions from a model sector list
+    '''
+    keep = np.ones(len(sector_list), dtype=bool)
+    keep[positions] = False
+    return(sector_list.iloc[keep])
 
 
 def aggregate_master_crosswalk(model: "USEEIOModel", aggregation_specs: dict):
@@ -361,16 +368,12 @@ def remove_rows_from_list(sector_list: "DataFrame", indices_to_aggregate: "Index
     logging.debug("check")
     return(sector_list.drop(indices_to_aggregate, errors = "ignore"))
 
-def aggregate_multi_year_output(original_output:"DataFrame", main_index, indices_to_aggregate):
+def aggregate_multi_year_output(original_output:"DataFrame", aggregation_specs: dict):
     '''
     #' Aggregate MultiYear Output model objects
     #' @param originalOutput MultiYear Output dataframe
-    #' @param mainIndex Index to aggregate the others to.
-    #' @param indecesToAggregate List of indeces to aggregate.
-    #' @return model A dataframe with the disaggregated GDPGrossOutputIO by year.
+    #' @param aggregationSpecs Specifications for aggregation
+    #' @return model A dataframe with the aggregated GDPGrossOutputIO by year.
     '''
     logging.debug("check")
-    new_output = original_output.copy(deep=True)
-    new_output.iloc[main_index] = original_output.iloc[main_index] + original_output.loc[indices_to_aggregate].sum(axis=0)
-    new_output = new_output.drop(indices_to_aggregate, axis=0, errors="ignore")
-    return(new_output)
\ No newline at end of file
+    return(aggregate_table(original_output, aggregation_specs))
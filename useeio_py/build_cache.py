@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+Persistent on-disk cache of fully constructed models
+'''
+import hashlib
+import importlib.resources
+import json
+import logging
+import os
+import pickle
+import time
+from .configuration_functions import get_configuration
+
+# Bump when the layout of cached models changes so that older entries are not loaded
+CACHE_FORMAT_VERSION = 2
+# Packaged data whose files make up the data version of a build
+data_packages = ['useeio_py.data', 'useeio_py.data2', 'useeio_py.inst.extdata']
+# Spec entries naming additional configuration files, and their configuration types
+spec_files = {"AggregationSpecs": "agg", "DisaggregationSpecs": "disagg", "HybridizationSpecs": "hybridization"}
+# Model attributes that only live for the current process and are not cached
+transient_attributes = ["_leontief_solvers", "_derived_matrices", "_build_timings", "_build_memory", "_code_indices", "_build_profiles"]
+
+_data_version = None
+
+
+def get_default_cache_dir():
+    '''
+    Get the build cache directory: $USEEIO_PY_BUILD_CACHE if set, otherwise ~/.cache/useeio_py/builds
+    '''
+    return(os.environ.get("USEEIO_PY_BUILD_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "useeio_py", "builds")))
+
+
+def get_data_version():
+    '''
+    Fingerprint the packaged data (file names, sizes and modification times).
+    Computed once per process.
+
+    return: A hex digest string.
+    '''
+    global _data_version
+    if _data_version is None:
+        digest = hashlib.sha256()
+        for package in data_packages:
+            root = str(importlib.resources.files(package))
+            for folder, _, files in sorted(os.walk(root)):
+                for file in sorted(files):
+                    stat = os.stat(os.path.join(folder, file))
+                    digest.update(f"{os.path.relpath(os.path.join(folder, file), root)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        _data_version = digest.hexdigest()
+    return(_data_version)
+
+
+def get_build_key(specs, config_paths = None):
+    '''
+    Get the content address of a model build.
+
+    Arguments:
+    specs:          Resolved model specifications from get_configuration().
+    config_paths:   str list, paths of model and agg/disagg configuration files as given to the model.
+
+    return: A hex digest string that changes whenever the specs, the agg/disagg/hybridization
+            spec files or the packaged data change.
+    '''
+    resolved = {"format": CACHE_FORMAT_VERSION, "data": get_data_version(), "specs": specs}
+    for spec, config_type in spec_files.items():
+        resolved[spec] = {}
+        for config_name in (specs.get(spec) or []):
+            try:
+                resolved[spec][config_name] = get_configuration(config_name, config_type, config_paths)
+            except Exception:
+                # Spec file can't be resolved here; key on its name only
+                resolved[spec][config_name] = None
+    content = json.dumps(resolved, sort_keys=True, default=str)
+    return(hashlib.sha256(content.encode()).hexdigest())
+
+
+class BuildCache:
+    '''
+    Content-addressed on-disk cache of constructed models.
+    Each entry is a pickle of the model state, named by its build key. Entries are evicted
+    when they have not been used for max_age seconds, and least recently used entries are
+    evicted while the cache is larger than max_bytes.
+
+    Arguments:
+    cache_dir:  Directory of the cache. Defaults to get_default_cache_dir().
+    max_bytes:  Maximum total size of the cache in bytes.
+    max_age:    Maximum time in seconds since an entry was last used.
+    '''
+    def __init__(self, cache_dir = None, max_bytes = 2 * 1024**3, max_age = 30 * 24 * 3600):
+        self.cache_dir = get_default_cache_dir() if cache_dir is None else cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def get_path(self, key):
+        return(os.path.join(self.cache_dir, f"{key}.pkl"))
+
+    def load(self, key):
+        '''
+        Load the model state stored under key.
+
+        return: A dictionary of model attributes, or None if there is no valid entry.
+        '''
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return(None)
+        try:
+            with open(path, "rb") as f:
+                header, state = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Removing unreadable build cache entry {path}: {e}")
+            self.remove(key)
+            return(None)
+        if header.get("format") != CACHE_FORMAT_VERSION or header.get("key") != key:
+            logging.info(f"Removing stale build cache entry {path}")
+            self.remove(key)
+            return(None)
+        # Mark the entry as recently used
+        os.utime(path)
+        return(state)
+
+    def store(self, key, model):
+        '''
+        Store the state of a constructed model under key and apply the eviction policy.
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        state = {name: value for name, value in model.__dict__.items() if name not in transient_attributes}
+        header = {"format": CACHE_FORMAT_VERSION, "key": key, "model": model.specs.get('Model')}
+        path = self.get_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((header, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def remove(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, now = None):
+        '''
+        Remove entries unused for more than max_age seconds, then remove least recently
+        used entries until the cache is no larger than max_bytes.
+
+        return: The keys of the removed entries.
+        '''
+        if not os.path.isdir(self.cache_dir):
+            return([])
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.cache_dir, file))
+                entries.append((stat.st_mtime, stat.st_size, file[:-len(".pkl")]))
+        entries.sort()
+        now = time.time() if now is None else now
+        removed = []
+        total = sum(size for _, size, _ in entries)
+        for used, size, key in entries:
+            if now - used > self.max_age or total > self.max_bytes:
+                self.remove(key)
+                removed.append(key)
+                total -= size
+        if removed:
+            logging.info(f"Evicted {len(removed)} build cache entries")
+        return(removed)
+
+    def clear(self):
+        '''Remove all entries.'''
+        if os.path.isdir(self.cache_dir):
+            for file in os.listdir(self.cache_dir):
+                if file.endswith(".pkl"):
+                    self.remove(file[:-len(".pkl")])
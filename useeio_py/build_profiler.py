@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+'''
+Build profiler: nested spans of a model build with their wall time, CPU time, peak resident
+memory growth and output shapes, reported as JSON or as folded stacks for flame graphs
+'''
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is not reported there
+    resource = None
+
+# Innermost open span of the model build profiled in the current context
+_current_span = contextvars.ContextVar("current_span", default = None)
+
+
+def get_peak_rss():
+    '''
+    Get the peak resident memory of the process in bytes, or None where it can't be measured.
+    '''
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return(peak if sys.platform == "darwin" else peak * 1024)
+
+
+class BuildSpan:
+    '''
+    A timed section of a model build, with the spans opened inside it as children.
+
+    Arguments:
+    name:   Name of the span, e.g. "stage_io_data" or "generate_market_shares_from_make".
+
+    Attributes set when the span closes:
+    start:          Start time in seconds (time.perf_counter()).
+    wall:           Wall time in seconds.
+    cpu:            CPU time of the process in seconds.
+    peak_rss_delta: Growth of the peak resident memory of the process in bytes, None where
+                    it can't be measured. Only memory beyond the previous peak shows up.
+    shapes:         Dictionary of output name to the shape of the output matrix.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+        self.shapes = {}
+        self.start = None
+        self.wall = None
+        self.cpu = None
+        self.peak_rss_delta = None
+
+    def set_output(self, output, name = None):
+        '''
+        Record the shape of an output matrix of the span, if it has one.
+        '''
+        shape = getattr(output, "shape", None)
+        if shape is not None:
+            self.shapes[self.name if name is None else name] = [int(n) for n in shape]
+
+    def get_self_wall(self):
+        '''Wall time in seconds not spent in child spans.'''
+        return(max(self.wall - sum(child.wall for child in self.children), 0.0))
+
+    def to_dict(self, start = None):
+        '''
+        Get the span and its children as a dictionary, with start times in seconds relative
+        to start (defaults to the start of this span).
+        '''
+        start = self.start if start is None else start
+        return({
+            "name": self.name,
+            "start": self.start - start,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "peak_rss_delta": self.peak_rss_delta,
+            "shapes": self.shapes,
+            "children": [child.to_dict(start) for child in self.children],
+        })
+
+    def to_folded_stacks(self):
+        '''
+        Get the span as folded stacks, the input format of flame graph tools (e.g. flamegraph.pl
+        or speedscope): one "root;child;grandchild <microseconds>" line per call stack, with the
+        self wall time of the spans on that stack summed.
+
+        return: A list of lines.
+        '''
+        totals = {}
+        pending = [((self.name,), self)]
+        while pending:
+            stack, span = pending.pop()
+            totals[stack] = totals.get(stack, 0.0) + span.get_self_wall()
+            pending.extend((stack + (child.name,), child) for child in span.children)
+        return([f"{';'.join(stack)} {round(seconds * 1e6)}" for stack, seconds in sorted(totals.items())])
+
+
+@contextlib.contextmanager
+def _timed(span):
+    token = _current_span.set(span)
+    rss = get_peak_rss()
+    span.start = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield span
+    finally:
+        span.wall = time.perf_counter() - span.start
+        span.cpu = time.process_time() - cpu
+        if rss is not None:
+            span.peak_rss_delta = get_peak_rss() - rss
+        _current_span.reset(token)
+
+
+@contextlib.contextmanager
+def span(name):
+    '''
+    Time a section of the model build. When a build is profiled (see profile_build()), the
+    span is recorded as a child of the innermost open span.
+
+    Argument:
+    name:   Name of the span.
+
+    yield: The BuildSpan, e.g. to record output shapes with set_output(). Its times are set
+           when the section exits.
+    '''
+    build_span = BuildSpan(name)
+    parent = _current_span.get()
+    if parent is not None:
+        parent.children.append(build_span)
+    with _timed(build_span):
+        yield build_span
+
+
+@contextlib.contextmanager
+def profile_build(model, name = None):
+    '''
+    Profile a model build: the spans opened inside are recorded under a root span, which is
+    added to the build profiles of the model (see get_build_profiles()). Inside a profiled
+    build, this is a span named name.
+
+    Arguments:
+    model:  The USEEIOModel being built.
+    name:   Name of the root span, defaults to the model name.
+
+    yield: The root BuildSpan.
+    '''
+    name = model.specs.get('Model', "model") if name is None else name
+    if _current_span.get() is not None:
+        with span(name) as build_span:
+            yield build_span
+        return
+    root = BuildSpan(name)
+    with _timed(root):
+        yield root
+    model.__dict__.setdefault('_build_profiles', []).append(root)
+    logging.info(f"Profiled build {name}: {root.wall:.3f} s wall, {root.cpu:.3f} s CPU")
+
+
+def profiled(function):
+    '''
+    Decorator that runs a function in a span named after it when a build is profiled,
+    and records the shape of its result.
+    '''
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        if _current_span.get() is None:
+            return(function(*args, **kwargs))
+        with span(function.__name__) as build_span:
+            result = function(*args, **kwargs)
+            build_span.set_output(result)
+        return(result)
+    return(run)
+
+
+def get_build_profiles(model):
+    '''
+    Get the profiles of the builds of a model in this process, oldest first.
+
+    return: A list of root BuildSpans.
+    '''
+    return(list(model.__dict__.get('_build_profiles', [])))
+
+
+def write_build_profile(profile, path, format = "json"):
+    '''
+    Write a build profile.
+
+    Arguments:
+    profile:    A root BuildSpan, see get_build_profiles().
+    path:       Path of the file to write.
+    format:     "json" for the span tree with times, memory and shapes, or "folded" for
+                folded stacks of self wall time in microseconds (for flame graphs).
+    '''
+    if format == "json":
+        with open(path, "w") as f:
+            json.dump(profile.to_dict(), f, indent = 2)
+    elif format == "folded":
+        with open(path, "w") as f:
+            f.write("\n".join(profile.to_folded_stacks()) + "\n")
+    else:
+        msg = f"{format} is not a valid build profile format."
+        logging.error(msg)
+        sys.exit(msg)
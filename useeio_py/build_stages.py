@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental model builds: the model build stages, fingerprinted by their inputs
+'''
+import hashlib
+import logging
+from . import build_profiler, load_io_tables, load_satellites, load_indicators, load_demand_vectors
+from .build_cache import get_build_key
+
+# Model build stages in build order, with the model spec entries each stage reads, the stages
+# it needs and the model components it sets. The io_data stage reads all spec entries that
+# no other stage reads. A stage is only run again when its spec entries, the spec files and
+# packaged data it reads, or a stage it needs have changed.
+build_stages = {
+    "io_data": {"specs": None, "after": [], "outputs": None},
+    "satellites": {"specs": ["SatelliteTable"], "after": ["io_data"], "outputs": ["SatelliteTables"]},
+    "indicators": {"specs": ["Indicators"], "after": ["satellites"], "outputs": ["Indicators"]},
+    "demand_vectors": {"specs": ["DemandVectors"], "after": ["io_data"], "outputs": ["DemandVectors"]},
+    "matrices": {"specs": [], "after": ["io_data", "satellites", "indicators"], "outputs": []},
+}
+
+# Stages whose outputs are model matrices (see useeio_model.matrix_dependencies). Lazy models
+# drop their outputs instead of running them, and build the outputs on first access.
+lazy_stages = ["satellites", "indicators", "matrices"]
+
+
+def run_io_data_stage(model, config_paths):
+    model.load_crosswalk()
+    load_io_tables.load_io_data(model, config_paths)
+
+def run_satellites_stage(model, config_paths):
+    load_satellites.load_and_build_satellite_tables(model)
+
+def run_indicators_stage(model, config_paths):
+    load_indicators.load_and_build_indicators(model)
+
+def run_demand_vectors_stage(model, config_paths):
+    load_demand_vectors.load_demand_vectors(model)
+
+def run_matrices_stage(model, config_paths):
+    # Only builds the matrices that are missing, i.e. were dropped when a component was replaced
+    model.construct_EEIO_matrices()
+
+stage_functions = {
+    "io_data": run_io_data_stage,
+    "satellites": run_satellites_stage,
+    "indicators": run_indicators_stage,
+    "demand_vectors": run_demand_vectors_stage,
+    "matrices": run_matrices_stage,
+}
+
+
+def get_stage_specs(specs, stage):
+    '''
+    Get the model spec entries a build stage reads.
+
+    Arguments:
+    specs:  Model specifications.
+    stage:  Name of the build stage, one of build_stages.
+
+    return: A dictionary of spec entries.
+    '''
+    read = build_stages[stage]["specs"]
+    if read is None:
+        # Everything that no other stage reads
+        others = {spec for config in build_stages.values() for spec in (config["specs"] or [])}
+        return({spec: value for spec, value in specs.items() if spec not in others})
+    return({spec: specs.get(spec) for spec in read})
+
+
+def get_stage_fingerprints(specs, config_paths = None):
+    '''
+    Fingerprint the build stages of a model by their inputs.
+
+    Arguments:
+    specs:          Model specifications.
+    config_paths:   str list, paths of model and agg/disagg configuration files as given to the model.
+
+    return: A dictionary of stage name to a hex digest string that changes whenever the spec
+            entries, spec files or packaged data the stage reads, or the fingerprint of a stage
+            it needs, change.
+    '''
+    fingerprints = {}
+    for stage, config in build_stages.items():
+        digest = hashlib.sha256(get_build_key(get_stage_specs(specs, stage), config_paths).encode())
+        for upstream in config["after"]:
+            digest.update(fingerprints[upstream].encode())
+        fingerprints[stage] = digest.hexdigest()
+    return(fingerprints)
+
+
+def run_build_stages(model, config_paths = None, lazy = False):
+    '''
+    Build a model, running only the build stages whose fingerprint differs from the one
+    recorded when the stage last ran on the model. Replacing the outputs of a stage drops
+    the model matrices built from them (e.g. new Indicators drop C, D, N and N_d, but not
+    B or the Leontief factorization), and the matrices stage rebuilds only those.
+    The build is profiled (see build_profiler.profile_build()) with a stage_<name> span per
+    stage run, and the wall time of each stage run is recorded as build timing stage_<name>.
+
+    Arguments:
+    model:          A USEEIOModel with specs.
+    config_paths:   str list, paths of model and agg/disagg configuration files as given to the model.
+    lazy:           If True, drop the outputs of invalidated lazy_stages instead of running
+                    them, so they are built on first access.
+
+    return: The names of the stages that were run (or dropped).
+    '''
+    with build_profiler.profile_build(model):
+        fingerprints = get_stage_fingerprints(model.specs, config_paths)
+        previous = model.__dict__.get('_stage_fingerprints', {})
+        if previous.get("io_data") != fingerprints["io_data"] and previous:
+            # Every component is built from the IO data, so nothing can be kept
+            logging.info("IO data specs changed, rebuilding the model from scratch")
+            model.reset()
+            previous = {}
+        invalidated = [stage for stage in build_stages if previous.get(stage) != fingerprints[stage]]
+        for stage in invalidated:
+            if lazy and stage in lazy_stages:
+                for output in build_stages[stage]["outputs"]:
+                    model.drop_matrix(output)
+            else:
+                logging.info(f"Running build stage {stage}...")
+                with build_profiler.span(f"stage_{stage}") as stage_span:
+                    stage_functions[stage](model, config_paths)
+                model.record_build_timing(f"stage_{stage}", stage_span.wall)
+            previous[stage] = fingerprints[stage]
+            model._stage_fingerprints = previous
+    return(invalidated)
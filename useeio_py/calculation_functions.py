@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import sys
 import pandas as pd
 import numpy as np
 from pandas.api.types import is_numeric_dtype
-from demand_functions import is_demand_vector_valid, format_demand_vector
+import scipy.sparse
+from . import io_functions, utility_functions
+from .demand_functions import is_demand_vector_valid, format_demand_vector
 
 def calculate_EEIO_model(model, perspective, demand = "Production", use_domestic_requirements = False):
     '''
@@ -25,11 +28,9 @@ def calculate_EEIO_model(model, perspective, demand = "Production", use_domestic
     '''
     
     result = {}
-    # Generate Total Requirements (L or L_d) matrix based on whether "use_domestic"
-    if use_domestic_requirements:
-        L = model.L_d
-    else:
-        L = model.L
+    # Get the factorized Total Requirements (L or L_d) solver based on whether "use_domestic".
+    # The solver exposes the sector index of L, so it is used in place of L below.
+    L = model.get_leontief_solver(domestic = use_domestic_requirements)
         
     # Prepare demand vector
     if type(demand) == str:
@@ -49,8 +50,8 @@ def calculate_EEIO_model(model, perspective, demand = "Production", use_domestic
     else:
         # Assume this is a user-defined demand vector
         #! Need to check that the given demand vector is valid
-        if is_demand_vector_valid(demand, L):
-            d = format_demand_vector(demand,L)
+        if is_demand_vector_valid(demand, L, model):
+            d = format_demand_vector(demand, L, model)
         else:
             logging.error("Format of the demand vector is invalid. Cannot calculate result.")
     
@@ -97,13 +98,106 @@ def calculate_EEIO_model(model, perspective, demand = "Production", use_domestic
     return(result)
 
 
+def calculate_EEIO_model_batch(model, perspective, demands, use_domestic_requirements = False, detail = False,
+                               max_detail_bytes = 2**30):
+    '''
+    Calculate total emissions/resources (LCI) and total impacts (LCIA) for an EEIO model
+    for many demand vectors at once. All scaling vectors and results are computed with
+    single matrix-matrix products instead of one calculate_EEIO_model() call per demand.
+    
+    Arguments:
+    model:          A complete EEIO Model: an instance of class Model as defined in useeio_classes.py
+    perspective:    Perspective of the model: can be "DIRECT", "FINAL", or "BOTH".
+    demands:        Demand vectors, either a (sectors x k) DataFrame with one named demand per column,
+                    a dictionary of named demand vectors (Series or single column DataFrames),
+                    or a list of named Series. Each vector may cover only some model sectors;
+                    values are in USD with the same dollar year as model.
+    use_domestic_requirements:  
+                    A logical value: if True, use L_d matrix; if False, use L matrix.
+    detail:         A logical value: if True, return results by sector for each demand; 
+                    if False, return only totals for each demand.
+    max_detail_bytes:
+                    Largest size in bytes of a detail=True result (demands x sectors x flows values).
+                    Larger requests stop with an error; calculate fewer demands per call instead.
+    
+    return: A dictionary with LCI and LCIA results (in data.frame format) with the same keys as
+            calculate_EEIO_model(). With detail=False each result has demand names as rows and
+            flows/indicators as columns. With detail=True each result is stacked with a
+            (demand, sector) row index.
+    '''
+    result = {}
+    L = model.get_leontief_solver(domestic = use_domestic_requirements)
+
+    # Assemble all demand vectors into one (sectors x k) demand matrix ordered like L
+    if isinstance(demands, pd.DataFrame):
+        Y = demands
+    elif isinstance(demands, dict):
+        Y = pd.concat([pd.DataFrame(d).iloc[:, 0].rename(name) for name, d in demands.items()], axis=1)
+    else:
+        Y = pd.concat([pd.Series(d) for d in demands], axis=1)
+    if not (all(is_numeric_dtype(Y[col]) for col in Y.columns) and set(Y.index).issubset(L.index)):
+        logging.error("Format of the demand matrix is invalid. Cannot calculate result.")
+        return(result)
+    Y = Y.reindex(L.index).fillna(0)
+    y = Y.to_numpy(dtype=float)
+
+    if detail:
+        # The results by sector hold a value per demand, sector and flow (or indicator)
+        targets = []
+        if perspective in ["DIRECT", "BOTH"]:
+            targets += [model.B, model.D]
+        if perspective in ["FINAL", "BOTH"]:
+            targets += [model.M, model.N]
+        detail_bytes = y.shape[1] * y.shape[0] * max([X.shape[0] for X in targets], default=0) * 8
+        if detail_bytes > max_detail_bytes:
+            msg = (f"Results by sector of {y.shape[1]} demands need {detail_bytes/1e9:.1f} GB, more than "
+                   f"max_detail_bytes. Use detail=False or calculate fewer demands at a time.")
+            logging.error(msg)
+            sys.exit(msg)
+
+    def _format(values, target):
+        # values is (k x n x target) when detail, otherwise (target x k)
+        if detail:
+            index = pd.MultiIndex.from_product([Y.columns, L.index], names=["Demand", "Sector"])
+            return(pd.DataFrame(values.reshape(-1, values.shape[-1]), index=index, columns=target))
+        return(pd.DataFrame(np.transpose(values), index=Y.columns, columns=target))
+
+    def _direct(X, S):
+        # Direct perspective, X is B or D
+        if detail:
+            return(_format(np.transpose(S)[:, :, None] * np.transpose(X.to_numpy())[None, :, :], X.index))
+        return(_format(utility_functions.matrix_values(X) @ S, X.index))
+
+    def _final(X):
+        # Final perspective, X is M or N
+        if detail:
+            return(_format(np.transpose(y)[:, :, None] * np.transpose(X.to_numpy())[None, :, :], X.index))
+        return(_format(utility_functions.matrix_values(X) @ y, X.index))
+
+    if perspective in ["DIRECT", "BOTH"]:
+        logging.info(f"Calculating Direct Perspective LCI and LCIA for {y.shape[1]} demands...")
+        S = L.solve(y)
+        result['LCI_d'] = _direct(model.B, S)
+        result['LCIA_d'] = _direct(model.D, S)
+    if perspective in ["FINAL", "BOTH"]:
+        logging.info(f"Calculating Final Perspective LCI and LCIA for {y.shape[1]} demands...")
+        result['LCI_f'] = _final(model.M)
+        result['LCIA_f'] = _final(model.N)
+    if perspective not in ["DIRECT", "FINAL", "BOTH"]:
+        logging.error(f"{perspective} is not a valid perspective in the model.")
+    
+    logging.info("Result calculation complete.")
+    return(result)
+
+
 def get_scaling_vector(L, demand):
     '''
     Multiply the Leontief inverse L and the demand vector to calculate scaling vector
     that represents production needed to fulfill the demand.
     
     Arguments:
-    L:      Leontief inverse.
+    L:      Leontief inverse, or an io_functions.LeontiefSolver for the model A matrix.
+            The solver answers by back-substitution without forming L.
     demand: Final demand vector
     
     return: Scaling vector
@@ -113,10 +207,13 @@ def get_scaling_vector(L, demand):
                 Journal of Cleaner Production 158 (August): 308–18. https://doi.org/10.1016/j.jclepro.2017.04.150.
                 SI1, Equation 8.
     '''
-    s = np.matmul(L, np.asarray(demand))
+    if isinstance(L, io_functions.LeontiefSolver):
+        s = L.solve(demand)
+    else:
+        s = np.matmul(L, np.asarray(demand))
     return(s)
         
-def calculate_direct_perspective_LCI(B, s):
+def calculate_direct_perspective_LCI(B, s, nonzero_only = False):
     '''
     The direct perspective LCI aligns flows with sectors consumed by direct use.
     Multiply the B matrix and the scaling vector s.
@@ -124,6 +221,7 @@ def calculate_direct_perspective_LCI(B, s):
     Arguments:
     B:  Marginal impact per unit of the environmental flows.
     s:  Scaling vector.
+    nonzero_only:   A logical value: if True, only return rows for sectors with a nonzero scaling value.
     
     return: A matrix with direct impacts in form of sector x flows.
     
@@ -132,12 +230,11 @@ def calculate_direct_perspective_LCI(B, s):
                 Journal of Cleaner Production 158 (August): 308–18. https://doi.org/10.1016/j.jclepro.2017.04.150.
                 SI1, Equation 9.
     '''
-    lci_d = np.transpose(np.matmul(B, np.diag(s.iloc[:,0])))
-    lci_d.index = s.index
+    lci_d = scale_matrix_columns(B, s, nonzero_only)
     return(lci_d)
     
     
-def calculate_final_perspective_LCI(M, y):
+def calculate_final_perspective_LCI(M, y, nonzero_only = False):
     '''
     The final perspective LCI aligns flows with sectors consumed by final users.
     Multiply the M matrix and the diagonal of demand, y.
@@ -145,6 +242,7 @@ def calculate_final_perspective_LCI(M, y):
     Arguments:
     M:  a model M matrix, direct + indirect flows per $ output of sector.
     y:  a model demand vector
+    nonzero_only:   A logical value: if True, only return rows for sectors with nonzero demand.
     
     return: A matrix with total impacts in form of sectors x flows.
     
@@ -153,14 +251,11 @@ def calculate_final_perspective_LCI(M, y):
                 Journal of Cleaner Production 158 (August): 308–18. https://doi.org/10.1016/j.jclepro.2017.04.150.
                 SI1, Equation 10.
     '''
-
-    lci_f = np.transpose(np.matmul(M, np.diag(y.iloc[:,0])))
-    lci_f.index = M.columns
-    
+    lci_f = scale_matrix_columns(M, y, nonzero_only)
     return(lci_f)
 
 
-def calculate_direct_perspective_LCIA(D, s):
+def calculate_direct_perspective_LCIA(D, s, nonzero_only = False):
     '''
     The direct perspective LCIA aligns impacts with sectors consumed by direct use.
     Multiply the D matrix (the product of C matrix and B matrix) and scaling vector s.
@@ -168,6 +263,7 @@ def calculate_direct_perspective_LCIA(D, s):
     Arguments:
     D:  a model D matrix, Direct impact per unit of the environmental flows.
     s:  Scaling vector.
+    nonzero_only:   A logical value: if True, only return rows for sectors with a nonzero scaling value.
     
     return: A matrix with direct impacts in form of sector x impact categories.
     
@@ -176,12 +272,11 @@ def calculate_direct_perspective_LCIA(D, s):
                 Journal of Cleaner Production 158 (August): 308–18. https://doi.org/10.1016/j.jclepro.2017.04.150.
                 SI1, Equation 9.
     '''
-    lcia_d = np.transpose(np.matmul(D, np.diag(s.iloc[:,0])))
-    lcia_d.index = s.index
+    lcia_d = scale_matrix_columns(D, s, nonzero_only)
     return(lcia_d)
     
     
-def calculate_final_perspective_LCIA(N, y):
+def calculate_final_perspective_LCIA(N, y, nonzero_only = False):
     '''
     The final perspective LCIA aligns impacts with sectors consumed by final users.
     Multiply the N matrix and the diagonal of demand, y.
@@ -189,6 +284,7 @@ def calculate_final_perspective_LCIA(N, y):
     Arguments:
     N: a model N matrix, direct + indirect impact per unit of the environmental flows.
     y:  a model demand vector
+    nonzero_only:   A logical value: if True, only return rows for sectors with nonzero demand.
     
     return: A matrix with total impacts in form of sector x impact categories.
     
@@ -197,9 +293,39 @@ def calculate_final_perspective_LCIA(N, y):
                 Journal of Cleaner Production 158 (August): 308–18. https://doi.org/10.1016/j.jclepro.2017.04.150.
                 SI1, Equation 10.
     '''
-    lcia_f = np.transpose(np.matmul(N, np.diag(y.iloc[:,0])))
-    lcia_f.index = N.columns
+    lcia_f = scale_matrix_columns(N, y, nonzero_only)
     return(lcia_f)
+
+
+def scale_matrix_columns(X, v, nonzero_only = False):
+    '''
+    Scale each sector column of a flow/indicator x sector matrix by a sector vector and
+    transpose, i.e. t(X %*% diag(v)), using broadcasting instead of a dense diagonal matrix.
+    
+    Arguments:
+    X:  A matrix (dataframe) with flows or indicators as rows and sectors as columns.
+    v:  A sector vector (single column dataframe, series or array) ordered like the columns of X.
+    nonzero_only:   A logical value: if True, only return rows for sectors where v is nonzero.
+    
+    return: A dataframe in form of sector x flows (or impact categories). If X uses the
+            sparse matrix backend, so does the result.
+    '''
+    if isinstance(v, pd.DataFrame):
+        v = v.iloc[:, 0]
+    values = np.asarray(v, dtype=float)
+    flows = X.index
+    sectors = X.columns
+    X = utility_functions.matrix_values(X)
+    if nonzero_only and np.count_nonzero(values) < len(values):
+        keep = np.flatnonzero(values)
+        values = values[keep]
+        sectors = sectors[keep]
+        X = X[:, keep]
+    if scipy.sparse.issparse(X):
+        scaled = X.multiply(values.reshape(1, -1)).T
+        return(utility_functions.to_sparse_matrix(scaled, index=sectors, columns=flows))
+    scaled = pd.DataFrame(np.transpose(X * values), index=sectors, columns=flows)
+    return(scaled)
   
 
 def calculate_sector_contribution_to_impact(model, sector, indicator, domestic=False):
@@ -240,8 +366,12 @@ def aggregate_result_matrix_by_row(matrix, to_level, crosswalk):
     #' @return An aggregated matrix with sectors as rows
     #' @export
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    # Matrix sectors are USEEIO codes with a location suffix, which is removed so that all
+    # locations of a sector are summed into one bare BEA code
+    # R code: df_fromlevel[, from_code] <- gsub("/.*", "", df_fromlevel[, from_code])
+    matrix = matrix.set_axis(remove_location(matrix.index), axis = 0)
+    crosswalk_index = utility_functions.get_crosswalk_index(crosswalk, "USEEIO", f"BEA_{to_level}")
+    return(crosswalk_index.aggregate(matrix, rows = True))
 
 def aggregate_result_matrix(matrix, to_level, crosswalk):
     '''
@@ -253,8 +383,15 @@ def aggregate_result_matrix(matrix, to_level, crosswalk):
     #' @return An aggregated matrix with sectors as rows and columns
     #' @export
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    matrix = matrix.set_axis(remove_location(matrix.index), axis = 0).set_axis(remove_location(matrix.columns), axis = 1)
+    crosswalk_index = utility_functions.get_crosswalk_index(crosswalk, "USEEIO", f"BEA_{to_level}")
+    return(crosswalk_index.aggregate(matrix, rows = True, columns = True))
+
+def remove_location(codes):
+    '''
+    Remove the location suffix from sector codes, e.g. "1111A0/US" becomes "1111A0".
+    '''
+    return(pd.Index(codes).astype(str).str.replace("/.*", "", regex = True))
 
 def calculate_sector_purchased_by_sector_sourced_impact(y, model, indicator):
     '''
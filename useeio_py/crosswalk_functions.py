@@ -3,7 +3,6 @@
 import pandas as pd
 import numpy as np
 from os import path
-import requests
 
 '''
 Functions that use sector crosswalks
@@ -25,8 +24,25 @@ def get_naics_to_bea_allocation(year, model):
     #' @param year Year of model Industry output.
     #' @return A table of allocation factors between NAICS and BEA sectors.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    # Keep USEEIO and NAICS columns in model crosswalk
+    naics_to_bea = model.crosswalk[["NAICS", "USEEIO"]].drop_duplicates()
+    naics_to_bea.columns = ["NAICS_Code", "BEA_Code"]
+    # Drop 2-digit NAICS code
+    naics_to_bea = naics_to_bea[naics_to_bea["NAICS_Code"].str.len() > 2]
+    # Select the repeated NAICS codes that need allocation
+    allocation_codes = naics_to_bea[naics_to_bea["NAICS_Code"].duplicated(keep = False)]
+    # Merge allocation_codes with Gross Output table to calculate allocation factors
+    output = model.MultiYearIndustryOutput[[str(year)]].rename(columns = {str(year): "Output"})
+    output = output.assign(BEA_Code = output.index.str.replace("/.*", "", regex = True),
+                           Location = output.index.str.replace(".*/", "", regex = True))
+    allocation_codes = pd.merge(allocation_codes, output, on = "BEA_Code", how = "left")
+    # Aggregate Output for the same NAICS code and location
+    sum_output = allocation_codes.groupby(["NAICS_Code", "Location"])["Output"].transform("sum")
+    # Calculate allocation factors
+    allocation_codes["allocation_factor"] = allocation_codes["Output"] / sum_output
+    # Keep wanted columns
+    allocation_codes = allocation_codes[["NAICS_Code", "BEA_Code", "Location", "allocation_factor"]]
+    return(allocation_codes.reset_index(drop = True))
 
 #TODO: ensure file names are properly referenced in file structure for python module
 #TODO: throw error if user inputs year other than 2012 or 2007
@@ -47,6 +63,8 @@ def get_naics_2_to_6_digits_code_name(year):
         url = "https://www.census.gov/eos/www/naics/reference_files_tools/2007/naics07.xls"
     
     if not path.exists(file_name):
+        # requests is only needed to download missing files
+        import requests
         response = requests.get(url)
         with open(file_name, 'wb') as f:
             f.write(response.content)
@@ -88,6 +106,8 @@ def get_naics_2_to_6_digits(year):
         url = "https://www.census.gov/eos/www/naics/reference_files_tools/2007/naics07.xls"
     
     if not path.exists(file_name):
+        # requests is only needed to download missing files
+        import requests
         response = requests.get(url)
         with open(file_name, 'wb') as f:
             f.write(response.content)
@@ -225,6 +245,8 @@ def get_naics_2012_to_2007_concordances():
     url = "https://www.census.gov/naics/concordances/2012_to_2017_NAICS.xlsx"
     
     if not path.exists(file_name):
+        # requests is only needed to download missing files
+        import requests
         response = requests.get(url)
         with open(file_name, 'wb') as f:
             f.write(response.content)
@@ -244,6 +266,8 @@ def get_naics_2012_to_2017_concordances():
     url = "https://www.census.gov/naics/concordances/2012_to_2017_NAICS.xlsx"
     
     if not path.exists(file_name):
+        # requests is only needed to download missing files
+        import requests
         response = requests.get(url)
         with open(file_name, 'wb') as f:
             f.write(response.content)
@@ -4,9 +4,16 @@ Functions to support data quality assessment
 Draws from https://github.com/USEPA/ElectricityLCI/blob/master/electricitylci/dqi.py 
 '''
 
+import datetime
+import logging
+import sys
 import pandas as pd
 import numpy as np
 
+# Data quality indicator fields of totals-by-sector tables
+flow_data_quality_fields = ["DataReliability", "TemporalCorrelation", "GeographicalCorrelation",
+                            "TechnologicalCorrelation", "DataCollection"]
+
 
 def get_dq_fields(df):
     '''
@@ -14,17 +21,8 @@ def get_dq_fields(df):
     #' @param df A totals_by_sector data frame
     #' @return A string vector with names of data quality fields
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    flow_data_quality_fields <- c("DataReliability",
-                                    "TemporalCorrelation",
-                                    "GeographicalCorrelation",
-                                    "TechnologicalCorrelation",
-                                    "DataCollection")  
-    fields_in_df <- flow_data_quality_fields[flow_data_quality_fields %in% colnames(df)]
+    fields_in_df = [field for field in flow_data_quality_fields if field in df.columns]
     return(fields_in_df)
-    '''
 
 def set_dq_scoring_bounds():
     '''
@@ -32,94 +30,88 @@ def set_dq_scoring_bounds():
     #' and for each indicator, provide those bounds
     #' @return A list with DQ bounds
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    bound_to_dqi <- list()
-    bound_to_dqi[["upper"]] <- c("TemporalCorrelation")
-    bound_to_dqi[["lower"]] <- c("DataCollection")
-    temp_upper_bounds <- c(3, 6, 10, 15, NA) #years from target date
-    dc_lower_bounds <- c(0.8, 0.6, 0.4, 0, NA) #proportion of total industry
-    bound_to_dqi[["TemporalCorrelation"]] <- temp_upper_bounds
-    bound_to_dqi[["DataCollection"]] <- dc_lower_bounds
+    bound_to_dqi = {}
+    bound_to_dqi["upper"] = ["TemporalCorrelation"]
+    bound_to_dqi["lower"] = ["DataCollection"]
+    temp_upper_bounds = [3, 6, 10, 15, np.nan] #years from target date
+    dc_lower_bounds = [0.8, 0.6, 0.4, 0, np.nan] #proportion of total industry
+    bound_to_dqi["TemporalCorrelation"] = temp_upper_bounds
+    bound_to_dqi["DataCollection"] = dc_lower_bounds
     return(bound_to_dqi)
-    '''
 
 def lookup_dq_bound_score(raw_score, dqi, scoring_bounds):
     '''
     #' For the data quality scores based on ranges, this provides the appropriate
     #' score in relation to either an upper or lower bound
     #' passed based on the data quality indicator type.
-    #' @param raw_score numeric. Raw value used
+    #' @param raw_score numeric. Raw value used, or an array of raw values
     #' @param dqi string. Name of the DQI category and a column name
-    #' @param scoring_bounds List. Constant returned by setDQScoringBounds()
-    #' @return integer, a data quality score
-    '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    score <- NA
-    if (is.na(raw_score)){
-        return(score)  
-    }
-    
-    if (dqi %in% scoring_bounds["lower"]) {
-        for (i in 1:4) {
-        if (raw_score >= scoring_bounds[[dqi]][i]) {
-            score <- i
-            break
-        }  
-        }
-        if (is.na(score)) score<-5
-    } else if (dqi %in% scoring_bounds["upper"]) {
-        for (i in 1:4) {
-        if (raw_score <= scoring_bounds[[dqi]][i]) {
-            score <- i
-            break
-        } 
-        }
-        if (is.na(score)) score<-5
-    } else {
-        stop(paste("No bounds defined for", dqi))
-    }
+    #' @param scoring_bounds List. Constant returned by set_dq_scoring_bounds()
+    #' @return integer, a data quality score, or a float array of scores for an array of raw
+    #' values (NaN where the raw value is missing)
+    '''
+    raw = np.asarray(raw_score, dtype = float)
+    bounds = np.asarray(scoring_bounds[dqi][:4], dtype = float) if dqi in scoring_bounds else None
+    if dqi in scoring_bounds["lower"]:
+        # Score is the first bound the raw score is at or above, 5 if none;
+        # i.e. one more than the number of bounds above the raw score
+        score = 1 + len(bounds) - np.searchsorted(bounds[::-1], raw, side = "right")
+    elif dqi in scoring_bounds["upper"]:
+        # Score is the first bound the raw score is at or below, 5 if none
+        score = 1 + np.searchsorted(bounds, raw, side = "left")
+    else:
+        logging.error(f"No bounds defined for {dqi}")
+        sys.exit(f"No bounds defined for {dqi}")
+    score = np.where(np.isnan(raw), np.nan, score)
+    if score.ndim == 0:
+        return(None if np.isnan(score) else int(score))
     return(score)
-    '''
 
 def score_contextual_dq(df):
     '''
     #' Adds contextual data quality scores to a data frame with Year present
     #' @param df A data frame containing a 'Year' column representing data year
     #' @return A data frame with contextual data quality scores added in columns
-    #' with names of the indicators. Only 'TemporalCorrelation' currently added.
-    '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    bounds <- setDQScoringBounds()
-    for (year in unique(df$Year)) {
-        df[df$Year==year, "TemporalCorrelation"] <- scoreTemporalDQ(year, target_year = NA, scoring_bounds = bounds)
-    }
+    #' with names of the indicators. Only 'TemporalCorrelation' currently added,
+    #' NA where the year is missing.
+    '''
+    bounds = set_dq_scoring_bounds()
+    # Score each distinct year once, then spread the scores over the rows
+    codes, years = pd.factorize(df['Year'])
+    year_scores = score_temporal_dq(pd.to_numeric(pd.Series(years), errors = "coerce").to_numpy(dtype = float),
+                                    bounds)
+    # Rows without a year (code -1) take the last entry, NA
+    scores = np.append(year_scores, np.nan)[codes]
+    df = df.assign(TemporalCorrelation = scores)
     return(df)
-    '''
 
 def score_temporal_dq(data_year, scoring_bounds, target_year=None):
     '''
     #' Scores temporal data quality using a lookup based on difference between data year and target year
-    #' @param data_year integer year of data
+    #' @param data_year integer year of data, or an array of years
     #' @param target_year integer year of data, defaults to current year
     #' @param scoring_bounds global scoring bounds
-    #' @return An integer data quality score 1-5 or NA
-    '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    #' @return An integer data quality score 1-5 or NA, or a float array of scores for an array of years
     '''
-    if (is.na(data_year)) {
-        return(NA)
-    }
-    if (is.na(target_year)) {
-        target_year <- as.integer(format(Sys.Date(), "%Y"))
-    }
-    age <- target_year - data_year
-    score <- lookupDQBoundScore(age, "TemporalCorrelation", scoring_bounds) 
+    if target_year is None:
+        target_year = datetime.date.today().year
+    age = target_year - np.asarray(data_year, dtype = float)
+    score = lookup_dq_bound_score(age, "TemporalCorrelation", scoring_bounds)
     return(score)
+
+def get_flow_weighted_dq(df, flow_amount, dq_fields = None):
+    '''
+    Weight the DQ scores of a totals-by-sector table by flow amount, for flow-weighted means
+    of DQ scores over groups of rows: the sum of the weighted scores of a group divided by the
+    sum of its flow amounts. Missing scores count as 5.
+
+    Arguments:
+    df:             A totals-by-sector df.
+    flow_amount:    Array of the flow amount of each row.
+    dq_fields:      DQ fields to weight, defaults to the DQ fields in df (see get_dq_fields()).
+
+    return: A dataframe of the weighted DQ fields, with the index of df.
     '''
+    dq_fields = get_dq_fields(df) if dq_fields is None else dq_fields
+    weighted = {f: np.nan_to_num(df[f].to_numpy(dtype = float), nan = 5) * flow_amount for f in dq_fields}
+    return(pd.DataFrame(weighted, index = df.index))
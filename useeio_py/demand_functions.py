@@ -94,43 +94,61 @@ def prepare_household_demand(model):
     logging.debug("Function not implemented")
     sys.exit()
 
-def is_demand_vector_valid(dv, L):
+def is_demand_vector_valid(dv, L, model = None):
     '''
     A function to validate a user provided demand vector
 
     Arguments:
-    dv: a user provided demand vector
-    L:  the L matrix for the given model, used as a reference
+    dv:     a user provided demand vector
+    L:      the L matrix for the given model, used as a reference
+    model:  the model L belongs to. If given, sectors are looked up in the model code index.
 
     return: A logical value indicating demand vector is valid or not.
     '''
     # dv index shoud be part of sectors in L
-    is_valid = all([is_numeric_dtype(dv.iloc[:,0]), set(dv.index).issubset(L.index)])
+    is_valid = all([is_numeric_dtype(dv.iloc[:,0]), (get_sector_positions(dv, L, model) != -1).all()])
     return(is_valid)
 
-def format_demand_vector(dv, L):
+def format_demand_vector(dv, L, model = None):
     '''
     Format a named demand vector with partial sectors to have all the rows and ordering needed
 
     Arguments:
-    dv: a user provided demand vector. See calculateEEIOModel()
-    L:  the L matrix for the given model, used as a reference
+    dv:     a user provided demand vector. See calculateEEIOModel()
+    L:      the L matrix for the given model, used as a reference
+    model:  the model L belongs to. If given, sectors are looked up in the model code index.
 
     return: A DataFrame with values for all names in L, and ordered like L
     '''
-    # create zero demand vector with row for each columns in L and update rows with matching index in user-specified dv
+    # create zero demand vector with row for each columns in L and fill the rows of the
+    # user-specified sectors, looked up by position in the sectors of L
     a = np.zeros(shape=(L.shape[0], 1))
-    d = pd.DataFrame(a, index=L.index)
-
-    # ensure column and index names match so new DataFrame is properly updated.
-    d.columns = [0]
-    dv.columns = [0]
+    a[get_sector_positions(dv, L, model), 0] = dv.iloc[:, 0].fillna(0).to_numpy(dtype=float)
+    d = pd.DataFrame(a, index=L.index, columns=[0])
     d.index.rename('', inplace=True)
-    dv.index.rename('', inplace=True)
-
-    d.update(dv)
     return(d)
 
+def get_sector_positions(dv, L, model = None):
+    '''
+    Look up the positions of the sectors of a demand vector in the sectors of L.
+
+    Arguments:
+    dv:     a user provided demand vector
+    L:      the L matrix (or io_functions.LeontiefSolver) for the given model
+    model:  the model L belongs to, or None
+
+    return: An integer array of positions, -1 for sectors that are not in L.
+    '''
+    index = L.index if isinstance(L.index, pd.Index) else pd.Index(L.index)
+    if model is not None:
+        # Where L is ordered like the model commodities (or industries for industry-by-industry
+        # models), use the code index kept on the model
+        table = "Industries" if model.specs.get('CommodityorIndustryType') == "Industry" else "Commodities"
+        if table in model.__dict__ and model.is_code_index_of(table, index):
+            return(model.get_code_positions(table, dv.index))
+    # The index of L keeps its hash table between lookups
+    return(index.get_indexer(dv.index))
+
 def extract_and_format_demand_vector(file_path, demand_name, model):
     '''
     #' Read demand vector from a csv file and format for use in model calculations
@@ -20,6 +20,12 @@ def disaggregate_model(model):
     logging.info("Initializing Disaggregation of IO tables...")
 
     for disagg in model.DisaggregationSpecs:
+        # Positions of the original sector in the sector lists, which the multi-year output
+        # tables are ordered like, looked up before the lists are disaggregated
+        original_positions = {
+            output_type: model.get_code_positions(table, [disagg['OriginalSectorCode']])[0]
+            for output_type, table in [("Commodity", "Commodities"), ("Industry", "Industries")]
+        }
         # Disaggregating sector lists 
         model.Commodities = disaggregate_sector_dfs(model, disagg, "Commodity")
         model.Industries = disaggregate_sector_dfs(model, disagg, "Industry")
@@ -57,8 +63,10 @@ def disaggregate_model(model):
             model.CommodityOutput = np.sum(model.UseTransactions, axis=1) + np.sum(model.UseValueAdded, axis=1)
 
         # Disaggregating MultiyearIndustryOutput and MultiYearCommodityOutput 
-        model.MultiYearCommodityOutput = disaggregate_multi_year_output(model, disagg, output_type = "Commodity")
-        model.MultiYearIndustryOutput = disaggregate_multi_year_output(model, disagg, output_type = "Industry")
+        model.MultiYearCommodityOutput = disaggregate_multi_year_output(model, disagg, output_type = "Commodity",
+                                                                        original_position = original_positions["Commodity"])
+        model.MultiYearIndustryOutput = disaggregate_multi_year_output(model, disagg, output_type = "Industry",
+                                                                       original_position = original_positions["Industry"])
 
 
 
@@ -206,23 +214,33 @@ def disaggregate_margins(model, disagg):
     logging.debug("Function not implemented")
     sys.exit()
 
-def disaggregate_multi_year_output(model, disagg, output_type = "Commodity"):
+def disaggregate_multi_year_output(model, disagg, output_type = "Commodity", original_position = None):
    #' Disaggregate MultiYear Output model objects
     #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
     #' @param disagg Specifications for disaggregating the current Table
     #' @param output_type A string that indicates whether the Commodity or Industry output should be disaggregated
+    #' @param original_position Row position of the original sector in the output table. If None, it is
+    #' looked up in the model code index of the (not yet disaggregated) Commodities or Industries.
     #' @return model A dataframe with the disaggregated GDPGrossOutputIO by year 
     if output_type == "Industry":
         originalOutput = model.MultiYearIndustryOutput
+        sector_table = "Industries"
     else:
         #assume commodity if industry is not specified
         originalOutput = model.MultiYearCommodityOutput
+        sector_table = "Commodities"
     
     disaggRatios = disaggregated_ratios(model, disagg, output_type)
     # Obtain row with original vector in GDPGrossOutput object
-    #TODO: I don't understand what this code is supposed to do exactly. Will have to write tests for the actual code to see behavior
-    originalVectorIndex = 0 # r code seems to assume this will be a single number, but also allows it to be a series???
-    originalVector = originalOutput[originalOutput.index == disagg['OriginalSectorCode']]
+    # The output tables are ordered like the model sector lists
+    if original_position is None:
+        original_position = model.get_code_positions(sector_table, [disagg['OriginalSectorCode']])[0]
+    if original_position < 0:
+        msg = f"{disagg['OriginalSectorCode']} is not a model {output_type.lower()}, cannot disaggregate its output."
+        logging.error(msg)
+        sys.exit(msg)
+    originalVectorIndex = int(original_position)
+    originalVector = originalOutput.iloc[[originalVectorIndex]]
     # Create new rows where disaggregated values will be stored
     disaggOutput = pd.DataFrame(
         np.tile(originalVector.values, reps=(len(disagg['DisaggregatedSectorCodes']), 1)),
@@ -230,18 +248,18 @@ def disaggregate_multi_year_output(model, disagg, output_type = "Commodity"):
     )
 
     # apply ratios to values
-    disaggOutput = disaggOutput * disaggRatios.T()
+    disaggOutput = disaggOutput * np.asarray(disaggRatios, dtype=float).reshape(-1, 1)
     
     # rename rows
     disaggOutput.index = disagg['DisaggregatedSectorCodes']
 
-    # bind new values to original table
-    newOutputTotals = pd.concat([originalVector, disaggOutput, originalOutput])
-
-    ''' R code for comparison because I am not sure about the translation of this part
-    #bind new values to original table
-    newOutputTotals <- rbind(originalOutput[1:originalVectorIndex-1,], disaggOutput, originalOutput[-(1:originalVectorIndex),])
-    '''
+    # bind new values to original table in place of the original vector
+    newOutputTotals = pd.concat([
+        originalOutput.iloc[:originalVectorIndex],
+        disaggOutput,
+        originalOutput.iloc[originalVectorIndex + 1:]
+    ])
+    return(newOutputTotals)
 
 def disaggregated_ratios(model, disagg, output_type = "Commodity"):
     '''
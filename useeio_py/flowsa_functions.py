@@ -3,52 +3,116 @@
 '''
 Functions for handling data from flowsa, https://github.com/USEPA/flowsa
 '''
+import logging
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from .utility_functions import load_data_commons_file, map_location_codes_to_names
+
+# Flow types kept in satellite tables
+acceptable_flow_types = ["ELEMENTARY_FLOW", "WASTE_FLOW"]
+# FlowBySector columns used for satellite tables; other columns are not read
+fbs_fields = ["Flowable", "Class", "SectorProducedBy", "SectorConsumedBy", "Context", "Location", "LocationSystem",
+              "FlowAmount", "Unit", "FlowType", "Year", "MeasureofSpread", "Spread", "DistributionType", "Min", "Max",
+              "DataReliability", "TemporalCorrelation", "GeographicalCorrelation", "TechnologicalCorrelation",
+              "DataCollection", "MetaSources", "FlowUUID"]
+# Number of rows per batch when streaming FlowBySector files
+fbs_batch_size = 250000
+
+
+def collapse_sector_columns(fbs):
+    '''
+    Collapse the SectorProducedBy and SectorConsumedBy columns of a FlowBySector df into one
+    Sector column based on FlowType, and drop them.
+
+    Arguments:
+    fbs:    A FlowBySector df.
+
+    return: The df with a Sector column in place of the sector produced/consumed by columns.
+    '''
+    flow_type = fbs['FlowType'].to_numpy()
+    produced = fbs['SectorProducedBy']
+    consumed = fbs['SectorConsumedBy']
+    elementary = flow_type == 'ELEMENTARY_FLOW'
+    waste = flow_type == 'WASTE_FLOW'
+    # Conditions in order of precedence, the first that holds sets the sector
+    conditions = [
+        elementary & consumed.isin(['F010', 'F0100', 'F01000']).to_numpy()
+            & produced.isin(['22', '221', '2213', '22131', '221310']).to_numpy(),
+        elementary & consumed.isna().to_numpy(),
+        elementary & produced.isna().to_numpy(),
+        waste & produced.isna().to_numpy(),
+        waste,
+        flow_type == 'TECHNOSPHERE_FLOW',
+    ]
+    choices = [consumed, produced, consumed, consumed, produced, consumed]
+    sector = np.select(conditions, [c.to_numpy(dtype = object) for c in choices], default = None)
+    fbs = fbs.drop(columns = ['SectorProducedBy', 'SectorConsumedBy'])
+    fbs['Sector'] = sector
+    return(fbs)
+
+def read_flow_by_sector_batches(file, flow_types = None, columns = None, batch_size = fbs_batch_size):
+    '''
+    Stream a FlowBySector parquet file in batches with collapsed sector columns.
+    Only the requested columns are read and rows of other flow types are skipped while
+    reading, so at most one batch of the file is held in memory.
+
+    Arguments:
+    file:       Path of a FlowBySector parquet file.
+    flow_types: str list, FlowType values to keep. All rows are read if None.
+    columns:    str list, columns to read. Defaults to the columns in fbs_fields.
+    batch_size: Maximum number of rows per batch.
+
+    return: A generator of FlowBySector collapsed dfs.
+    '''
+    dataset = ds.dataset(file, format = "parquet")
+    columns = fbs_fields if columns is None else columns
+    columns = [col for col in columns if col in dataset.schema.names]
+    row_filter = None if flow_types is None else ds.field("FlowType").isin(flow_types)
+    for batch in dataset.to_batches(columns = columns, filter = row_filter, batch_size = batch_size):
+        if batch.num_rows > 0:
+            yield(collapse_sector_columns(batch.to_pandas()))
+
+def get_flow_by_sector_collapsed_batches(sat_spec, batch_size = fbs_batch_size):
+    '''
+    Stream flowsa's static FlowBySector file of a satellite table spec in batches of
+    sector by region totals.
+
+    Arguments:
+    sat_spec:   A standard specification for a single satellite table.
+    batch_size: Maximum number of rows per batch.
+
+    return: A generator of prepared FlowBySector collapsed dfs (see prepare_flow_by_sector_collapsed_for_satellite()).
+    '''
+    f = load_data_commons_file(sat_spec['StaticFile'])
+    for fbs in read_flow_by_sector_batches(f, acceptable_flow_types, batch_size = batch_size):
+        yield(prepare_flow_by_sector_collapsed_for_satellite(fbs))
 
 def get_flow_by_sector_collapsed(sat_spec):
     '''
     #' Load flowsa's FlowBySector df and collapse sector columns
+    #' The whole df is held in memory; satellite table builds stream static NAICS-coded files
+    #' instead, see load_satellites.generate_bea_tbs_from_flow_by_sector()
     #' @param sat_spec, a standard specification for a single satellite table
     #' @return A data frame for flowsa data in sector by region totals format
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
     # Access flowsa getFlowBySector_collapsed by indicating StaticSource: False
-    if (!(sat_spec$StaticSource)) {
-        method_name <- sub(".parquet$", "", sat_spec$StaticFile)
-        flowsa <- reticulate::import("flowsa")
-        fbs_collapsed <- flowsa$collapse_FlowBySector(method_name)
-        # checks columns that are all None values and converts to NA
-        for (i in colnames(fbs_collapsed)) {
-        if (is.list(fbs_collapsed[[i]])) {
-            if (i == 'MetaSources') {
-            # MetaSources must be a string if all None
-            fbs_collapsed[ , i] <- ""
-            } else {
-            fbs_collapsed[ , i] <- NA
-            }
-        }
-        }
-    } else {
-        f <- loadDataCommonsfile(sat_spec$StaticFile)
-        fbs <- as.data.frame(arrow::read_parquet(f))
-        # collapse the FBS sector columns into one column based on FlowType
-        fbs$Sector <- NA
-        fbs$Sector <- ifelse(fbs$FlowType=='TECHNOSPHERE_FLOW', fbs$SectorConsumedBy, fbs$Sector)
-        fbs$Sector <- ifelse(fbs$FlowType=='WASTE_FLOW', fbs$SectorProducedBy, fbs$Sector)
-        fbs$Sector <- ifelse((fbs$FlowType=='WASTE_FLOW') & (is.na(fbs$SectorProducedBy)), fbs$SectorConsumedBy, fbs$Sector)
-        fbs$Sector <- ifelse((fbs$FlowType=='ELEMENTARY_FLOW') & (is.na(fbs$SectorProducedBy)), fbs$SectorConsumedBy, fbs$Sector)
-        fbs$Sector <- ifelse((fbs$FlowType=='ELEMENTARY_FLOW') & (is.na(fbs$SectorConsumedBy)), fbs$SectorProducedBy, fbs$Sector)
-        fbs$Sector <- ifelse((fbs$FlowType=='ELEMENTARY_FLOW') & (fbs$SectorConsumedBy %in% c('F010', 'F0100', 'F01000')) &
-                            (fbs$SectorProducedBy %in% c('22', '221', '2213', '22131', '221310')), fbs$SectorConsumedBy, fbs$Sector)
-        # drop sector consumed/produced by columns
-        fbs_collapsed <- fbs[,!(names(fbs) %in% c('SectorProducedBy', 'SectorConsumedBy'))]
-    }
-    # reorder col
-    fbs_collapsed <- prepareFlowBySectorCollapsedforSatellite(fbs_collapsed)
-
+    if not sat_spec['StaticSource']:
+        import flowsa
+        method_name = sat_spec['StaticFile'].removesuffix(".parquet")
+        fbs_collapsed = flowsa.collapse_FlowBySector(method_name)
+        # MetaSources must be a string if all None
+        if fbs_collapsed['MetaSources'].isna().all():
+            fbs_collapsed['MetaSources'] = ""
+        # reorder col
+        fbs_collapsed = prepare_flow_by_sector_collapsed_for_satellite(fbs_collapsed)
+    else:
+        # collapse the FBS sector columns batch by batch, reading only elementary and waste flows,
+        # and concatenate the whole file
+        batches = list(get_flow_by_sector_collapsed_batches(sat_spec))
+        fbs_collapsed = pd.concat(batches, ignore_index = True) if batches else None
     return(fbs_collapsed)
-'''
 
 def prepare_flow_by_sector_collapsed_for_satellite(fbsc):
     '''
@@ -58,19 +122,14 @@ def prepare_flow_by_sector_collapsed_for_satellite(fbsc):
     #' @param fbsc A FlowBySector collapsed df from flowsa
     #' @return A data frame of sector by region totals
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    # Replace Python type None with NA
-    fbsc <- replaceNonewithNA(fbsc)
     # If context is NA replace with blank
-    fbsc[,"Context"][is.na(fbsc[,"Context"])] <- ""
+    fbsc['Context'] = fbsc['Context'].fillna("")
     # Filter technosphere flows
-    acceptable_types <- c("ELEMENTARY_FLOW", "WASTE_FLOW")
-    fbsc <- fbsc[fbsc$FlowType %in% acceptable_types, ]
+    fbsc = fbsc[fbsc['FlowType'].isin(acceptable_flow_types)].copy()
     # Map location codes to names
-    fbsc$Location <- mapLocationCodestoNames(fbsc$Location, unique(fbsc$LocationSystem))
+    for location_system in fbsc['LocationSystem'].unique():
+        rows = (fbsc['LocationSystem'] == location_system).to_numpy()
+        fbsc.loc[rows, 'Location'] = map_location_codes_to_names(fbsc.loc[rows, 'Location'], location_system)
     # Remove unused data
-    fbsc[, c("Class", "FlowType", "LocationSystem", "MeasureofSpread", "Spread")] <- NULL
-    return(fbsc)
-    '''
\ No newline at end of file
+    fbsc = fbsc.drop(columns = ["Class", "FlowType", "LocationSystem", "MeasureofSpread", "Spread"], errors = "ignore")
+    return(fbsc)
\ No newline at end of file
@@ -7,9 +7,13 @@ import logging
 import importlib.resources
 import pandas as pd
 import numpy as np
-from . import (utility_functions)
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+from . import (utility_functions, build_profiler)
 
 #TODO
+@build_profiler.profiled
 def adjust_output_by_cpi(output_year, reference_year, location_acronym, is_ro_us, model, output_type):
     '''
     #' Adjust Industry output based on CPI.
@@ -41,37 +45,85 @@ def adjust_output_by_cpi(output_year, reference_year, location_acronym, is_ro_us
     return(AdjustedOutput)
     '''
 
+def use_sparse_matrices(model):
+    '''
+    Check whether the model is built with the sparse matrix backend,
+    i.e. model.specs['MatrixBackend'] is "sparse". The default backend is "dense".
+    '''
+    return(model.specs.get('MatrixBackend', "dense") == "sparse")
+
+
 #DONE: Implementation checked and passes
-def normalize_io_transactions(io_transactions_df, io_output_df):
+@build_profiler.profiled
+def normalize_io_transactions(io_transactions_df, io_output_df, sparse = False, zero_output = "replace"):
     '''
-    Derive IO coefficients
+    Derive IO coefficients by dividing each column of the transactions by output.
 
     Arguments:
     IO_transactions_df: IO transactions of the model in dataframe format.
     IO_output_df: Output of the model in dataframe format.
+    sparse: If True, return the coefficients with the sparse matrix backend.
+    zero_output: How to handle sectors with zero output: "replace" divides by an output of 1E-3
+                 instead (as useeior does), "zero" sets their coefficients to 0, "nan" sets them
+                 to NaN, and "error" stops with an error.
     
-    return: A matrix.
+    return: A matrix (dataframe), with the sparse matrix backend if sparse.
     '''
-    Z = io_transactions_df.to_numpy()
-    x = utility_functions.unlist(io_output_df)
-    x_hat = np.diag(x)
-    A = np.matmul(Z, np.linalg.inv(x_hat)) # R code: A <- Z %*% solve(x_hat)
-    A = pd.DataFrame(A, index=io_transactions_df.index)
-    A.columns=io_transactions_df.columns
+    x = utility_functions.unlist(io_output_df).astype(float)
+    zero = x == 0
+    if zero_output not in ["replace", "zero", "nan", "error"]:
+        msg = f"{zero_output} is not a valid zero output policy."
+        logging.error(msg)
+        sys.exit(msg)
+    if zero.any() and zero_output == "error":
+        msg = f"Zero output for {list(io_transactions_df.columns[zero])}, cannot normalize IO transactions."
+        logging.error(msg)
+        sys.exit(msg)
+    if zero_output == "replace":
+        # R code: x[x == 0] <- 1E-3
+        x[zero] = 1E-3
+        zero = x == 0
+    # Scale each column of Z by 1/x instead of forming and inverting diag(x)
+    # R code: A <- Z %*% solve(x_hat)
+    x_inv = np.divide(1, x, out=np.zeros_like(x), where=~zero)
+    if sparse:
+        Z = utility_functions.matrix_values(utility_functions.to_sparse_matrix(io_transactions_df))
+        A = utility_functions.to_sparse_matrix(Z.multiply(x_inv.reshape(1, -1)).tocsc(),
+                                               index=io_transactions_df.index, columns=io_transactions_df.columns)
+        if zero_output == "nan":
+            for j in np.flatnonzero(zero):
+                A.isetitem(j, pd.arrays.SparseArray(np.full(A.shape[0], np.nan), fill_value=0.0))
+    else:
+        if zero_output == "nan":
+            x_inv[zero] = np.nan
+        A = pd.DataFrame(io_transactions_df.to_numpy(dtype=float) * x_inv,
+                         index=io_transactions_df.index, columns=io_transactions_df.columns)
 
     return(A) 
 
 
-#TODO
+#DONE
+@build_profiler.profiled
 def generate_direct_requirements_from_use(model, domestic):
     '''
-    #' Generate Direct Requirements matrix from Use table.
-    #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
-    #' @param domestic A logical parameter indicating whether to calculate DR or Domestic DR.
-    #' @return Direct Requirements matrix of the model.
+    Generate Direct Requirements matrix from Use table.
+
+    Arguments:
+    model:      A complete EEIO model: a list with USEEIO model components and attributes.
+    domestic:   A logical parameter indicating whether to calculate DR or Domestic DR.
+
+    return: Direct Requirements matrix of the model.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    # The matrix is cached on the model until the Use table or industry output is replaced
+    if domestic:
+        B = model.get_derived_matrix("DomesticDirectRequirements",
+                                     lambda m: _generate_direct_requirements_from_use(m, True),
+                                     ["DomesticUseTransactions", "IndustryOutput"])
+    else:
+        B = model.get_derived_matrix("DirectRequirements",
+                                     lambda m: _generate_direct_requirements_from_use(m, False),
+                                     ["UseTransactions", "IndustryOutput"])
+    return(B)
     '''
     # Generate direct requirements matrix (commodity x industry) from Use, see Miller and Blair section 5.1.1
     if (domestic==TRUE) {
@@ -82,36 +134,62 @@ def generate_direct_requirements_from_use(model, domestic):
     return(B)
     '''
 
-#TODO: Test implementation
+def _generate_direct_requirements_from_use(model, domestic):
+    # Generate direct requirements matrix (commodity x industry) from Use, see Miller and Blair section 5.1.1
+    if domestic:
+        B = normalize_io_transactions(model.DomesticUseTransactions, model.IndustryOutput, use_sparse_matrices(model),
+            zero_output = model.specs.get('ZeroOutputPolicy', "replace")) # B = U %*% solve(x_hat)
+    else:
+        B = normalize_io_transactions(model.UseTransactions, model.IndustryOutput, use_sparse_matrices(model),
+            zero_output = model.specs.get('ZeroOutputPolicy', "replace")) # B = U %*% solve(x_hat)
+    return(B)
+
+#DONE
+@build_profiler.profiled
 def generate_market_shares_from_make(model): 
     '''
     Generate Market Shares matrix from Make table.
+    The matrix is cached on the model until MakeTransactions or CommodityOutput is replaced.
     
     Argument:
     model:  A complete EEIO model: a list with USEEIO model components and attributes.
     
     return: Market Shares matrix of the model.
     '''
+    D = model.get_derived_matrix("MarketShares", _generate_market_shares_from_make,
+                                 ["MakeTransactions", "CommodityOutput"])
+    return(D)
+
+def _generate_market_shares_from_make(model):
     # Generate market shares matrix (industry x commodity) from Make, see Miller and Blair section 5.3.1
-    D = normalize_io_transactions(model.MakeTransactions, model.CommodityOutput) # D = V %*% solve(q_hat)
+    D = normalize_io_transactions(model.MakeTransactions, model.CommodityOutput, use_sparse_matrices(model),
+        zero_output = model.specs.get('ZeroOutputPolicy', "replace")) # D = V %*% solve(q_hat)
     # useeior comment: Put in code here for adjusting marketshares to remove scrap
     return(D)
 
 
 #DONE: Implementation checked and passes
+@build_profiler.profiled
 def generate_commodity_mix_matrix(model):
     '''
     Generate Commodity Mix matrix.
+    The matrix is cached on the model until MakeTransactions or IndustryOutput is replaced.
 
     Argument:
     model:  A complete EEIO model: a list with USEEIO model components and attributes.
 
     return: Commodity Mix matrix of the model.
     '''
+    C = model.get_derived_matrix("CommodityMix", _generate_commodity_mix_matrix,
+                                 ["MakeTransactions", "IndustryOutput"])
+    return(C)
+
+def _generate_commodity_mix_matrix(model):
     # Generate commodity mix matrix (commodity x industry), see Miller and Blair section 5.3.2
-    C = normalize_io_transactions(np.transpose(model.MakeTransactions), model.IndustryOutput) # C = V' %*% solve(x_hat)
+    C = normalize_io_transactions(np.transpose(model.MakeTransactions), model.IndustryOutput, use_sparse_matrices(model),
+        zero_output = model.specs.get('ZeroOutputPolicy', "replace")) # C = V' %*% solve(x_hat)
 
-    industry_output_fractions = np.sum(C.to_numpy(), axis = 0)
+    industry_output_fractions = np.asarray(utility_functions.matrix_values(C).sum(axis = 0)).ravel()
     err = abs(1-industry_output_fractions)>0.01
     if sum(err) > 0:
         msg = "Error in commodity mix"
@@ -121,6 +199,7 @@ def generate_commodity_mix_matrix(model):
 
 
 #DONE
+@build_profiler.profiled
 def transform_industry_output_to_commodity_output_for_year(year: int | str, model: "USEEIOModel"):
     '''
     #' Generate Commodity output by transforming Industry output using Commodity Mix matrix.
@@ -128,11 +207,7 @@ def transform_industry_output_to_commodity_output_for_year(year: int | str, mode
     #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
     #' @return A dataframe contains adjusted Commodity output.
     '''
-    # Generate adjusted industry output by location
-    IndustryOutput = model.MultiYearIndustryOutput[str(year)]
-    # Use CommodityMix to transform IndustryOutput to CommodityOutput
-    CommodityMix = generate_commodity_mix_matrix(model)
-    CommodityOutput = np.matmul(CommodityMix, IndustryOutput)
+    CommodityOutput = transform_industry_output_to_commodity_output_for_years([year], model)[str(year)]
     return(CommodityOutput)
     '''
     # Generate adjusted industry output by location
@@ -143,7 +218,29 @@ def transform_industry_output_to_commodity_output_for_year(year: int | str, mode
     return(CommodityOutput)
     '''
 
+#DONE
+@build_profiler.profiled
+def transform_industry_output_to_commodity_output_for_years(years, model):
+    '''
+    Generate Commodity output for many years by transforming the (industries x years) block
+    of Industry output with the Commodity Mix matrix in a single matrix product.
+
+    Arguments:
+    years:  List of years of Industry output (columns of model.MultiYearIndustryOutput).
+    model:  A complete EEIO model: a list with USEEIO model components and attributes.
+
+    return: A dataframe of Commodity output with commodities as rows and years as columns.
+    '''
+    year_cols = [str(year) for year in years]
+    # Generate adjusted industry output by location
+    IndustryOutput = model.MultiYearIndustryOutput[year_cols]
+    # Use CommodityMix to transform IndustryOutput to CommodityOutput
+    CommodityMix = generate_commodity_mix_matrix(model)
+    CommodityOutput = utility_functions.matrix_values(CommodityMix) @ IndustryOutput.reindex(CommodityMix.columns).to_numpy(dtype=float)
+    return(pd.DataFrame(CommodityOutput, index=CommodityMix.index, columns=year_cols))
+
 #DONE: Implementation checked and passes
+@build_profiler.profiled
 def transform_industry_cpi_to_commodity_cpi_for_year(year, model):
     '''
     #' Generate Commodity CPI by transforming Industry CPI using Commodity Mix matrix.
@@ -151,36 +248,80 @@ def transform_industry_cpi_to_commodity_cpi_for_year(year, model):
     #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
     #' @return A dataframe contains adjusted Commodity CPI.
     '''
+    CommodityCPI = transform_industry_cpi_to_commodity_cpi_for_years([year], model)[str(year)].to_numpy()
+    return(CommodityCPI)
+
+#DONE
+@build_profiler.profiled
+def transform_industry_cpi_to_commodity_cpi_for_years(years, model):
+    '''
+    Generate Commodity CPI for many years by transforming the (years x industries) block
+    of Industry CPI with the Market Shares matrix in a single matrix product.
+
+    Arguments:
+    years:  List of years of Industry CPI (columns of model.MultiYearIndustryCPI).
+    model:  A complete EEIO model: a list with USEEIO model components and attributes.
+
+    return: A dataframe of Commodity CPI with commodities as rows and years as columns.
+    '''
+    year_cols = [str(year) for year in years]
     # Generate adjusted industry CPI by location
-    IndustryCPI = model.MultiYearIndustryCPI[f"{year}"]
+    IndustryCPI = model.MultiYearIndustryCPI[year_cols]
     # Use MarketShares (of model IO year) to transform IndustryCPI to CommodityCPI
     MarketShares = generate_market_shares_from_make(model)
-    # The transformation is essentially a I x 1 matrix %*% a C x I matrix which yields a C x 1 matrix
-    CommodityCPI = np.matmul(IndustryCPI, MarketShares.to_numpy()) # CommodityCPI <- as.numeric(IndustryCPI %*% MarketShares)
+    # The transformation is essentially a Y x I matrix %*% a I x C matrix which yields a Y x C matrix
+    CommodityCPI = np.transpose(IndustryCPI.reindex(MarketShares.index).to_numpy(dtype=float)) @ utility_functions.matrix_values(MarketShares)
+    CommodityCPI = np.transpose(np.asarray(CommodityCPI))
     # Non-industry sectors would have CommodityCPI of 0
     # To avoid interruption in later calculations, they are forced to 100
     CommodityCPI[CommodityCPI == 0] = 100
     # Validation: check if IO year CommodityCPI is 100
-    if (year == 2012):
-        err = abs(100-CommodityCPI) > 0.3
+    if "2012" in year_cols:
+        err = abs(100-CommodityCPI[:, year_cols.index("2012")]) > 0.3
         if sum(err) > 0:
             msg = "Error in CommodityCPI"
             logging.error(msg)
             sys.exit(msg)
-    return(CommodityCPI)
+    return(pd.DataFrame(CommodityCPI, index=MarketShares.columns, columns=year_cols))
 
 
-#TODO
+#DONE
+@build_profiler.profiled
 def transform_direct_requirements_with_market_shares(B, D, model):
     '''
-    #' Transform Direct Requirements matrix with Market Shares matrix, works for both commodity-by-commodity and industry-by-industry model types.
-    #' @param B Marginal impact per unit of the environmental flows.
-    #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
-    #' @param D Market Shares matrix.
-    #' @return Direct Requirements matrix.
+    Transform Direct Requirements matrix with Market Shares matrix, works for both
+    commodity-by-commodity and industry-by-industry model types.
+    Sparse backend matrices are multiplied as scipy.sparse matrices.
+
+    Arguments:
+    B:      Direct Requirements matrix (commodity x industry).
+    D:      Market Shares matrix (industry x commodity).
+    model:  A complete EEIO model: a list with USEEIO model components and attributes.
+
+    return: Direct Requirements matrix.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    # Only generate result if the column names of the direct requirements table match the row names of the market shares matrix
+    if not (list(B.columns) == list(D.index) and list(D.columns) == list(B.index)):
+        msg = "Column names of the direct requirements do not match the row names of the market shares matrix."
+        logging.error(msg)
+        sys.exit(msg)
+    if model.specs['CommodityorIndustryType'] == "Commodity":
+        # commodity model DR_coeffs = dr %*% ms (CxI x IxC) = CxC
+        A = utility_functions.matrix_values(B) @ utility_functions.matrix_values(D)
+        index, columns = B.index, D.columns
+    elif model.specs['CommodityorIndustryType'] == "Industry":
+        # industry model DR_coeffs = ms %*% dr (IxC x CxI) = IxI
+        A = utility_functions.matrix_values(D) @ utility_functions.matrix_values(B)
+        index, columns = D.index, B.columns
+    else:
+        msg = "CommodityorIndustryType not specified or incorrectly specified for model."
+        logging.error(msg)
+        sys.exit(msg)
+    if scipy.sparse.issparse(A):
+        A = utility_functions.to_sparse_matrix(A, index=index, columns=columns)
+    else:
+        A = pd.DataFrame(A, index=index, columns=columns)
+    return(A)
     '''
     # Only generate result if the column names of the direct requirements table match the row names of the market shares matrix
     if (all(colnames(B) == rownames(D)) && all(colnames(D) == rownames(B))) {
@@ -203,6 +344,7 @@ def transform_direct_requirements_with_market_shares(B, D, model):
     '''
 
 #TODO: test implementation
+@build_profiler.profiled
 def transform_final_demand_with_market_shares(fdf, model): 
     '''
     Transform Final Demand (commodity x sector) with Market Shares matrix
@@ -216,18 +358,107 @@ def transform_final_demand_with_market_shares(fdf, model):
     '''
     D = generate_market_shares_from_make(model)
     # See Miller and Blair section 5.3.7 (pg 197)
-    Fmatrix = np.matmul(D, fdf)
-    return(pd.DataFrame(Fmatrix))
+    Fmatrix = utility_functions.matrix_values(D) @ np.asarray(fdf, dtype=float)
+    return(pd.DataFrame(Fmatrix, index=D.index, columns=fdf.columns))
 
-#TODO
+#DONE
+class LeontiefSolver:
+    '''
+    Total requirements solver for a Direct Requirements matrix.
+
+    (I - A) is LU-factorized once when the solver is created and the factors are
+    reused for every request, so s = L y is answered by back-substitution and the
+    Leontief inverse L = (I - A)^-1 is only materialized when it is asked for
+    (e.g. when the model matrices are written out).
+    If A uses the sparse matrix backend, (I - A) is factorized with a sparse LU (SuperLU).
+
+    Arguments:
+    A:  Direct Requirements matrix (dataframe) with sectors as index and columns.
+    '''
+    def __init__(self, A):
+        self.index = A.index
+        self.columns = A.columns
+        self.sparse = utility_functions.is_sparse_matrix(A)
+        if self.sparse:
+            I = scipy.sparse.identity(A.shape[0], format="csc")
+            self._lu = scipy.sparse.linalg.splu((I - utility_functions.matrix_values(A)).tocsc())
+        else:
+            I = np.identity(A.shape[0])
+            self._lu = scipy.linalg.lu_factor(I - np.asarray(A, dtype=float))
+        self._L = None
+
+    @property
+    def shape(self):
+        return(self._lu.shape if self.sparse else self._lu[0].shape)
+
+    def _solve(self, b, trans = False):
+        # Solve (I - A) x = b, or (I - A)' x = b if trans, with the cached factors
+        if self.sparse:
+            return(self._lu.solve(b, trans="T" if trans else "N"))
+        return(scipy.linalg.lu_solve(self._lu, b, trans=1 if trans else 0))
+
+    def solve(self, demand):
+        '''
+        Calculate the scaling vector(s) s = L y without forming L.
+
+        Argument:
+        demand: Demand vector or (sectors x k) demand matrix, ordered like A.
+
+        return: Scaling vector(s) in the same form as demand (dataframe with sectors
+                as index if demand is a Series/DataFrame, otherwise an array).
+        '''
+        s = self._solve(np.asarray(demand, dtype=float))
+        if isinstance(demand, pd.DataFrame):
+            return(pd.DataFrame(s, index=self.index, columns=demand.columns))
+        if isinstance(demand, pd.Series):
+            return(pd.DataFrame(s, index=self.index, columns=[0]))
+        return(s)
+
+    def left_multiply(self, B):
+        '''
+        Calculate B %*% L without forming L, e.g. M = B L or N = D L.
+        Solves (I - A)' X' = B' using the cached factors.
+        The result is dense for both backends, since L (and so B L) has few zeros.
+
+        Argument:
+        B:  A matrix (dataframe) with columns ordered like A.
+
+        return: A dataframe with the rows of B and the columns of A.
+        '''
+        B_values = utility_functions.matrix_values(B)
+        if scipy.sparse.issparse(B_values):
+            B_values = B_values.toarray()
+        X = self._solve(np.transpose(B_values), trans=True)
+        index = B.index if isinstance(B, pd.DataFrame) else None
+        return(pd.DataFrame(np.transpose(X), index=index, columns=self.columns))
+
+    def inverse(self):
+        '''
+        Materialize the Leontief inverse L. The result is cached on the solver.
+
+        return: L as a dataframe with the labels of A.
+        '''
+        if self._L is None:
+            L = self._solve(np.identity(self.shape[0]))
+            self._L = pd.DataFrame(L, index=self.index, columns=self.columns)
+        return(self._L)
+
+
+#DONE
+@build_profiler.profiled
 def calculate_leontif_inverse(A):
     '''
-    #' Calculate Leontief inverse from direct requirements matrix.
-    #' @param A Direct Requirements matrix.
-    #' @return Leontief inverse.
+    Calculate Leontief inverse from direct requirements matrix.
+    Prefer a LeontiefSolver when only scaling vectors are needed; this function is
+    meant for writers and other consumers of an explicit L.
+
+    Argument:
+    A:  Direct Requirements matrix.
+
+    return: Leontief inverse.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    L = LeontiefSolver(A).inverse()
+    return(L)
     '''
     I <- diag(nrow(A))
     L <- solve(I-A)
@@ -235,32 +466,53 @@ def calculate_leontif_inverse(A):
     '''
 
 #DONE
-def generate_domestic_use(use, model): 
+@build_profiler.profiled
+def load_import_matrix(model):
     '''
-    Generate domestic Use table by adjusting Use table based on Import matrix.
+    Load the BEA Import matrix (before redefinitions) of the model IO year in $.
+    For Sector models, the Summary Import matrix is aggregated to Sector level.
+    Load it once per build and pass it to generate_domestic_use() and
+    generate_international_trade_adjustment_vector().
 
-    Arguments:
-    Use:    dataframe of a Use table
+    Argument:
     model:  An EEIO model object with model specs and crosswalk table loaded
-    
-    return: A Domestic Use table with rows as commodity codes and 
-            columns as industry and final demand codes
+
+    return: An Import matrix with commodity codes as index and
+            industry and final demand codes as columns
     '''
-    # Load Import matrix
     if model.specs["BaseIOLevel"] != "Sector":
-        imp = pd.read_parquet(importlib.resources.files('useeio_py.data2').joinpath(
+        imp = utility_functions.get_named_dataset('useeio_py.data2',
             f"{model.specs['BaseIOLevel']}_Import_{model.specs['IOYear']}_BeforeRedef.parquet"
-        )).set_index('index').select_dtypes(include=['number']) * 1E6
+        ).set_index('index').select_dtypes(include=['number']) * 1E6
         
     else:
-        imp = pd.read_parquet(importlib.resources.files('useeio_py.data2').joinpath(
+        imp = utility_functions.get_named_dataset('useeio_py.data2',
             f"Summary_Import_{model.specs['IOYear']}_BeforeRedef.parquet"
-        )).set_index('index').select_dtypes(include=['number']) * 1E6
+        ).set_index('index').select_dtypes(include=['number']) * 1E6
 
         imp = pd.DataFrame(utility_functions.aggregate_matrix(imp, "Summary", "Sector", model))
+    return(imp)
+
+#DONE
+@build_profiler.profiled
+def generate_domestic_use(use, model, imp = None): 
+    '''
+    Generate domestic Use table by adjusting Use table based on Import matrix.
+
+    Arguments:
+    Use:    dataframe of a Use table
+    model:  An EEIO model object with model specs and crosswalk table loaded
+    imp:    Import matrix from load_import_matrix(). Loaded if not given.
+    
+    return: A Domestic Use table with rows as commodity codes and 
+            columns as industry and final demand codes
+    '''
+    # Load Import matrix
+    if imp is None:
+        imp = load_import_matrix(model)
     
     # subtract import from use
-    domestic_use = use - imp.loc[list(use.index)][list(use.columns)]
+    domestic_use = use - imp.loc[list(use.index), list(use.columns)]
     
     # adjust import column in domestic_use to 0
     # Note: the original values in Import column are essentially the International Trade Adjustment
@@ -274,28 +526,21 @@ def generate_domestic_use(use, model):
     return(domestic_use)
 
 #DONE
-def generate_international_trade_adjustment_vector(use, model):
+@build_profiler.profiled
+def generate_international_trade_adjustment_vector(use, model, imp = None):
     '''
     Generate international trade adjustment vector from Use and Import matrix.
     
     Arguments:
     Use:    dataframe of a Use table
     model:  An EEIO model object with model specs and crosswalk table loaded
+    imp:    Import matrix from load_import_matrix(). Loaded if not given.
 
     return: An international trade adjustment vector with commodity codes as index
     '''
     # Load Import matrix
-    if model.specs["BaseIOLevel"] != "Sector":
-        imp = pd.read_parquet(importlib.resources.files('useeio_py.data2').joinpath(
-            f"{model.specs['BaseIOLevel']}_Import_{model.specs['IOYear']}_BeforeRedef.parquet"
-        )).set_index('index').select_dtypes(include=['number']) * 1E6
-        
-    else:
-        imp = pd.read_parquet(importlib.resources.files('useeio_py.data2').joinpath(
-            f"Summary_Import_{model.specs['IOYear']}_BeforeRedef.parquet"
-        )).set_index('index').select_dtypes(include=['number']) * 1E6
-
-        imp = pd.DataFrame(utility_functions.aggregate_matrix(imp, "Summary", "Sector", model))
+    if imp is None:
+        imp = load_import_matrix(model)
     # Define Import code
     import_code = utility_functions.get_vector_of_codes(
         model.specs['BaseIOSchema'],
@@ -310,5 +555,5 @@ def generate_international_trade_adjustment_vector(use, model):
     # So, InternationalTradeAdjustment = Use$Imports - Import$Imports
     # InternationalTradeAdjustment is essentially 'value of all transportation and insurance services to import' and 'customs duties'
     
-    intl_trade_adj = use[import_code] - imp.loc[list(use.index)][import_code]
+    intl_trade_adj = use[import_code] - imp.loc[list(use.index), import_code]
     return(intl_trade_adj)
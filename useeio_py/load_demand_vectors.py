@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import sys
 import pandas as pd
 import numpy as np
 
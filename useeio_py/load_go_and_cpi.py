@@ -6,6 +6,7 @@ import numpy as np
 import logging
 import importlib.resources
 import sys
+from . import utility_functions
 
 #TODO: test implementation
 def load_national_gross_output_table(specs):
@@ -19,10 +20,9 @@ def load_national_gross_output_table(specs):
     '''
     logging.info("Initializing Gross Output tables...")
     # Load pre-saved Gross Output tables
-    gross_output = pd.read_parquet(
-        importlib.resources.files('useeio_py.data2').joinpath(
-            f"{specs['BaseIOLevel']}_GrossOutput_IO.parquet"
-            )
+    gross_output = utility_functions.get_named_dataset(
+        'useeio_py.data2',
+        f"{specs['BaseIOLevel']}_GrossOutput_IO.parquet"
     ).set_index('index')
     return(gross_output*1e6)
 
@@ -34,8 +34,9 @@ def load_chain_price_index_table(specs):
     #' @return A data.frame of Chain Price Index.
     '''
     logging.info("Initializing Chain Price Index tables...")
-    chain_price_index = pd.read_parquet(importlib.resources.files('useeio_py.data2').joinpath(
+    chain_price_index = utility_functions.get_named_dataset(
+        'useeio_py.data2',
         f"{specs['BaseIOLevel']}_CPI_IO.parquet"
-    )).set_index('index')
+    ).set_index('index')
     
     return(chain_price_index)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 '''Functions for loading and checking indicator data'''
 
+import logging
+import sys
 import pandas as pd
 import numpy as np
 
@@ -6,7 +6,7 @@ import importlib.resources
 import pandas as pd
 from . import (
     utility_functions, io_functions, load_margins, aggregate_functions, disaggregate_functions,
-    hybridization_functions, load_go_and_cpi, stateior_functions
+    hybridization_functions, load_go_and_cpi, stateior_functions, build_profiler
 )
 import numpy as np
 import re
@@ -15,14 +15,14 @@ import sys
 #TODO: Test implementation
 def load_io_data(model, config_paths = None):
     '''
-    Prepare economic components of an EEIO form USEEIO model
+    Prepare economic components of an EEIO form USEEIO model.
+    Each step runs in a build_profiler span.
     '''
-    logging.debug("check")
     # Declare model IO objects
     logging.info("Initializing IO tables...")
     # Load model IO meta
-    logging.debug("calling func...")
-    load_io_meta(model)
+    with build_profiler.span("load_io_meta"):
+        load_io_meta(model)
     # Define IO table names
     io_table_names = [
         "MakeTransactions", "UseTransactions", "DomesticUseTransactions",
@@ -32,132 +32,106 @@ def load_io_data(model, config_paths = None):
     
     # Load IO data
     if model.specs['IODataSource'] == "BEA":
-        logging.debug("calling func...")
-        io_codes = load_io_codes(model)
-        logging.debug("calling func...")
-        national_io_data = load_national_io_data(model, io_codes)
+        with build_profiler.span("load_national_io_data") as io_span:
+            io_codes = load_io_codes(model)
+            national_io_data = load_national_io_data(model, io_codes)
         for name in io_table_names:
             setattr(model, name, national_io_data[name])
+            io_span.set_output(national_io_data[name], name)
     elif model.specs['IODataSource'] == "stateior":
-        logging.debug("calling func...")
-        two_region_state_io_tables = load_two_region_state_io_tables(model)
+        with build_profiler.span("load_two_region_state_io_tables") as io_span:
+            two_region_state_io_tables = load_two_region_state_io_tables(model)
         for name in io_table_names:
             setattr(model, name, two_region_state_io_tables[name])
+            io_span.set_output(two_region_state_io_tables[name], name)
 
     # Add Industry and Commodity Output
-    logging.debug("calling func...")
-    load_commodity_and_industry_output(model)
+    with build_profiler.span("load_commodity_and_industry_output"):
+        load_commodity_and_industry_output(model)
     # Transform model FinalDemand and DomesticFinalDemand to by-industry form
     if model.specs['CommodityorIndustryType']=='Industry':
-        # Keep the orignal FinalDemand (in by-commodity form)
-        model.FinalDemandbyCommodity = model.FinalDemand
-        model.DomesticFinalDemandbyCommodity = model.DomesticFinalDemand
-        model.InternationalTradeAdjustmentbyCommodity = model.InternationalTradeAdjustment
-        logging.debug("calling func...")
-        model.FinalDemand = io_functions.transform_final_demand_with_market_shares(
-            model.FinalDemand, model
-        )
-        logging.debug("calling func...")
-        model.DomesticFinalDemand = io_functions.transform_final_demand_with_market_shares(
-            model.DomesticFinalDemand, model
-        )
-        logging.debug("calling func...")
-        model.InternationalTradeAdjustment = io_functions.transform_final_demand_with_market_shares( 
-                        model.InternationalTradeAdjustment, model
-        )
-        logging.debug("calling func...")
-        model.InternationalTradeAdjustment = utility_functions.unlist(model.InternationalTradeAdjustment)
-        model.InternationalTradeAdjustment = model.InternationalTradeAdjustment.set_index(
-            model.Industries['Code_Loc']
-        )
+        with build_profiler.span("transform_final_demand_to_industry"):
+            # Keep the orignal FinalDemand (in by-commodity form)
+            model.FinalDemandbyCommodity = model.FinalDemand
+            model.DomesticFinalDemandbyCommodity = model.DomesticFinalDemand
+            model.InternationalTradeAdjustmentbyCommodity = model.InternationalTradeAdjustment
+            model.FinalDemand = io_functions.transform_final_demand_with_market_shares(
+                model.FinalDemand, model
+            )
+            model.DomesticFinalDemand = io_functions.transform_final_demand_with_market_shares(
+                model.DomesticFinalDemand, model
+            )
+            model.InternationalTradeAdjustment = io_functions.transform_final_demand_with_market_shares( 
+                            model.InternationalTradeAdjustment, model
+            )
+            model.InternationalTradeAdjustment = utility_functions.unlist(model.InternationalTradeAdjustment)
+            model.InternationalTradeAdjustment = model.InternationalTradeAdjustment.set_index(
+                model.Industries['Code_Loc']
+            )
     # Add Margins Table
-    logging.debug("calling func...")
-    model.Margins = load_margins.get_margins_table(model)
-    
+    with build_profiler.span("get_margins_table") as margins_span:
+        model.Margins = load_margins.get_margins_table(model)
+        margins_span.set_output(model.Margins)
     # Add Chain Price Index (CPI) to model
-    logging.debug("calling func...")
-    model.MultiYearIndustryCPI = load_go_and_cpi.load_chain_price_index_table(model.specs)
-    model.MultiYearIndustryCPI = model.MultiYearIndustryCPI.loc[model.Industries['Code']]
-    model.MultiYearIndustryCPI = model.MultiYearIndustryCPI.set_index(model.Industries['Code_Loc'])
+    with build_profiler.span("load_chain_price_index_table") as cpi_span:
+        model.MultiYearIndustryCPI = load_go_and_cpi.load_chain_price_index_table(model.specs)
+        model.MultiYearIndustryCPI = model.MultiYearIndustryCPI.loc[model.Industries['Code']]
+        model.MultiYearIndustryCPI = model.MultiYearIndustryCPI.set_index(model.Industries['Code_Loc'])
+        cpi_span.set_output(model.MultiYearIndustryCPI)
     # Transform industry CPI to commodity CPI
     #TODO: Check this implementation. R Code used a [, FALSE] selection to eliminate all columns here. Not sure how this translates
     # model.MultiYearCommodityCPI = model.Commodities.set_index(model.Commodities['Code_Loc'])
-    model.MultiYearCommodityCPI = pd.DataFrame(index = model.Commodities['Code_Loc'])
-
-
-    for year_col in model.MultiYearIndustryCPI.columns:
-        logging.debug("calling func...")
-        model.MultiYearCommodityCPI[year_col] = io_functions.transform_industry_cpi_to_commodity_cpi_for_year(
-            int(year_col),
-            model
-        ) 
+    model.MultiYearCommodityCPI = io_functions.transform_industry_cpi_to_commodity_cpi_for_years(
+        model.MultiYearIndustryCPI.columns,
+        model
+    ).set_axis(model.Commodities['Code_Loc'])
     # Check for aggregation
     if "AggregationSpecs" in model.specs.keys():
         if model.specs['AggregationSpecs'] is not None:
-            logging.debug("calling func...")
-            aggregate_functions.get_aggregation_specs(model, config_paths)
-            logging.debug("calling func...")
-            aggregate_functions.aggregate_model(model)
-
+            with build_profiler.span("aggregate_model"):
+                aggregate_functions.get_aggregation_specs(model, config_paths)
+                aggregate_functions.aggregate_model(model)
 
     # Check for disaggregation
-    logging.debug("WORKING ON DISAGGREGATION...")
     if "DisaggregationSpecs" in model.specs.keys():
         if model.specs['DisaggregationSpecs'] is not None:
-            logging.debug("calling func...")
-            disaggregate_functions.get_disaggregation_specs(model, config_paths)
-            logging.debug("calling func...")
-            disaggregate_functions.disaggregate_model(model) #TODO
+            with build_profiler.span("disaggregate_model"):
+                disaggregate_functions.get_disaggregation_specs(model, config_paths)
+                disaggregate_functions.disaggregate_model(model) #TODO
 
     # Check for hybridization
     if model.specs['ModelType'] == "EEIO-IH":
-        logging.debug("calling func...")
-        hybridization_functions.get_hybridization_specs(model, config_paths) #TODO
-        logging.debug("calling func...")
-        hybridization_functions.get_hybridization_files(model, config_paths) #TODO
+        with build_profiler.span("get_hybridization_specs"):
+            hybridization_functions.get_hybridization_specs(model, config_paths) #TODO
+            hybridization_functions.get_hybridization_files(model, config_paths) #TODO
     
 #DONE
 def load_io_meta(model):
     '''Prepare metadata of economic components of an EEIO form USEEIO model'''
-    logging.debug("check")
-    logging.debug("calling func...")
     io_codes = load_io_codes(model)
     
     
     model_base_elements = model.get_elements()
 
-    logging.debug("calling func...")
     model.Commodities = pd.merge(
         io_codes['Commodities'],
-        pd.read_csv(
-            utility_functions.get_named_dataset('useeio_py.inst.extdata', "USEEIO_Commodity_Meta.csv"),
-            header = 0
-        ),
+        utility_functions.get_named_dataset('useeio_py.inst.extdata', "USEEIO_Commodity_Meta.csv", header = 0),
         how = 'left',
         on = 'Code'
     )
-    logging.debug("calling func...")  
-    model.Industries = pd.read_parquet(
-        utility_functions.get_named_dataset(
-            'useeio_py.data',
-            f"{model.specs['BaseIOLevel']}_IndustryCodeName_{model.specs['BaseIOSchema']}.parquet"
-        )
+    model.Industries = utility_functions.get_named_dataset(
+        'useeio_py.data',
+        f"{model.specs['BaseIOLevel']}_IndustryCodeName_{model.specs['BaseIOSchema']}.parquet"
     )
     
     merge_code_names = [
         "HouseholdDemandCodes","InvestmentDemandCodes","ChangeInventoriesCodes",
         "ExportCodes","ImportCodes","GovernmentDemandCodes"
     ]
-    logging.debug("calling func...")
     model.FinalDemandMeta = pd.merge(
-        pd.read_parquet(
-            utility_functions.get_named_dataset(
-                'useeio_py.data',
-                f"{model.specs['BaseIOLevel']}_FinalDemandCodeName_{model.specs['BaseIOSchema']}.parquet"
-            )
-            ##FIX: importlib.resources.files('useeio_py.data').joinpath(
-            #    f"{model.specs['BaseIOLevel']}_FinalDemandCodeName_{model.specs['BaseIOSchema']}.parquet"
-            #)
+        utility_functions.get_named_dataset(
+            'useeio_py.data',
+            f"{model.specs['BaseIOLevel']}_FinalDemandCodeName_{model.specs['BaseIOSchema']}.parquet"
         ),
         utility_functions.stack(io_codes, merge_code_names),
         left_on=f"BEA_{model.specs['BaseIOSchema']}_{model.specs['BaseIOLevel']}_FinalDemand_Code",
@@ -165,17 +139,12 @@ def load_io_meta(model):
     )
     model.FinalDemandMeta = model.FinalDemandMeta.drop(columns = 'Code')
     
-    logging.debug("calling func...")
     if model.specs["IODataSource"] == "BEA":
         model.InternationalTradeAdjustmentMeta = utility_functions.stack(io_codes, ["InternationalTradeAdjustmentCodes"])
-    logging.debug("calling func...")
     model.MarginSectors = utility_functions.stack(io_codes, ["TransportationCodes", "WholesaleCodes", "RetailCodes"])
-    logging.debug("calling func...")
-    model.ValueAddedMeta = pd.read_parquet(
-        utility_functions.get_named_dataset(
-            'useeio_py.data',
-            f"{model.specs['BaseIOLevel']}_ValueAddedCodeName_{model.specs['BaseIOSchema']}.parquet"
-        )
+    model.ValueAddedMeta = utility_functions.get_named_dataset(
+        'useeio_py.data',
+        f"{model.specs['BaseIOLevel']}_ValueAddedCodeName_{model.specs['BaseIOSchema']}.parquet"
     )
     model_meta = list(filter(
         lambda x: x not in model_base_elements,
@@ -210,16 +179,13 @@ def load_io_codes(model):
     '''
     Load BEA IO codes in a list based on model config
     '''
-    logging.debug("check")
     io_codes = {}
 	# Get IO sector codes by group
-    logging.debug("calling func...")
     io_codes["Commodities"] = utility_functions.get_vector_of_codes(
 		model.specs['BaseIOSchema'],
 		model.specs['BaseIOLevel'],
 		"Commodity"
 		)
-    logging.debug("calling func...")
     io_codes["Industries"] = utility_functions.get_vector_of_codes(
 		model.specs['BaseIOSchema'],
 		model.specs['BaseIOLevel'],
@@ -230,7 +196,6 @@ def load_io_codes(model):
 			"ChangeInventories", "Export", "Import", "GovernmentDemand",
 			"Scrap", "Transportation", "Wholesale", "Retail"]
     
-    logging.debug("calling func...")
     for code in codes:
         io_codes[f"{code}Codes"] = utility_functions.get_vector_of_codes(
             model.specs['BaseIOSchema'],
@@ -255,22 +220,27 @@ def load_io_codes(model):
 #DONE
 def load_national_io_data(model, io_codes):
     '''Prepare economic components of an EEIO form USEEIO model.'''
-    logging.debug("check")
     # Load BEA IO and gross output tables
-    logging.debug("calling func...")
-    bea = load_bea_tables(model.specs, io_codes)
+    with build_profiler.span("load_bea_tables") as bea_span:
+        bea = load_bea_tables(model.specs, io_codes)
+        bea_span.set_output(bea["UseTransactions"], "UseTransactions")
+    # Load the Import matrix and combine Use transactions and final demand once,
+    # both are shared by domestic Use and the International Trade Adjustment
+    with build_profiler.span("load_import_matrix"):
+        imp = io_functions.load_import_matrix(model)
+        use = pd.concat([bea["UseTransactions"], bea["FinalDemand"]], axis=1)
     # Generate domestic Use transaction and final demand
-    logging.debug("calling func...")
-    domestic_use = io_functions.generate_domestic_use(pd.concat([bea["UseTransactions"], bea["FinalDemand"]], axis=1), model)
-    bea['DomesticUseTransactions'] = domestic_use[io_codes['Industries']['Code']]
-    bea['DomesticFinalDemand'] = domestic_use[io_codes['FinalDemandCodes']['Code']]
+    with build_profiler.span("generate_domestic_use"):
+        domestic_use = io_functions.generate_domestic_use(use, model, imp)
+        bea['DomesticUseTransactions'] = domestic_use[io_codes['Industries']['Code']]
+        bea['DomesticFinalDemand'] = domestic_use[io_codes['FinalDemandCodes']['Code']]
 
-    # Generate Import Cost vector
-    logging.debug("calling func...")
-    bea['InternationalTradeAdjustment'] = io_functions.generate_international_trade_adjustment_vector(
-        pd.concat([bea["UseTransactions"], bea["FinalDemand"]], axis=1),
-        model
-    )
+        # Generate Import Cost vector
+        bea['InternationalTradeAdjustment'] = io_functions.generate_international_trade_adjustment_vector(
+            use,
+            model,
+            imp
+        )
     # Modify row and column names to Code_Loc format in all IO tables
     # Use model.Industries
     code_loc_ind = model.Industries['Code_Loc']
@@ -303,7 +273,6 @@ def load_bea_tables(specs, io_codes):
     #' @param io_codes A list of BEA IO codes.
     #' @return A list with BEA IO tables
     '''
-    logging.debug("check")
     bea = {}
 
     if specs['BasewithRedefinitions']:
@@ -311,16 +280,14 @@ def load_bea_tables(specs, io_codes):
     else:
         redef = "BeforeRedef"
     
-    bea["Make"] = pd.read_parquet(
-        importlib.resources.files('useeio_py.data2').joinpath(
-            f"{specs['BaseIOLevel']}_Make_{specs['IOYear']}_{redef}.parquet"
-        )
+    bea["Make"] = utility_functions.get_named_dataset(
+        'useeio_py.data2',
+        f"{specs['BaseIOLevel']}_Make_{specs['IOYear']}_{redef}.parquet"
     ).set_index('index')
 
-    bea["Use"] = pd.read_parquet(
-        importlib.resources.files('useeio_py.data2').joinpath(
-            f"{specs['BaseIOLevel']}_Use_{specs['IOYear']}_{specs['BasePriceType']}_{redef}.parquet"
-        )
+    bea["Use"] = utility_functions.get_named_dataset(
+        'useeio_py.data2',
+        f"{specs['BaseIOLevel']}_Use_{specs['IOYear']}_{specs['BasePriceType']}_{redef}.parquet"
     ).set_index('index')
 
      # Separate Make and Use tables into specific IO tables (all values in $)
@@ -366,22 +333,14 @@ def load_two_region_state_io_tables(model):
     #' @param model An EEIO form USEEIO model object with model specs and IO meta data loaded.
     #' @return A list with state IO tables.
     '''
-    logging.debug("check")
     state_io = {}
     # Load IO tables from stateior
-    logging.debug("calling func...")
     state_io['MakeTransactions'] = stateior_functions.get_two_region_io_data(model, "Make")
-    logging.debug("calling func...")
     state_io['UseTransactions'] = stateior_functions.get_two_region_io_data(model, "UseTransactions")
-    logging.debug("calling func...")
     state_io['FinalDemand'] = stateior_functions.get_two_region_io_data(model, "FinalDemand")
-    logging.debug("calling func...")
     state_io['DomesticUseTransactions'] = stateior_functions.get_two_region_io_data(model, "DomesticUseTransactions")
-    logging.debug("calling func...")
     state_io['DomesticFinalDemand'] = stateior_functions.get_two_region_io_data(model, "DomesticFinalDemand")
-    logging.debug("calling func...")
     state_io['UseValueAdded'] = stateior_functions.get_two_region_io_data(model, "UseValueAdded")
-    logging.debug("calling func...")
     state_io['InternationalTradeAdjustment'] = stateior_functions.get_two_region_io_data(model, "InternationalTradeAdjustment")
     return(state_io)
 
@@ -395,39 +354,30 @@ def load_commodity_and_industry_output(model):
 
     return: None
     '''
-    logging.debug("check")
     if model.specs["IODataSource"] == "BEA":
         # Calculate industry and commodity output
-        logging.debug("calling func...")
         calculate_industry_commodity_output(model) #TODO
         # Load multi-year industry output
-        logging.debug("calling func...")
         model.MultiYearIndustryOutput = load_go_and_cpi.load_national_gross_output_table(model.specs).loc[model.Industries["Code"]]
         model.MultiYearIndustryOutput = model.MultiYearIndustryOutput.set_index(model.Industries['Code_Loc'])
         model.MultiYearIndustryOutput[str(model.specs['IOYear'])] = model.IndustryOutput.copy()
         
         
         # Transform multi-year industry output to commodity output
-        model.MultiYearCommodityOutput = pd.DataFrame(index=model.CommodityOutput.index)
-        logging.debug("calling func...")
-        for year_col in model.MultiYearIndustryOutput.columns:
-            model.MultiYearCommodityOutput[year_col] = io_functions.transform_industry_output_to_commodity_output_for_year(
-                int(year_col),
-                model
-            ) #TODO: Check that this properly updates the year columns
+        model.MultiYearCommodityOutput = io_functions.transform_industry_output_to_commodity_output_for_years(
+            model.MultiYearIndustryOutput.columns,
+            model
+        ).set_axis(model.CommodityOutput.index)
         model.MultiYearCommodityOutput[str(model.specs['IOYear'])] = model.CommodityOutput.copy()
     elif model.specs['IODataSource'] == 'stateior':
         # Define state, year and iolevel
         if "US-DC" not in model.specs['ModelRegionAcronyms']:
             state_abb = re.sub(".*-", "", model.specs['ModelRegionAcronyms'][0])
-            logging.debug("calling func...")
             state = utility_functions.get_state_name_from_abb(state_abb)
         else:
             state = "District of Columbia"
         # Load industry and commodity output
-        logging.debug("calling func...")
         model.IndustryOutput =  stateior_functions.get_two_region_io_data(model, "IndustryOutput")
-        logging.debug("calling func...")
         model.CommodityOutput = stateior_functions.get_two_region_io_data(model, "CommodityOutput")
         # Load multi-year industry and commodity output
         years = range(2012, 2018)
@@ -439,9 +389,7 @@ def load_commodity_and_industry_output(model):
 
         for year in years:
             tmp_model.specs['IOYear'] = year
-            logging.debug("calling func...")
             model.MultiYearIndustryOutput[str(year)] = stateior_functions.get_two_region_io_data(tmp_model, "IndustryOutput")
-            logging.debug("calling func...")
             model.MultiYearCommodityOutput[str(year)] = stateior_functions.get_two_region_io_data(tmp_model, "CommodityOutput")
 
 #Done
@@ -454,7 +402,6 @@ def calculate_industry_commodity_output(model):
     
     return: None
     '''
-    logging.debug("check")
     model.IndustryOutput = model.UseTransactions.sum(axis=0) + model.UseValueAdded.sum(axis=0)
     model.CommodityOutput = model.UseTransactions.sum(axis=1) + model.FinalDemand.sum(axis=1)
     
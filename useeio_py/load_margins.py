@@ -21,11 +21,7 @@ def get_margins_table(model):
     value_columns = ["ProducersValue", "Transportation", "Wholesale", "Retail"]
     # Use BEA Margin Details table
     if model.specs['BaseIOSchema'] == 2012:
-        margins_table = pd.read_parquet(
-            importlib.resources.files('useeio_py.data2').joinpath(
-                'Detail_Margins_2012_BeforeRedef.parquet'
-            )
-        )
+        margins_table = utility_functions.get_named_dataset('useeio_py.data2', 'Detail_Margins_2012_BeforeRedef.parquet')
         margins_table[value_columns] *= 1E6
     else:
         logging.debug("This case is not handles in the R code. What to do?")
@@ -78,7 +74,7 @@ def get_margins_table(model):
 
         # Transform PRO value and Margins for Commodities from Commodity to Industry format, (Margins' * C_m )'
         margins_values_com = margins_table[value_columns]
-        margins_values_ind = np.transpose(np.matmul(np.transpose(margins_values_com.to_numpy()), commodity_mix)) 
+        margins_values_ind = np.transpose(np.transpose(margins_values_com.to_numpy()) @ utility_functions.matrix_values(commodity_mix))
         # Merge Industry Margins Table with Commodity Margins Table to add in metadata columns
 
         margins_table_industry.loc[:,value_columns] = margins_values_ind
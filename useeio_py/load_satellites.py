@@ -1,77 +1,184 @@
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
+import logging
+import os
+import sys
+import time
+import tracemalloc
 import pandas as pd
 import numpy as np
+from . import data_quality_functions, flow_mapping_functions, flowsa_functions, satellite_functions
+from . import aggregate_functions, disaggregate_functions
+from .utility_functions import format_location_for_state_models
+from .utility_functions import get_named_dataset, load_data_commons_file
 
+# Functions named by ScriptFunctionCall in satellite table specs
+script_functions = {
+    "getFlowbySectorCollapsed": flowsa_functions.get_flow_by_sector_collapsed,
+    "getValueAddedTotalsbySector": satellite_functions.get_value_added_totals_by_sector,
+}
+# Fields identifying a flow
+flow_fields = ["Flowable", "Context", "Unit", "FlowUUID"]
 
-def load_sat_tables(model):
+
+def build_satellite_table(sat_spec, model):
+    '''
+    Generate the totals by sector of a single satellite table and prepare it based on model specs:
+    generate, conform to the model schema, check for flow loss, score DQ and map flow names.
+
+    Arguments:
+    sat_spec:   A standard specification for a single satellite table.
+    model:      A model object with model specs and IO tables loaded.
+
+    return: A tuple (tbs, flows) of the totals by sector and its unique flows.
+    '''
+    if sat_spec['FileLocation'] == 'None':
+        logging.info(f"Generating {sat_spec['FullName']} flows...")
+    else:
+        logging.info(f"Loading {sat_spec['FullName']} flows from {sat_spec['FileLocation']}...")
+
+    ### Generate totals_by_sector, tbs
+    # Static NAICS FlowBySector files are streamed and mapped to BEA batch by batch
+    streamed = is_streamed_flow_by_sector(sat_spec)
+    if streamed:
+        tbs0 = generate_bea_tbs_from_flow_by_sector(sat_spec, model)
+    else:
+        tbs0 = generate_tbs_from_sat_spec(sat_spec, model)
+
+    # Convert totals_by_sector to standard satellite table format
+    tbs = satellite_functions.conform_tbs_to_standard_sat_table(tbs0)
+
+    ### Make tbs conform to the model schema
+    tbs = conform_tbs_to_io_schema(tbs, sat_spec, model, streamed)
+
+    ##Check for any loss of flow data
+    satellite_functions.check_satellite_flow_loss(tbs0, tbs)
+    tbs = satellite_functions.remove_missing_sectors(tbs)
+
+    # Add in DQ columns and additional contextual scores not provided
+    # Only setting TemporalCorrelation for now
+    tbs = data_quality_functions.score_contextual_dq(tbs)
+
+    # Convert totals_by_sector to standard satellite table format
+    tbs = satellite_functions.conform_tbs_to_standard_sat_table(tbs)
+
+    #Map names for files not already using FEDEFL
+    if not sat_spec['OriginalFlowSource'][:6] == 'FEDEFL':
+        tbs = flow_mapping_functions.map_list_by_name(tbs, sat_spec)
+    flows_tbs = tbs[flow_fields].drop_duplicates()
+    return(tbs, flows_tbs)
+
+# Model used by satellite table builds in worker processes, set once per worker
+_worker_model = None
+
+def _set_worker_model(model):
+    global _worker_model
+    _worker_model = model
+
+def _run_satellite_build(build, sat_spec, model = None, trace_memory = True):
+    '''
+    Run a satellite table build, measuring its wall time and, with trace_memory, the peak
+    memory allocated while it runs as traced by tracemalloc (numpy and pandas buffers included).
+
+    return: A tuple (result, seconds, peak_bytes), peak_bytes is None without trace_memory.
+    '''
+    model = _worker_model if model is None else model
+    tracing = trace_memory and tracemalloc.is_tracing()
+    if trace_memory and not tracing:
+        tracemalloc.start()
+    elif tracing:
+        tracemalloc.reset_peak()
+    start_bytes = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+    start = time.perf_counter()
+    try:
+        result = build(sat_spec, model)
+        seconds = time.perf_counter() - start
+        peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes if trace_memory else None
+    finally:
+        if trace_memory and not tracing:
+            tracemalloc.stop()
+    return(result, seconds, peak_bytes)
+
+def build_satellite_tables(model, build = build_satellite_table, workers = None, executor = "process"):
+    '''
+    Build the satellite tables of all SatelliteTable specs of a model, concurrently. Satellite
+    tables are independent of each other, so each is built by a separate task; results are
+    returned in the order of the specs regardless of which finishes first. The wall time of
+    each build is recorded with model.record_build_timing() as "satellite_<Abbreviation>",
+    together with the peak memory the build allocated above what its process held when it
+    started. A worker process builds one table at a time, so this is the memory of that table
+    alone. Threads share the memory of this process, so thread builds record no memory.
+
+    Arguments:
+    model:      A model object with model specs and IO tables loaded.
+    build:      Function taking a satellite table spec and the model and returning its result,
+                must be picklable for the process executor.
+    workers:    Maximum number of concurrent builds. Defaults to the number of specs, capped
+                at the CPU count. With 1, tables are built sequentially in this process.
+    executor:   "process" to build in worker processes, or "thread" to build in threads of
+                this process. Worker processes are sent a pickled copy of the model each,
+                and where processes are spawned (Windows, macOS) the calling script must
+                guard its entry point with if __name__ == "__main__".
+
+    return: A dictionary of satellite table abbreviation to build result, in spec order.
+    '''
+    sat_specs = list((model.specs.get('SatelliteTable') or {}).values())
+    if workers is None:
+        workers = min(len(sat_specs), os.cpu_count() or 1)
+    workers = max(1, min(workers, len(sat_specs)))
+    if executor not in ("process", "thread"):
+        logging.error(f"Unknown executor {executor}, use 'process' or 'thread'")
+        sys.exit(f"Unknown executor {executor}")
+
+    if workers == 1:
+        builds = [_run_satellite_build(build, sat_spec, model) for sat_spec in sat_specs]
+    elif executor == "process":
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer = _set_worker_model, initargs = (model,)) as pool:
+            builds = list(pool.map(_run_satellite_build, [build] * len(sat_specs), sat_specs))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            builds = list(pool.map(lambda sat_spec: _run_satellite_build(build, sat_spec, model, False), sat_specs))
+
+    results = {}
+    for sat_spec, (result, seconds, peak_bytes) in zip(sat_specs, builds):
+        abbreviation = sat_spec['Abbreviation']
+        model.record_build_timing(f"satellite_{abbreviation}", seconds, peak_bytes)
+        results[abbreviation] = result
+    return(results)
+
+def load_sat_tables(model, workers = None, executor = "process"):
     '''
     Load totals by sector/region and prepares them based on model specs.
+    Satellite tables are built concurrently in worker processes by default, see
+    build_satellite_tables() for workers and executor.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    sattables <- list()
-    sattables$totals_by_sector <- list()
-    flows <- list()
-    logging::loginfo("Initializing model satellite tables...")
-
-    #Loop through each sat specification
-    for (sat_spec in model$specs$SatelliteTable) {
-        if(sat_spec$FileLocation == 'None'){
-        logging::loginfo(paste0("Generating ", sat_spec$FullName, " flows..."))      
-        } else {
-        logging::loginfo(paste0("Loading ", sat_spec$FullName, " flows from ", sat_spec$FileLocation, "..."))
-        }
-
-        ### Generate totals_by_sector, tbs
-        tbs0 <- generateTbSfromSatSpec(sat_spec, model)
-        
-        # Convert totals_by_sector to standard satellite table format
-        tbs <- conformTbStoStandardSatTable(tbs0)
-        
-        ### Make tbs conform to the model schema
-        tbs <- conformTbStoIOSchema(tbs, sat_spec, model)
-        
-        ##Check for any loss of flow data
-        checkSatelliteFlowLoss(tbs0,tbs)
-        tbs <- removeMissingSectors(tbs)
-        
-        # Add in DQ columns and additional contextual scores not provided
-        # Only setting TemporalCorrelation for now
-        tbs <- scoreContextualDQ(tbs)
-        
-        # Convert totals_by_sector to standard satellite table format
-        tbs <- conformTbStoStandardSatTable(tbs)
-        
-        #Map names for files not already using FEDEFL
-        if (!substring(sat_spec$OriginalFlowSource,1,6) == 'FEDEFL') {
-        tbs <- mapListbyName(tbs, sat_spec)
-        }
-        flow_fields <- c("Flowable","Context","Unit","FlowUUID")
-        flows_tbs <- unique(tbs[,flow_fields])
-        flows <- rbind(flows,flows_tbs)
-        # Add totals_by_sector to the sattables list
-        sattables$totals_by_sector[[sat_spec$Abbreviation]] <- tbs
-    }
+    sat_tables = {}
+    logging.info("Initializing model satellite tables...")
+
+    #Build each sat specification
+    built = build_satellite_tables(model, build_satellite_table, workers, executor)
+    # Add totals_by_sector to the sat_tables list
+    sat_tables['totals_by_sector'] = {abbreviation: tbs for abbreviation, (tbs, _) in built.items()}
     # Check for duplicate flows across satellite tables
-    checkDuplicateFlowsBySector(sattables$totals_by_sector)
-    
-    flows <- flows[!duplicated(flows[,flow_fields[flow_fields != "FlowUUID"]]),]
+    satellite_functions.check_duplicate_flows_by_sector(sat_tables['totals_by_sector'])
+
+    flows = pd.concat([flows_tbs for _, flows_tbs in built.values()], ignore_index = True) \
+        if built else pd.DataFrame(columns = flow_fields)
+    flows = flows[~flows.duplicated([field for field in flow_fields if field != "FlowUUID"])]
     #Re-index the flows
-    rownames(flows) <- NULL
-    sattables$flows <- flows
-    return(sattables)
-    '''
+    sat_tables['flows'] = flows.reset_index(drop = True)
+    return(sat_tables)
 
 #TODO: add as method to model class
-def load_and_build_satellite_tables(model):
+def load_and_build_satellite_tables(model, workers = None, executor = "process"):
     '''
     #' Loads data for all satellite tables as lists in model specs
     #' @param model A model list object with model specs and IO tables listed
+    #' @param workers, executor Concurrency of the builds, see build_satellite_tables()
     #' @return A model object with Satellite tables added
     '''
-    model.SatelliteTables = load_sat_tables(model)
+    model.SatelliteTables = load_sat_tables(model, workers, executor)
 
 def generate_tbs_from_sat_spec(sat_spec, model):
     '''
@@ -80,75 +187,103 @@ def generate_tbs_from_sat_spec(sat_spec, model):
     #' @param model A model list object with model specs and IO tables listed
     #'@return a totals-by-sector dataframe
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    # Check if the satellite table uses a file from within useeior. If so, proceed.
+    # Check if the satellite table uses a file from within useeio_py. If so, proceed.
     # If not, use specified functions in model metadata to load data from dynamic source
-    if(sat_spec$FileLocation == "useeior") {
-        totals_by_sector <- utils::read.table(system.file("extdata", sat_spec$StaticFile, package = "useeior"),
-                                            sep = ",", header = TRUE, stringsAsFactors = FALSE,
-                                            fileEncoding = 'UTF-8-BOM')
-    } else if (!is.null(sat_spec$ScriptFunctionCall)) {
-        func_to_eval <- sat_spec$ScriptFunctionCall
-        totalsgenfunction <- as.name(func_to_eval)
-        params <- sat_spec
-        if (!is.null(sat_spec$ScriptFunctionParameters)) {
-        if (sat_spec$ScriptFunctionParameters == "model") {
-            params <- model
-        }
-        }
-        totals_by_sector <- do.call(eval(totalsgenfunction), list(params))
-    } else {
-        f <- loadDataCommonsfile(sat_spec$StaticFile)
-        totals_by_sector <- utils::read.table(f, sep = ",", header = TRUE, stringsAsFactors = FALSE,
-                                            fileEncoding = 'UTF-8-BOM')
-    }
+    if sat_spec['FileLocation'] == "useeior":
+        totals_by_sector = get_named_dataset('useeio_py.inst.extdata', sat_spec['StaticFile'], encoding = 'utf-8-sig')
+    elif sat_spec.get('ScriptFunctionCall') is not None:
+        func_to_eval = script_functions[sat_spec['ScriptFunctionCall']]
+        params = sat_spec
+        if sat_spec.get('ScriptFunctionParameters') == "model":
+            params = model
+        totals_by_sector = func_to_eval(params)
+    else:
+        f = load_data_commons_file(sat_spec['StaticFile'])
+        totals_by_sector = pd.read_csv(f, encoding = 'utf-8-sig')
     return(totals_by_sector)
+
+def is_streamed_flow_by_sector(sat_spec):
+    '''
+    Check whether a satellite table spec is built by streaming its static NAICS-coded
+    FlowBySector file with generate_bea_tbs_from_flow_by_sector().
+
+    Arguments:
+    sat_spec:   A standard specification for a single satellite table.
+
+    return: True for getFlowbySectorCollapsed specs with StaticSource: True and a NAICS SectorListSource.
+    '''
+    return(sat_spec.get('FileLocation') != "useeior" and sat_spec.get('ScriptFunctionCall') == "getFlowbySectorCollapsed"
+           and bool(sat_spec.get('StaticSource')) and "NAICS" in sat_spec['SectorListSource'])
+
+def generate_bea_tbs_from_flow_by_sector(sat_spec, model, batch_size = flowsa_functions.fbs_batch_size):
+    '''
+    Stream a NAICS-based FlowBySector satellite table into a BEA-coded totals-by-sector table.
+    Each batch of the file is collapsed, given the model locations and mapped to BEA as it is
+    read, so memory use is bounded by the batch size and the size of the mapped totals rather
+    than the file size. The result needs no further location or NAICS mapping in
+    conform_tbs_to_io_schema().
+
+    Arguments:
+    sat_spec:   A standard specification for a single satellite table with a static FlowBySector file.
+    model:      A model object with model specs, IO tables and crosswalk loaded.
+    batch_size: Maximum number of rows read from the file at once.
+
+    return: A totals-by-sector df with BEA sectors, or None if the file has no elementary or waste flows.
     '''
+    def map_batch(tbs):
+        tbs = satellite_functions.conform_tbs_to_standard_sat_table(tbs)
+        tbs = conform_tbs_locations_to_model(tbs, model)
+        return(satellite_functions.map_flow_totals_by_sector_and_location_from_naics_to_bea(
+            tbs, sat_spec['DataYears'][0], model))
+    batches = flowsa_functions.get_flow_by_sector_collapsed_batches(sat_spec, batch_size)
+    return(satellite_functions.collapse_tbs_batches(batches, model, map_batch))
 
-def conform_tbs_to_io_schema(tbs, sat_spec, model):
+def conform_tbs_locations_to_model(tbs, model):
+    '''
+    #'Change the locations of a totals-by-sector df to the model regions
+    #'@param tbs, totals-by-sector df
+    #'@param model an EEIO model with model specs loaded
+    #'@return the totals-by-sector df with locations outside the model regions set to the first region missing
+    #'from the df, or None
+    '''
+    # Change Location if model is a state model
+    region_acronyms = model.specs['ModelRegionAcronyms']
+    if all(acronym != "US" for acronym in region_acronyms) and model.specs['IODataSource'] == "stateior":
+        # Format location in tbs
+        tbs['Location'] = [format_location_for_state_models(location) for location in tbs['Location']]
+    other_regions = [acronym for acronym in region_acronyms if acronym not in set(tbs['Location'])]
+    tbs['Location'] = np.where(tbs['Location'].isin(region_acronyms), tbs['Location'],
+                               other_regions[0] if other_regions else None)
+    return(tbs)
+
+def conform_tbs_to_io_schema(tbs, sat_spec, model, streamed = False):
     '''
     #'Take a totals-by-sector df and maps flows to the model schema
     #'@param tbs, totals-by-sector df
     #'@param sat_spec, a standard specification for a single satellite table
     #'@param model an EEIO model with IO tables loaded
+    #'@param streamed, True if tbs was streamed with generate_bea_tbs_from_flow_by_sector(), which already
+    #'conformed its locations and mapped it from NAICS to BEA
     #'@return a totals-by-sector df with the sectors and flow amounts corresponding to the model schema
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
     # Check if aggregation or disaggregation are needed based on model metadata
-    if(!is.null(sat_spec$StaticFile)) {
-        for(aggSpecs in model$AggregationSpecs) {
-        tbs <- aggregateSectorsinTBS(model, aggSpecs, tbs, sat_spec)  
-        }
-        for (disagg in model$DisaggregationSpecs) {
-        tbs <- disaggregateSatelliteTable(disagg, tbs, sat_spec)
-        }
-    }
-    # Change Location if model is a state model
-    if (all(model$specs$ModelRegionAcronyms!="US", model$specs$IODataSource=="stateior")) {
-        # Format location in tbs
-        tbs$Location <- formatLocationforStateModels(tbs$Location)
-    }
-    tbs$Location <- ifelse(tbs$Location%in%model$specs$ModelRegionAcronyms,
-                            tbs$Location,
-                            setdiff(model$specs$ModelRegionAcronyms, tbs$Location))
-    
+    if sat_spec.get('StaticFile') is not None:
+        for agg_specs in (getattr(model, 'AggregationSpecs', None) or {}).values():
+            tbs = aggregate_functions.aggregate_sectors_in_tbs(model, agg_specs, tbs, sat_spec)
+        for disagg in (getattr(model, 'DisaggregationSpecs', None) or {}).values():
+            tbs = disaggregate_functions.disaggregate_satellite_table(disagg, tbs, sat_spec)
+    if not streamed:
+        tbs = conform_tbs_locations_to_model(tbs, model)
+
     # Check if the original data is BEA-based. If so, apply necessary allocation or aggregation.
     # If not, map data from original sector to BEA.
-    if (sat_spec$SectorListSource == "BEA") {
+    if sat_spec['SectorListSource'] == "BEA":
         # If BEA years is not the same as model year, must perform allocation
-        if (all(sat_spec$SectorListLevel == "Detail", sat_spec$SectorListYear == 2007, model$specs$BaseIOSchema == 2012)) {
-        tbs <- mapFlowTotalsbySectorfromBEASchema2007to2012(tbs)
-        }
+        if sat_spec['SectorListLevel'] == "Detail" and sat_spec['SectorListYear'] == 2007 and model.specs['BaseIOSchema'] == 2012:
+            tbs = satellite_functions.map_flow_totals_by_sector_from_bea_schema_2007_to_2012(tbs)
         # If the original data is at Detail level but model is not, apply aggregation
-        if (sat_spec$SectorListLevel == "Detail" && model$specs$BaseIOLevel != "Detail") {
-        tbs <- aggregateSatelliteTable(tbs,from_level = sat_spec$SectorListLevel,model)
-        }
-    } else if ("NAICS" %in% sat_spec$SectorListSource) {
-        tbs <- mapFlowTotalsbySectorandLocationfromNAICStoBEA(tbs, sat_spec$DataYears[1], model)
-    }  
+        if sat_spec['SectorListLevel'] == "Detail" and model.specs['BaseIOLevel'] != "Detail":
+            tbs = satellite_functions.aggregate_satellite_table(tbs, sat_spec['SectorListLevel'], model)
+    elif "NAICS" in sat_spec['SectorListSource'] and not streamed:
+        tbs = satellite_functions.map_flow_totals_by_sector_and_location_from_naics_to_bea(tbs, sat_spec['DataYears'][0], model)
     return(tbs)
-    '''
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
 '''Functions to format, aggregate and otherwise wrangle satellite tables'''
 
+import importlib.resources
+import logging
+import sys
+import yaml
 import pandas as pd
 import numpy as np
+from . import data_quality_functions
+from .crosswalk_functions import get_naics_to_bea_allocation
+
+# Fields that identify a flow, sector and location in a totals-by-sector table;
+# collapse_tbs() aggregates over all other fields
+tbs_key_fields = ["Flowable", "Context", "FlowUUID", "Sector", "SectorName", "Location", "Unit", "Year", "DistributionType"]
+# Fields stored as categoricals in columnar totals-by-sector tables
+tbs_categorical_fields = ["Flowable", "Context", "FlowUUID", "Sector", "SectorName", "Location", "Unit",
+                          "DistributionType", "MetaSources"]
+# Numeric fields stored as float arrays in columnar totals-by-sector tables
+tbs_value_fields = ["FlowAmount", "Min", "Max"] + data_quality_functions.flow_data_quality_fields
 
 
 def get_standard_satellite_table_format():
@@ -10,12 +25,158 @@ def get_standard_satellite_table_format():
     #' Load the template of standard satellite table.
     #' @return A dataframe with the columns of the standard sat table format from the IO model builder.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    sat <- configr::read.config(system.file("extdata/IOMB_Fields.yml", package="useeior"))[["SatelliteTable"]]
+    fields = importlib.resources.files('useeio_py.inst.extdata').joinpath("IOMB_Fields.yml").read_text()
+    sat = yaml.safe_load(fields)["SatelliteTable"]
     return(sat)
+
+def to_columnar_tbs(tbs, value_dtype = np.float64):
+    '''
+    Convert a totals-by-sector table to columnar form: Flowable, Context, Sector, Location and
+    the other code fields as pandas categoricals, FlowAmount, Min, Max and DQ fields as float
+    arrays. Grouping, merging and mapping then work on integer category codes instead of strings.
+
+    Arguments:
+    tbs:            A totals-by-sector table.
+    value_dtype:    Float type of the value fields, e.g. np.float32 to halve memory for very
+                    large tables.
+
+    return: The columnar table. Tables that are already columnar are returned as they are.
+    '''
+    conversions = {}
+    for field in tbs_categorical_fields:
+        if field in tbs.columns and not isinstance(tbs[field].dtype, pd.CategoricalDtype):
+            conversions[field] = "category"
+    for field in tbs_value_fields:
+        if field in tbs.columns and tbs[field].dtype != value_dtype:
+            conversions[field] = value_dtype
+    if not conversions:
+        return(tbs)
+    return(tbs.astype(conversions))
+
+def repeat_rows(row_counts):
     '''
+    Repeat row positions by their counts, as when rows are joined to several matches.
+
+    return: A tuple (rows, offsets) of the position of each output row in the input and its
+            number among the repeats of that row.
+    '''
+    rows = np.repeat(np.arange(len(row_counts)), row_counts)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+    return(rows, offsets)
+
+def map_sector_codes(tbs, mapping, how = "inner"):
+    '''
+    Map the Sector codes of a columnar totals-by-sector table to other codes. The mapping is
+    resolved once per Sector category rather than per row; rows of sectors that map to several
+    codes are repeated, as with a merge.
+
+    Arguments:
+    tbs:        A columnar totals-by-sector table (see to_columnar_tbs()).
+    mapping:    A two-column dataframe of from codes and to codes.
+    how:        "inner" drops rows of sectors without a mapping, "left" keeps them with a missing code.
+
+    return: A tuple (table, codes) of the table with rows repeated as needed and a categorical
+            of the mapped code of each row.
+    '''
+    mapping = mapping.drop_duplicates()
+    categories = tbs['Sector'].cat.categories
+    sector_codes = tbs['Sector'].cat.codes.to_numpy()
+    positions = categories.get_indexer(mapping.iloc[:, 0])
+    mapped = positions != -1
+    positions = positions[mapped]
+    to_codes = mapping.iloc[:, 1].to_numpy()[mapped]
+    # Mapped codes of each category are contiguous in to_codes after sorting by category
+    order = np.argsort(positions, kind = "stable")
+    positions, to_codes = positions[order], to_codes[order]
+    counts = np.bincount(positions, minlength = len(categories))
+    starts = np.cumsum(counts) - counts
+    row_counts = np.where(sector_codes == -1, 0, counts[sector_codes])
+    if how == "left":
+        unmapped = row_counts == 0
+        row_counts = np.where(unmapped, 1, row_counts)
+    rows, offsets = repeat_rows(row_counts)
+    codes = np.asarray(to_codes[np.minimum(starts[sector_codes[rows]] + offsets, len(to_codes) - 1)], dtype = object) \
+        if len(to_codes) > 0 else np.full(len(rows), None, dtype = object)
+    if how == "left":
+        codes[unmapped[rows]] = None
+    return(tbs.iloc[rows].reset_index(drop = True), pd.Categorical(codes))
+
+class NaicsToBeaAllocationIndex:
+    '''
+    NAICS to BEA mapping of a model crosswalk with the allocation factors of one data year and
+    location. Each NAICS code holds a contiguous slice of flat arrays of BEA code positions,
+    allocation factors and TechnologicalCorrelation adjustments, so mapping a satellite table
+    is a gather over these arrays instead of merges with the crosswalk and allocation table.
+
+    Arguments:
+    naics_to_bea:       Dataframe of NAICS and USEEIO columns with the model's NAICS to BEA mapping.
+    allocation_factor:  Dataframe of NAICS_Code, BEA_Code and allocation_factor columns for the
+                        location (see get_naics_to_bea_allocation()).
+    '''
+    def __init__(self, naics_to_bea, allocation_factor):
+        naics_to_bea = naics_to_bea.drop_duplicates()
+        naics_positions, naics = pd.factorize(naics_to_bea["NAICS"])
+        bea_positions, bea = pd.factorize(naics_to_bea["USEEIO"])
+        # Mapped codes of each NAICS code are contiguous after sorting by NAICS code
+        order = np.argsort(naics_positions, kind = "stable")
+        naics_positions, bea_positions = naics_positions[order], bea_positions[order]
+        self.naics = pd.Index(naics)
+        self.bea = np.asarray(bea, dtype = object)
+        self.counts = np.bincount(naics_positions, minlength = len(naics))
+        self.starts = np.cumsum(self.counts) - self.counts
+        # Allocation factors, 1 where there is none
+        allocation_index = pd.MultiIndex.from_frame(allocation_factor[["NAICS_Code", "BEA_Code"]])
+        positions = allocation_index.get_indexer(pd.MultiIndex.from_arrays(
+            [self.naics[naics_positions], self.bea[bea_positions]]))
+        factors = allocation_factor["allocation_factor"].to_numpy(dtype = float)[positions]
+        factors[(positions == -1) | np.isnan(factors)] = 1
+        # If there is allocation (1 NAICS to 2 or more BEA), add one to TechnologicalCorrelation score
+        tech_adjustments = (self.counts[naics_positions] > 1).astype(float)
+        # A last entry for codes without a mapping: no BEA code, no allocation or adjustment
+        self.bea_positions = np.append(bea_positions, -1)
+        self.factors = np.append(factors, 1.0)
+        self.tech_adjustments = np.append(tech_adjustments, 0.0)
+
+    def gather(self, codes):
+        '''
+        Look up the BEA codes, allocation factors and TechnologicalCorrelation adjustments of NAICS codes.
+
+        Arguments:
+        codes:  Array of NAICS codes.
+
+        return: A tuple (rows, bea_positions, factors, tech_adjustments) with one entry per
+                matching BEA code of each code: the position of the code in codes, the position
+                of the BEA code in self.bea (-1 for codes without a mapping), the allocation
+                factor and the adjustment. Codes without a mapping get a single entry.
+        '''
+        positions = self.naics.get_indexer(codes)
+        unmapped = positions == -1
+        row_counts = np.where(unmapped, 1, self.counts[positions])
+        rows, offsets = repeat_rows(row_counts)
+        entries = np.where(unmapped[rows], len(self.bea_positions) - 1, self.starts[positions[rows]] + offsets)
+        return(rows, self.bea_positions[entries], self.factors[entries], self.tech_adjustments[entries])
+
+def get_naics_to_bea_allocation_index(model, year, location):
+    '''
+    Get the NAICS to BEA allocation index of a model for a data year and location. Indices are
+    kept with the model's derived matrices and rebuilt only when the model crosswalk or
+    Industry output is replaced.
+
+    Arguments:
+    model:      A complete EEIO model: a list with USEEIO model components and attributes.
+    year:       Year of model Industry output used for allocation factors.
+    location:   Location acronym, e.g. "US".
+
+    return: A NaicsToBeaAllocationIndex.
+    '''
+    sources = ["crosswalk", "MultiYearIndustryOutput"]
+    allocation_factor = model.get_derived_matrix(f"NAICStoBEAAllocation_{year}",
+                                                 lambda model: get_naics_to_bea_allocation(year, model), sources)
+    generate = lambda model: NaicsToBeaAllocationIndex(
+        model.crosswalk[["NAICS", "USEEIO"]].dropna(),
+        allocation_factor[allocation_factor["Location"] == location])
+    name = f"NAICStoBEAAllocationIndex_{model.specs['BaseIOSchema']}_{year}_{location}"
+    return(model.get_derived_matrix(name, generate, sources))
 
 def map_flow_totals_by_sector_and_location_from_naics_to_bea(totals_by_sector, totals_by_sector_year, model):
     '''
@@ -25,51 +186,43 @@ def map_flow_totals_by_sector_and_location_from_naics_to_bea(totals_by_sector, t
     #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
     #' @return A satellite table aggregated by the USEEIO model sector codes.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    # Consolidate master crosswalk on model level and rename
-    NAICStoBEA <- unique(model$crosswalk[, c("NAICS","USEEIO")])
-    colnames(NAICStoBEA) <- c("NAICS","BEA")
-    # Modify TechnologicalCorrelation score based on the the correspondence between NAICS and BEA code
-    # If there is allocation (1 NAICS to 2 or more BEA), add one to score = 2
-    # Assign TechnologicalCorrelationAdjustment to NAICS
-    NAICS_duplicates <- unique(NAICStoBEA[duplicated(NAICStoBEA$NAICS), "NAICS"])
-    NAICStoBEA[NAICStoBEA$NAICS%in%NAICS_duplicates, "TechnologicalCorrelationAdjustment"] <- 1
-    NAICStoBEA[!NAICStoBEA$NAICS%in%NAICS_duplicates, "TechnologicalCorrelationAdjustment"] <- 0
-    
-    # Rename the existing Sector field to NAICS
-    colnames(totals_by_sector)[colnames(totals_by_sector)=="Sector"] <- "NAICS"
-    # Merge totals_by_sector table with NAICStoBEA mapping
-    totals_by_sector_BEA <- merge(totals_by_sector, NAICStoBEA, by = "NAICS", all.x = TRUE)
-    
-    # Because this occurs after disaggregation, some sectors may not map, update those sectors
-    disaggNAICS <- unique(totals_by_sector_BEA[is.na(totals_by_sector_BEA$BEA),"NAICS"])
-    totals_by_sector_BEA$BEA <- ifelse(totals_by_sector_BEA$NAICS %in% disaggNAICS, totals_by_sector_BEA$NAICS, totals_by_sector_BEA$BEA)
-    totals_by_sector_BEA$TechnologicalCorrelationAdjustment[is.na(totals_by_sector_BEA$TechnologicalCorrelationAdjustment)] <- 0
-    
-    # Generate allocation_factor data frame containing allocation factors between NAICS and BEA sectors
-    allocation_factor <- getNAICStoBEAAllocation(totals_by_sector_year, model)
-    colnames(allocation_factor) <- c("NAICS", "BEA", "Location", "allocation_factor")
-    # Merge the BEA-coded satellite table with allocation_factor dataframe
-    totals_by_sector_BEA <- merge(totals_by_sector_BEA, allocation_factor,
-                                    by = c("NAICS", "BEA", "Location"), all.x = TRUE)
-    # Replace NA in allocation_factor with 1
-    totals_by_sector_BEA[is.na(totals_by_sector_BEA$allocation_factor), "allocation_factor"] <- 1
+    tbs = to_columnar_tbs(totals_by_sector)
+    sectors = np.append(tbs['Sector'].cat.categories.to_numpy(dtype = object), None)
+    sector_codes = tbs['Sector'].cat.codes.to_numpy().astype(np.intp)
+    # Missing sectors use the last entry of sectors
+    sector_codes[sector_codes == -1] = len(sectors) - 1
+    location_codes = tbs['Location'].cat.codes.to_numpy()
+
+    # Map the Sector (NAICS) field to BEA with the allocation index of each location,
+    # resolving each NAICS code once per location
+    rows, bea, factors, tech_adjustments = [], [], [], []
+    locations = list(enumerate(tbs['Location'].cat.categories))
+    if (location_codes == -1).any():
+        locations.append((-1, None))
+    for location_code, location in locations:
+        index = get_naics_to_bea_allocation_index(model, totals_by_sector_year, location)
+        sector_rows, bea_positions, sector_factors, sector_adjustments = index.gather(sectors)
+        counts = np.bincount(sector_rows, minlength = len(sectors))
+        starts = np.cumsum(counts) - counts
+        location_rows = np.flatnonzero(location_codes == location_code)
+        repeats, offsets = repeat_rows(counts[sector_codes[location_rows]])
+        entries = starts[sector_codes[location_rows[repeats]]] + offsets
+        # Because this occurs after disaggregation, some sectors may not map, these keep their NAICS code
+        mapped_sectors = np.where(bea_positions == -1, sectors[sector_rows], index.bea[bea_positions])
+        rows.append(location_rows[repeats])
+        bea.append(mapped_sectors[entries])
+        factors.append(sector_factors[entries])
+        tech_adjustments.append(sector_adjustments[entries])
+    rows = np.concatenate(rows)
+    tbs = tbs.iloc[rows].reset_index(drop = True)
     # Calculate FlowAmount for BEA-coded sectors using allocation factors
-    totals_by_sector_BEA$FlowAmount <- totals_by_sector_BEA$FlowAmount*totals_by_sector_BEA$allocation_factor
-    
+    tbs["FlowAmount"] = tbs["FlowAmount"].to_numpy() * np.concatenate(factors)
     # Apply tech correlation adjustment
-    totals_by_sector_BEA$TechnologicalCorrelation <- totals_by_sector_BEA$TechnologicalCorrelation + totals_by_sector_BEA$TechnologicalCorrelationAdjustment
-    # Drop unneeded cols
-    totals_by_sector_BEA[, c("NAICS", "TechnologicalCorrelationAdjustment", "allocation_factor")] <- NULL
-    # Rename BEA to Sector
-    colnames(totals_by_sector_BEA)[colnames(totals_by_sector_BEA)=="BEA"] <- "Sector"
-    
-    totals_by_sector_BEA_agg <- collapseTBS(totals_by_sector_BEA, model)
+    tbs["TechnologicalCorrelation"] = tbs["TechnologicalCorrelation"].to_numpy() + np.concatenate(tech_adjustments)
+    tbs["Sector"] = pd.Categorical(np.concatenate(bea))
 
+    totals_by_sector_BEA_agg = collapse_tbs(tbs, model)
     return(totals_by_sector_BEA_agg)
-    '''
 
 def generate_flow_to_dollar_coefficient(sat_table, output_year, reference_year, location_acronym, model, is_ro_us = False, output_type = "Industry"):
     '''
@@ -108,17 +261,13 @@ def conform_tbs_to_standard_sat_table(sat_table):
     #' @param sattable A satellite table contains FlowAmount already aggregated and transformed to coefficients.
     #' @return A standard satellite table with coefficients (kg/$) and only columns completed in the original satellite table.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
     # Get standard sat table fields
-    fields <- getStandardSatelliteTableFormat()
-    # Add missing fields as new columns to sattable
-    sattable[, setdiff(fields, colnames(sattable))] <- ""
+    fields = get_standard_satellite_table_format()
+    # Add missing fields as new columns to sat_table
+    sat_table = sat_table.assign(**{field: "" for field in fields if field not in sat_table.columns})
     # Sort by satellite table sector code
-    Sattable_standardformat <- as.data.frame(sattable[order(sattable$Sector), fields])
-    return(Sattable_standardformat)
-    '''
+    sat_table_standard_format = sat_table.sort_values("Sector", kind = "stable")[fields].reset_index(drop = True)
+    return(sat_table_standard_format)
 
 def stact_satellite_tables(sat_table1, sat_table2):
     '''
@@ -141,18 +290,14 @@ def aggregate_satellite_table(sat_table, from_level, model):
     #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
     #' @return A more aggregated satellite table.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
     # Determine the columns within MasterCrosswalk that will be used in aggregation
-    from_code <- paste0("BEA_", from_level)
-    # Merge the satellite table with model$crosswalk
-    sattable <- merge(sattable, unique(model$crosswalk[, c(from_code, "USEEIO")]), by.x = "Sector", by.y = from_code)
+    from_code = f"BEA_{from_level}"
+    # Map the satellite table sectors to model sectors
+    sat_table, sectors = map_sector_codes(to_columnar_tbs(sat_table), model.crosswalk[[from_code, "USEEIO"]])
     # Update Sector field
-    sattable$Sector <- sattable$USEEIO
-    sattable_agg <- collapseTBS(sattable, model)
-    return(sattable_agg)
-    '''
+    sat_table["Sector"] = sectors
+    sat_table_agg = collapse_tbs(sat_table, model)
+    return(sat_table_agg)
 
 def collapse_tbs(tbs, model):
     '''
@@ -161,48 +306,77 @@ def collapse_tbs(tbs, model):
     #' @param model An EEIO model object with model specs and IO table loaded
     #' @return aggregated totals by sector
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    # Add in BEA industry names
-    sectornames <- model$Industries[, c("Code", "Name")]
-    colnames(sectornames) <- c("Sector", "SectorName")
-    # Add F01000 or F010 to sectornames
-    if (model$specs$BaseIOLevel=="Detail") {
-        sectornames <- rbind.data.frame(sectornames, c("F01000", "Household"))
-    } else {
-        sectornames <- rbind.data.frame(sectornames, c("F010", "Household"))
-    }
-    # Assign sector names to TBS
-    if("SectorName" %in% colnames(tbs)){
-        tbs$SectorName <- NULL
-    }
-    tbs <- merge(tbs, sectornames, by = "Sector", all.x = TRUE)
-    
+    tbs = to_columnar_tbs(tbs)
+    # Add in BEA industry names, and F01000 or F010 for households
+    sector_names = dict(zip(model.Industries['Code'], model.Industries['Name']))
+    sector_names["F01000" if model.specs['BaseIOLevel'] == "Detail" else "F010"] = "Household"
+    # Assign sector names to TBS, looked up once per Sector category (last entry for missing sectors)
+    sector_name = np.array([sector_names.get(code) for code in tbs['Sector'].cat.categories] + [None], dtype = object)
+    tbs = tbs.assign(SectorName = pd.Categorical(sector_name[tbs['Sector'].cat.codes.to_numpy()]))
+    flow_amount = tbs['FlowAmount'].to_numpy()
+
+    # Aggregate to BEA sectors in a single grouped pass: sums, min and max, and
+    # flow-weighted DQ means as sums of DQ*FlowAmount divided by sums of FlowAmount
+    dq_fields = data_quality_functions.get_dq_fields(tbs)
+    work = tbs[tbs_key_fields].copy()
+    work['FlowAmount'] = flow_amount
+    work['Min'] = tbs['Min'].to_numpy()
+    work['Max'] = tbs['Max'].to_numpy()
     # Replace NA in DQ cols with 5
-    dq_fields <- getDQfields(tbs)
-    for (f in dq_fields) {
-        tbs[is.na(tbs[, f]), f] <- 5
-    }
-    # Aggregate to BEA sectors using unique aggregation functions depending on the quantitative variable
-    tbs_agg <- dplyr::group_by(tbs, Flowable, Context, FlowUUID, Sector, SectorName,
-                                Location, Unit, Year, DistributionType) 
-    tbs_agg <- dplyr::summarize(
-        tbs_agg,
-        FlowAmountAgg = sum(FlowAmount),
-        Min = min(Min),
-        Max = max(Max),
-        DataReliability = stats::weighted.mean(DataReliability, FlowAmount),
-        TemporalCorrelation = stats::weighted.mean(TemporalCorrelation, FlowAmount),
-        GeographicalCorrelation = stats::weighted.mean(GeographicalCorrelation, FlowAmount),
-        TechnologicalCorrelation = stats::weighted.mean(TechnologicalCorrelation, FlowAmount),
-        DataCollection = stats::weighted.mean(DataCollection, FlowAmount),
-        MetaSources = dplyr::nth(MetaSources, which.max(nchar(MetaSources))),
-        .groups = 'drop'
+    work[dq_fields] = data_quality_functions.get_flow_weighted_dq(tbs, flow_amount, dq_fields)
+    grouped = work.groupby(tbs_key_fields, observed = True, dropna = False, sort = True)
+    tbs_agg = grouped.agg(
+        FlowAmount = ('FlowAmount', 'sum'),
+        Min = ('Min', 'min'),
+        Max = ('Max', 'max'),
+        **{f: (f, 'sum') for f in dq_fields}
     )
-    colnames(tbs_agg)[colnames(tbs_agg)=="FlowAmountAgg"] <- "FlowAmount"
-    return(tbs_agg)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        for f in dq_fields:
+            tbs_agg[f] = tbs_agg[f].to_numpy() / tbs_agg['FlowAmount'].to_numpy()
+
+    # MetaSources of each group is the longest one (the first of the longest on ties)
+    group = grouped.ngroup().to_numpy()
+    meta_sources = tbs['MetaSources'].cat
+    lengths = np.append(meta_sources.categories.astype(str).str.len().to_numpy(), -1)[meta_sources.codes.to_numpy()]
+    order = np.lexsort((np.arange(len(tbs)), -lengths, group))
+    first = order[np.unique(group[order], return_index = True)[1]]
+    tbs_agg['MetaSources'] = tbs['MetaSources'].to_numpy()[first]
+    return(tbs_agg.reset_index())
+
+def collapse_tbs_batches(batches, model, map_batch = None, max_rows = 1000000):
     '''
+    Collapse a totals by sector table that arrives in batches, e.g. streamed from a large file.
+    Each batch is collapsed (or mapped) on arrival and the partial results are collapsed
+    again whenever they exceed max_rows, so only the partial totals are held in memory.
+    Sums, min, max, flow-weighted DQ means and the longest MetaSources combine exactly
+    across batches.
+
+    Arguments:
+    batches:    An iterable of totals by sector dfs.
+    model:      An EEIO model object with model specs and IO table loaded.
+    map_batch:  Function taking a batch and returning it collapsed, e.g. mapped from NAICS to BEA
+                with map_flow_totals_by_sector_and_location_from_naics_to_bea(). Defaults to collapse_tbs().
+    max_rows:   Number of rows of partial totals above which they are collapsed again.
+
+    return: Aggregated totals by sector, or None if there are no batches.
+    '''
+    if map_batch is None:
+        map_batch = lambda tbs: collapse_tbs(tbs, model)
+    partials = []
+    rows = 0
+    for tbs in batches:
+        tbs = map_batch(tbs)
+        partials.append(tbs)
+        rows += len(tbs)
+        if rows > max_rows and len(partials) > 1:
+            partials = [collapse_tbs(pd.concat(partials, ignore_index = True), model)]
+            rows = len(partials[0])
+    if not partials:
+        return(None)
+    if len(partials) == 1:
+        return(partials[0])
+    return(collapse_tbs(pd.concat(partials, ignore_index = True), model))
 
 def calculate_indicator_scores_for_totals_by_sector(model, totals_by_sector_name, indicator_name):
     '''
@@ -262,31 +436,29 @@ def check_duplicate_flows_by_sector(sat_table_ls):
     #' @param sattable_ls A list of satellite tables
     #' @return Messages about whether there are duplicates across satellite tables
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
+    flow_fields = ["Flowable", "Context", "Sector"]
+    unique_flows = []
     # Extract unique Flowable and Context combination from each sat table
-    for (table_name in names(sattable_ls)){
-        # Update context to reflect only primary context (e.g. emission/air)
-        sattable_ls[[table_name]][, "Context"] <- stringr::str_match(sattable_ls[[table_name]][, "Context"],"\\w*\\/?\\w*")
+    for table_name, sat_table in sat_table_ls.items():
         # Store only flow information for each table
-        sattable_ls[[table_name]] <- unique(sattable_ls[[table_name]][, c("Flowable", "Context", "Sector")])
-        sattable_ls[[table_name]][, "name"] <- table_name
-    }
-    unique_flows <- do.call(rbind, sattable_ls)
+        flows = sat_table[flow_fields].astype(object)
+        # Update context to reflect only primary context (e.g. emission/air)
+        flows["Context"] = flows["Context"].str.extract(r"(\w*/?\w*)", expand = False)
+        flows = flows.drop_duplicates()
+        flows["name"] = table_name
+        unique_flows.append(flows)
+    if not unique_flows:
+        return
+    unique_flows = pd.concat(unique_flows, ignore_index = True)
     # Check duplicates in all unique flows
-    duplicates <- unique_flows[duplicated(unique_flows[, c("Flowable", "Context", "Sector")]) |
-                                duplicated(unique_flows[, c("Flowable", "Context", "Sector")], fromLast = TRUE), ]
-    duplicates <- duplicates[order(duplicates$Context, duplicates$Flowable, duplicates$Sector), ]
-    rownames(duplicates) <- NULL
-    
-    if (nrow(duplicates) > 0){
-        logging::logdebug("Duplicate flows exist across satellite tables and should be reviewed.")
-        logging::logdebug(duplicates)
-    } else {
-        logging::loginfo("No duplicate flows exist across satellite tables.")
-    }
-    '''
+    duplicates = unique_flows[unique_flows.duplicated(flow_fields, keep = False)]
+    duplicates = duplicates.sort_values(["Context", "Flowable", "Sector"]).reset_index(drop = True)
+
+    if len(duplicates) > 0:
+        logging.debug("Duplicate flows exist across satellite tables and should be reviewed.")
+        logging.debug(duplicates)
+    else:
+        logging.info("No duplicate flows exist across satellite tables.")
 
 def map_flow_totals_by_sector_from_bea_schema_2007_to_2012(totals_by_sector):
     '''
@@ -335,41 +507,22 @@ def check_satellite_flow_loss(tbs0, tbs, tolerance = 0.005):
     #'@param tbs, totals-by-sector df in model schema
     #'@param tolerance, tolerance level for data loss
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    tbs0 <- tbs0[!is.na(tbs0$Sector), ]
-    tbs <- tbs[!is.na(tbs$Sector), ]
-    
-    tbs0 <- tbs0[, c("Flowable", "Context", "FlowAmount")]
-    tbs <- tbs[, c("Flowable", "Context", "FlowAmount")]
-    tbs0_agg <- dplyr::group_by(tbs0, Flowable, Context)   
-    tbs0_agg <- dplyr::summarize(tbs0_agg,
-                                FlowAmount = sum(FlowAmount)
-                                )
-    tbs_agg <- dplyr::group_by(tbs, Flowable, Context)   
-    tbs_agg <- dplyr::summarize(tbs_agg,
-                                FlowAmount = sum(FlowAmount)
-                                )
-    tbs0_agg$Flow <- apply(tbs0_agg[, c('Context', 'Flowable')],1, FUN = joinStringswithSlashes)
-    tbs_agg$Flow <- apply(tbs_agg[, c('Context', 'Flowable')], 1, FUN = joinStringswithSlashes)
-    lost_flows <- setdiff(tbs0_agg$Flow, tbs_agg$Flow)
-
-    if(length(lost_flows) > 0){
-        df <- data.frame(Flow = lost_flows, FlowAmount = 0)
-        tbs_agg <- rbind(tbs_agg, df)
-        logging::logdebug("Flows lost upon conforming to model schema  :")
-        logging::logdebug(lost_flows)
-    }
+    def flow_totals(df):
+        df = to_columnar_tbs(df[df['Sector'].notna()][['Flowable', 'Context', 'Sector', 'FlowAmount']])
+        return(df.groupby(['Flowable', 'Context'], observed = True)['FlowAmount'].sum())
 
-    tbs_agg[order(match(tbs_agg$Flow, tbs0_agg$Flow)),1, drop=FALSE]
-    rel_diff <- abs((tbs_agg$FlowAmount - tbs0_agg$FlowAmount)/tbs0_agg$FlowAmount)
-    n <- length(subset(rel_diff, rel_diff > tolerance))
+    tbs0_agg = flow_totals(tbs0)
+    tbs_agg = flow_totals(tbs).reindex(tbs0_agg.index)
+    lost_flows = tbs_agg.index[tbs_agg.isna().to_numpy()]
+    if len(lost_flows) > 0:
+        logging.debug("Flows lost upon conforming to model schema  :")
+        logging.debug([f"{context}/{flowable}" for flowable, context in lost_flows])
+    tbs_agg = tbs_agg.fillna(0)
 
-    if(n > 0){
-        logging::logdebug("Data loss on conforming to model schema")    
-    }
-    '''
+    rel_diff = np.abs((tbs_agg.to_numpy() - tbs0_agg.to_numpy()) / tbs0_agg.to_numpy())
+    n = int((rel_diff > tolerance).sum())
+    if n > 0:
+        logging.debug("Data loss on conforming to model schema")
 
 def set_common_year_for_flow(tbs):
     '''
@@ -403,13 +556,8 @@ def remove_missing_sectors(tbs):
     #' @param tbs, totals-by-sector df in model schema
     #' @return df, the modified tbs
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    df <- tbs[!is.na(tbs$Sector), ]
-    n <- nrow(tbs) - nrow(df)
-    if(n > 0){
-        logging::logdebug(paste0(n, "records dropped with no sector"))
-    }
+    df = tbs[tbs['Sector'].notna()]
+    n = len(tbs) - len(df)
+    if n > 0:
+        logging.debug(f"{n} records dropped with no sector")
     return(df)
-    '''
@@ -6,17 +6,79 @@ logging.basicConfig(format='%(levelname)-8s [%(funcName)20s() %(filename)s:%(lin
 
 import importlib.resources
 import pandas as pd
+import numpy as np
+import scipy.sparse
 import re
-import inspect
 from .configuration_functions import get_configuration
-from .utility_functions import get_vector_of_codes, stack
-from . import load_io_tables, load_satellites, load_demand_vectors
+from .utility_functions import get_vector_of_codes, stack, to_sparse_matrix, to_dense_matrix
+from . import load_satellites, io_functions, utility_functions
+from . import satellite_functions, hybridization_functions, adjust_price, load_indicators, build_stages, build_profiler
+from .build_cache import BuildCache, get_build_key
 import sys
 
 
+# Model matrices that are stored with the sparse backend when it is selected.
+# M, M_d, N and N_d are products with the (dense) Leontief inverse and stay dense.
+sparse_matrices = ["V", "U", "U_d", "A", "A_d", "B", "C", "D"]
+
+# Model tables that derived matrices (e.g. market shares, commodity mix) are generated from.
+# Assigning a new table to any of them bumps its version, which invalidates derived matrices.
+derived_matrix_sources = ["MakeTransactions", "UseTransactions", "DomesticUseTransactions",
+                          "CommodityOutput", "IndustryOutput", "MultiYearIndustryOutput", "crosswalk"]
+
+# Model metadata tables with a Code_Loc column that sector codes are looked up in.
+# Assigning a new table to any of them drops its code index.
+code_index_tables = ["Commodities", "Industries", "ValueAddedMeta", "FinalDemandMeta"]
+
+# Model matrices (and the satellite tables and indicators they need), in build order, with the model
+# components each one is built from. Each is built by its builder in matrix_builders.
+# A lazy model builds a matrix, and the matrices it needs, on first access. Assigning a
+# new value to a component drops the matrices built from it, which are rebuilt on access.
+matrix_dependencies = {
+    "SatelliteTables": [],
+    "Indicators": ["SatelliteTables"],
+    "TbS": ["SatelliteTables"],
+    "CbS": ["TbS", "MultiYearIndustryOutput", "MultiYearIndustryCPI"],
+    "V": ["MakeTransactions"],
+    "C_m": ["MakeTransactions", "IndustryOutput"],
+    "V_n": ["MakeTransactions", "CommodityOutput"],
+    "U": ["UseTransactions", "FinalDemand", "FinalDemandbyCommodity", "UseValueAdded"],
+    "U_d": ["DomesticUseTransactions", "DomesticFinalDemand", "DomesticFinalDemandbyCommodity",
+            "UseValueAdded"],
+    "U_n": ["UseTransactions", "IndustryOutput"],
+    "U_d_n": ["DomesticUseTransactions", "IndustryOutput"],
+    "q": ["CommodityOutput"],
+    "x": ["IndustryOutput"],
+    "mu": ["InternationalTradeAdjustment"],
+    "A": ["U_n", "V_n"],
+    "A_d": ["U_d_n", "V_n"],
+    "L": ["A"],
+    "L_d": ["A_d"],
+    "B": ["CbS", "V_n"],
+    "C": ["Indicators", "B"],
+    "D": ["C", "B"],
+    "M": ["B", "A"],
+    "M_d": ["B", "A_d"],
+    "N": ["C", "M"],
+    "N_d": ["C", "M_d"],
+    "Rho": ["MultiYearCommodityCPI"],
+    "Phi": ["Margins"],
+}
+
+# Model matrices that construct_EEIO_matrices() leaves to be built on access
+# (the Leontief inverses, see get_leontief_solver()).
+on_access_matrices = ["L", "L_d"]
+
+# Model matrices built directly from each model component
+matrix_dependents = {}
+for _name, _dependencies in matrix_dependencies.items():
+    for _dependency in _dependencies:
+        matrix_dependents.setdefault(_dependency, []).append(_name)
+
+
 class USEEIOModel:
     
-    def __init__(self, model_name, config_paths = None):
+    def __init__(self, model_name, config_paths = None, sparse = None, build_cache = None, lazy = False):
         '''
         Initialize model with specifications and fundamental crosswalk table.
 
@@ -25,10 +87,19 @@ class USEEIOModel:
         configpaths:    str list, paths (including file name) of model configuration file
                         and optional agg/disagg configuration file(s).
                         If None, built-in config files are used.
+        sparse:         If True, build the model with the sparse matrix backend (scipy.sparse
+                        storage and sparse LU). If None, use the MatrixBackend model spec
+                        ("dense" if it is not given).
+        build_cache:    If True, reuse a model constructed from the same specs, spec files and
+                        packaged data from the on-disk build cache, and store newly constructed
+                        models in it. A BuildCache may be given to use a custom directory or
+                        eviction policy.
+        lazy:           If True, only load the IO tables and demand vectors, and build the
+                        satellite tables and model matrices (see matrix_dependencies) on
+                        first access. Lazy models are not stored in the build cache.
         '''
         logging.info("begin model initialization...")
-        self._valid = True
-        self._invalid_reason = None
+        self._init_state(lazy)
         # Get model specs
         self.specs = get_configuration(model_name, "model", config_paths)
 
@@ -36,161 +107,395 @@ class USEEIOModel:
             msg = f"No configuration exists for a model named {model_name}"
             logging.info(msg)
             sys.exit(msg)
+        if sparse is not None:
+            self.specs['MatrixBackend'] = "sparse" if sparse else "dense"
+        if build_cache:
+            cache = build_cache if isinstance(build_cache, BuildCache) else BuildCache()
+            build_key = get_build_key(self.specs, config_paths)
+            state = cache.load(build_key)
+            if state is not None:
+                logging.info(f"Loaded {model_name} from build cache {cache.cache_dir}")
+                self.__dict__.update(state)
+                self._config_paths = config_paths
+                return
+
+        self._config_paths = config_paths
+        build_stages.run_build_stages(self, config_paths, lazy)
+        if lazy:
+            logging.info("Model matrices are built on first access.")
+        elif build_cache:
+            cache.store(build_key, self)
+
+    def _init_state(self, lazy):
+        self._valid = True
+        self._invalid_reason = None
+        self._leontief_solvers = {}
+        self._versions = {}
+        self._derived_matrices = {}
+        self._build_timings = {}
+        self._build_memory = {}
+        self._code_indices = {}
+        self._materialized = set()
+        self._lazy = lazy
+        self._lazy_matrices = lazy
+        self._stage_fingerprints = {}
+
+    def load_crosswalk(self):
+        '''
+        Assign the model crosswalk (NAICS to BEA codes) of the model base schema.
+        '''
+        crosswalk_name = f"MasterCrosswalk{self.specs['BaseIOSchema']}.parquet"
+        crosswalk = utility_functions.get_named_dataset('useeio_py.data', crosswalk_name)
+        cols = ["NAICS_2012_Code"] + list((crosswalk.filter(regex = "^BEA", axis=1).columns))
+        crosswalk = crosswalk[cols]
+        crosswalk = crosswalk.drop_duplicates()
+        crosswalk = crosswalk.rename(
+            columns = lambda x: re.sub(
+                f"_{self.specs['BaseIOSchema']}|_Code",
+                "", x))
+        # Assign initial model crosswalk based on base schema
+        model_schema = "USEEIO"
+        base_schema = f"BEA_{self.specs['BaseIOLevel']}"
+        crosswalk[model_schema] = crosswalk[base_schema]
+        self.crosswalk = crosswalk
+
+    def rebuild(self, specs = None, config_paths = None):
+        '''
+        Rebuild the model after its specs changed, only re-running the build stages whose
+        inputs changed (see build_stages.run_build_stages()). E.g. changing an indicator
+        only reloads the indicators and rebuilds C, D, N and N_d.
+
+        Arguments:
+        specs:          New model specifications. If None, the model specs (modified in place).
+        config_paths:   str list, paths of model and agg/disagg configuration files.
+                        Defaults to the paths the model was initialized with.
+
+        return: The names of the build stages that were run.
+        '''
+        if specs is not None:
+            self.specs = specs
+        if config_paths is not None:
+            self._config_paths = config_paths
+        return(build_stages.run_build_stages(self, self.__dict__.get('_config_paths'),
+                                             self.__dict__.get('_lazy', False)))
+
+    def reset(self):
+        '''
+        Remove all model components except the specs, and the caches built from them.
+        '''
+        specs = self.specs
+        lazy = self.__dict__.get('_lazy', False)
+        config_paths = self.__dict__.get('_config_paths')
+        self.__dict__.clear()
+        self._init_state(lazy)
+        self._config_paths = config_paths
+        self.specs = specs
+
+    def __setattr__(self, name, value):
+        # Track a version per derived matrix source so cached derived matrices are
+        # regenerated after e.g. aggregation or disaggregation replaces the table
+        if name in derived_matrix_sources:
+            versions = self.__dict__.setdefault('_versions', {})
+            versions[name] = versions.get(name, 0) + 1
+        if name in code_index_tables:
+            self.__dict__.setdefault('_code_indices', {}).pop(name, None)
+        if name in matrix_dependents:
+            self.drop_dependent_matrices(name)
+        # A matrix assigned from outside is no longer managed (and rebuilt) by the model
+        self.__dict__.get('_materialized', set()).discard(name)
+        object.__setattr__(self, name, value)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set: build missing model matrices on access
+        if name in matrix_dependencies and self.__dict__.get('_lazy_matrices'):
+            return(self.materialize(name))
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def get_matrix_dependencies(self, name = None, missing = False):
+        '''
+        Get the model matrix dependency graph.
+
+        Arguments:
+        name:       Name of a model matrix. If given, only its dependencies are returned.
+        missing:    If True, only return the dependencies of name that are not built yet,
+                    i.e. the matrices that accessing name would build.
+
+        return: A dictionary of model matrix name to the names of the model components it is
+                built from, or for name the list of model matrices it needs (directly or
+                indirectly) in build order, ending with name.
+        '''
+        if name is None:
+            return({matrix: list(dependencies) for matrix, dependencies in matrix_dependencies.items()})
+        if name not in matrix_dependencies:
+            msg = f"{name} is not a model matrix."
+            logging.error(msg)
+            sys.exit(msg)
+        return(_required_matrices(name, built = self.__dict__ if missing else ()))
+
+    def is_materialized(self, name):
+        '''
+        Check whether a model matrix is built (or assigned), i.e. accessing it costs nothing.
+        '''
+        return(name in self.__dict__)
+
+    def materialize(self, name):
+        '''
+        Build a model matrix, and the model matrices it needs that are not built yet.
+
+        Argument:
+        name:   Name of a model matrix, see matrix_dependencies.
+
+        return: The matrix.
+        '''
+        if name not in matrix_dependencies:
+            msg = f"{name} is not a model matrix."
+            logging.error(msg)
+            sys.exit(msg)
+        # Matrices that are already built are used as they are, whatever they were built from
+        for matrix in _required_matrices(name, built = self.__dict__):
+            self.build_matrix(matrix)
+        return(self.__dict__[name])
+
+    def build_matrix(self, name):
+        '''
+        Build a model matrix from its model components with its builder in matrix_builders,
+        in a matrix_<name> span (see build_profiler), and record its build timing matrix_<name>.
+        The components must be built already, see materialize().
+        '''
+        logging.info(f"Building {name}...")
+        with build_profiler.span(f"matrix_{name}") as matrix_span:
+            matrix = matrix_builders[name](self)
+            matrix_span.set_output(matrix)
+        setattr(self, name, matrix)
+        self.__dict__.setdefault('_materialized', set()).add(name)
+        self.record_build_timing(f"matrix_{name}", matrix_span.wall)
+
+    def drop_matrix(self, name):
+        '''
+        Drop a model matrix (or model component) and the model matrices built from it, so
+        they are built again on next access.
+
+        Argument:
+        name:   Name of a model matrix or model component, e.g. "SatelliteTables".
+        '''
+        self.drop_dependent_matrices(name)
+        self.__dict__.pop(name, None)
+        self.__dict__.get('_materialized', set()).discard(name)
+
+    def drop_dependent_matrices(self, name):
+        '''
+        Drop the model matrices built (directly or indirectly) from a model component, so they
+        are rebuilt from its new value on next access. Matrices assigned from outside the model
+        are kept.
+
+        Argument:
+        name:   Name of a model component, e.g. "A" or "UseTransactions".
+
+        return: The names of the dropped matrices.
+        '''
+        materialized = self.__dict__.get('_materialized')
+        dropped = []
+        pending = list(matrix_dependents.get(name, []))
+        while materialized and pending:
+            matrix = pending.pop()
+            if matrix in materialized:
+                materialized.discard(matrix)
+                del self.__dict__[matrix]
+                dropped.append(matrix)
+                pending.extend(matrix_dependents.get(matrix, []))
+        if dropped:
+            logging.debug(f"Dropped {', '.join(dropped)} after {name} was replaced")
+        return(dropped)
+
+    def get_code_index(self, table):
+        '''
+        Get the hash index of the sector codes of a model metadata table. The index is built
+        once per table and dropped when the table is replaced (e.g. by aggregation or
+        disaggregation).
+
+        Arguments:
+        table:  Name of the metadata table, one of code_index_tables.
+
+        return: A pandas Index of the table's Code_Loc codes, in row order. Use get_loc() or
+                get_indexer() on it for code to row position lookups.
+        '''
+        indices = self.__dict__.setdefault('_code_indices', {})
+        index = indices.get(table)
+        codes = getattr(self, table)['Code_Loc']
+        if index is None or len(index) != len(codes):
+            index = pd.Index(codes, name = 'Code_Loc')
+            indices[table] = index
+        return(index)
+
+    def get_code_positions(self, table, codes):
+        '''
+        Look up the row positions of sector codes in a model metadata table.
+
+        Arguments:
+        table:  Name of the metadata table, one of code_index_tables.
+        codes:  List of sector codes (Code_Loc).
+
+        return: An integer array of row positions, -1 for codes that are not in the table.
+        '''
+        return(self.get_code_index(table).get_indexer(codes))
+
+    def is_code_index_of(self, table, index):
+        '''
+        Check whether an index, e.g. of a model matrix, lists the codes of a model metadata table
+        in row order, so that positions from get_code_positions() apply to it. The result for
+        the last matching index object is kept with the code index of the table.
+
+        Arguments:
+        table:  Name of the metadata table, one of code_index_tables.
+        index:  A pandas Index of sector codes (Code_Loc).
+
+        return: True if index equals the code index of the table.
+        '''
+        code_index = self.get_code_index(table)
+        indices = self.__dict__['_code_indices']
+        matched_code_index, matched_index = indices.get((table, "matched"), (None, None))
+        if matched_code_index is code_index and matched_index is index:
+            return(True)
+        if not code_index.equals(index):
+            return(False)
+        indices[(table, "matched")] = (code_index, index)
+        return(True)
+
+    def get_derived_matrix(self, name, generate, sources):
+        '''
+        Get a matrix derived from model tables, generating it only when one of its source
+        tables has been replaced since it was last generated.
+
+        Arguments:
+        name:       Name of the derived matrix, e.g. "MarketShares".
+        generate:   Function that takes the model and returns the derived matrix.
+        sources:    Names of the model tables the matrix is derived from
+                    (see derived_matrix_sources).
+
+        return: The derived matrix.
+        '''
+        versions = self.__dict__.setdefault('_versions', {})
+        cache = self.__dict__.setdefault('_derived_matrices', {})
+        key = tuple(versions.get(source, 0) for source in sources)
+        cached = cache.get(name)
+        if cached is None or cached[0] != key:
+            logging.debug(f"Generating {name}...")
+            matrix = generate(self)
+            # Cached arrays are shared by all callers, so they are made read-only
+            if isinstance(matrix, np.ndarray):
+                matrix.flags.writeable = False
+            cached = (key, matrix)
+            cache[name] = cached
+        return(cached[1])
+
+    def invalidate_derived_matrices(self):
+        '''
+        Drop all cached derived matrices, e.g. after a source table was modified in place
+        or model specs that affect them (MatrixBackend, ZeroOutputPolicy) were changed.
+        '''
+        self.__dict__.setdefault('_derived_matrices', {}).clear()
+
+    def record_build_timing(self, stage, seconds, peak_bytes = None):
+        '''
+        Record the wall time of a model build stage, and its peak memory where it was measured.
+
+        Arguments:
+        stage:      Name of the build stage, e.g. "stage_io_data".
+        seconds:    Wall time of the stage in seconds.
+        peak_bytes: Peak memory allocated by the stage in bytes, or None if not measured.
+        '''
+        self.__dict__.setdefault('_build_timings', {})[stage] = seconds
+        if peak_bytes is None:
+            logging.info(f"{stage} took {seconds:.3f} s")
         else:
-            # Get model crosswalk
-            crosswalk_name = f"MasterCrosswalk{self.specs['BaseIOSchema']}.parquet"
-            crosswalk_parquet = importlib.resources.files('useeio_py.data').joinpath(crosswalk_name)
-            crosswalk = pd.read_parquet(crosswalk_parquet)
-            cols = ["NAICS_2012_Code"] + list((crosswalk.filter(regex = "^BEA", axis=1).columns))
-            crosswalk = crosswalk[cols]
-            crosswalk = crosswalk.drop_duplicates()
-            crosswalk = crosswalk.rename(
-                columns = lambda x: re.sub(
-                    f"_{self.specs['BaseIOSchema']}|_Code",
-                    "", x))
-            # Assign initial model crosswalk based on base schema
-            model_schema = "USEEIO"
-            base_schema = f"BEA_{self.specs['BaseIOLevel']}"
-            crosswalk[model_schema] = crosswalk[base_schema]
-            self.crosswalk = crosswalk
-
-        logging.debug("Debugging Model __init__ here...")
-        load_io_tables.load_io_data(self)
-        load_satellites.load_and_build_satellite_tables(self)
-        load_demand_vectors.load_demand_vectors(self)
-        self.construct_EEIO_matrices()
+            self.__dict__.setdefault('_build_memory', {})[stage] = peak_bytes
+            logging.info(f"{stage} took {seconds:.3f} s with peak memory {peak_bytes / 1024**2:.1f} MB")
 
-    def get_elements(self):
-        elements = list(filter(
-            lambda x: not (x[0].startswith('_') or inspect.ismethod(x[1])),
-            inspect.getmembers(self)
-        ))
-        return(list(zip(*elements))[0])
+    def get_build_timings(self):
+        '''
+        Get the wall times (in seconds) of the model build stages recorded so far.
 
-    def construct_EEIO_matrices(self):
+        return: A dictionary of build stage name to seconds.
         '''
-        Construct EEIO matrices based on loaded IO tables, built satellite tables,
-        and indicator tables.
+        return(dict(self.__dict__.get('_build_timings', {})))
+
+    def get_build_memory(self):
         '''
-        logging.debug("Function not implemented")
-        sys.exit()
+        Get the peak memory (in bytes) of the model build stages that measured it, see record_build_timing().
+
+        return: A dictionary of build stage name to bytes.
         '''
-        # Combine data into a single totals by sector df
-        model$TbS <- do.call(rbind,model$SatelliteTables$totals_by_sector)
-        # Set common year for flow when more than one year exists
-        model$TbS <- setCommonYearforFlow(model$TbS)
-        # Generate coefficients 
-        model$CbS <- generateCbSfromTbSandModel(model)
-
-        # Generate matrices
-        model$V <- as.matrix(model$MakeTransactions) # Make
-        model$C_m <- generateCommodityMixMatrix(model) # normalized t(Make)
-        model$V_n <- generateMarketSharesfromMake(model) # normalized Make
-        if (model$specs$CommodityorIndustryType=="Industry") {
-        FinalDemand_df <- model$FinalDemandbyCommodity
-        DomesticFinalDemand_df <- model$DomesticFinalDemandbyCommodity
-        } else {
-        FinalDemand_df <- model$FinalDemand
-        DomesticFinalDemand_df <- model$DomesticFinalDemand
-        }
-        model$U <- as.matrix(dplyr::bind_rows(cbind(model$UseTransactions,
-                                                    FinalDemand_df),
-                                            model$UseValueAdded)) # Use
-        model$U_d <- as.matrix(dplyr::bind_rows(cbind(model$DomesticUseTransactions,
-                                                    DomesticFinalDemand_df),
-                                                model$UseValueAdded)) # DomesticUse
-        colnames(model$U_d) <- colnames(model$U)
-        model[c("U", "U_d")] <- lapply(model[c("U", "U_d")],
-                                        function(x) ifelse(is.na(x), 0, x))
-        model$U_n <- generateDirectRequirementsfromUse(model, domestic = FALSE) #normalized Use
-        model$U_d_n <- generateDirectRequirementsfromUse(model, domestic = TRUE) #normalized DomesticUse
-        model$q <- model$CommodityOutput
-        model$x <- model$IndustryOutput
-        model$mu <- model$InternationalTradeAdjustment
-        if(model$specs$CommodityorIndustryType == "Commodity") {
-        logging::loginfo("Building commodity-by-commodity A matrix (direct requirements)...")
-        model$A <- model$U_n %*% model$V_n
-        logging::loginfo("Building commodity-by-commodity A_d matrix (domestic direct requirements)...")
-        model$A_d <- model$U_d_n %*% model$V_n
-        } else if(model$specs$CommodityorIndustryType == "Industry") {
-        logging::loginfo("Building industry-by-industry A matrix (direct requirements)...")
-        model$A <- model$V_n %*% model$U_n
-        logging::loginfo("Building industry-by-industry A_d matrix (domestic direct requirements)...")
-        model$A_d <- model$V_n %*% model$U_d_n
-        }
+        return(dict(self.__dict__.get('_build_memory', {})))
 
-        if(model$specs$ModelType == "EEIO-IH"){
-        model$A <- hybridizeAMatrix(model)
-        model$A_d <- hybridizeAMatrix(model, domestic=TRUE)
-        }
+    def get_elements(self):
+        '''
+        Get the names of the model components that are set (matrices that are not built yet
+        are not included), in alphabetical order.
+        '''
+        return(tuple(sorted(name for name in self.__dict__ if not name.startswith('_'))))
 
-        # Calculate total requirements matrix as Leontief inverse (L) of A
-        logging::loginfo("Calculating L matrix (total requirements)...")
-        I <- diag(nrow(model$A))
-        I_d <- diag(nrow(model$A_d))
-        model$L <- solve(I - model$A)
-        logging::loginfo("Calculating L_d matrix (domestic total requirements)...")
-        model$L_d <- solve(I_d - model$A_d)
+    def get_leontief_solver(self, domestic = False):
+        '''
+        Get the factorized total requirements solver for the model A (or A_d) matrix.
+        (I - A) is LU-factorized on first use and the factors are cached on the model,
+        so repeated scaling vector requests only pay for back-substitution.
 
-        # Generate B matrix
-        logging::loginfo("Building B matrix (direct emissions and resource use per dollar)...")
-        model$B <- createBfromFlowDataandOutput(model)
+        Argument:
+        domestic:   If True, use the domestic direct requirements matrix A_d.
 
-        if(model$specs$ModelType == "EEIO-IH"){
-        model$B <- hybridizeBMatrix(model)
-        }
+        return: An io_functions.LeontiefSolver
+        '''
+        name = "A_d" if domestic else "A"
+        A = getattr(self, name)
+        solvers = self.__dict__.setdefault('_leontief_solvers', {})
+        cached = solvers.get(name)
+        # Refactorize if the direct requirements matrix has been replaced
+        if cached is None or cached[0] is not A:
+            logging.info(f"Factorizing Leontief system (I - {name})...")
+            with build_profiler.span(f"factorize_{name}"):
+                cached = (A, io_functions.LeontiefSolver(A))
+            solvers[name] = cached
+        return(cached[1])
 
-        # Generate C matrix
-        logging::loginfo("Building C matrix (characterization factors for model indicators)...")
-        model$C <- createCfromFactorsandBflows(model$Indicators$factors,rownames(model$B))
-
-        # Add direct impact matrix
-        logging::loginfo("Calculating D matrix (direct environmental impacts per dollar)...")
-        model$D <- model$C %*% model$B 
-
-        # Calculate total emissions/resource use per dollar (M)
-        logging::loginfo("Calculating M matrix (total emissions and resource use per dollar)...")
-        model$M <- model$B %*% model$L
-        colnames(model$M) <- colnames(model$M)
-        # Calculate M_d, the domestic emissions per dollar using domestic Leontief
-        logging::loginfo("Calculating M_d matrix (total emissions and resource use per dollar from domestic activity)...")
-        model$M_d <- model$B %*% model$L_d
-        colnames(model$M_d) <- colnames(model$M)
-
-        # Calculate total impacts per dollar (N), impact category x sector
-        logging::loginfo("Calculating N matrix (total environmental impacts per dollar)...")
-        model$N <- model$C %*% model$M
-        # Calculate U_d, the domestic impacts per dollar
-        logging::loginfo("Calculating N_d matrix (total environmental impacts per dollar from domestic activity)...")
-        model$N_d <- model$C %*% model$M_d
-
-        # Calculate year over model IO year price ratio
-        logging::loginfo("Calculating Rho matrix (price year ratio)...")
-        model$Rho <- calculateModelIOYearbyYearPriceRatio(model)
-
-        # Calculate producer over purchaser price ratio.
-        logging::loginfo("Calculating Phi matrix (producer over purchaser price ratio)...")
-        model$Phi <- calculateProducerbyPurchaserPriceRatio(model)
-
-        #Clean up model elements not written out or used in further functions to reduce clutter
-        mat_to_remove <- c("MakeTransactions", "UseTransactions", "DomesticUseTransactions",
-                            "UseValueAdded", "FinalDemand", "DomesticFinalDemand",
-                            "InternationalTradeAdjustment", "CommodityOutput", "IndustryOutput",
-                            "U_n", "U_d_n")
-        if (model$specs$CommodityorIndustryType=="Industry") {
-        mat_to_remove <- c(mat_to_remove,
-                            c("FinalDemandbyCommodity", "DomesticFinalDemandbyCommodity",
-                                "InternationalTradeAdjustmentbyCommodity"))
-        }
-        model <- within(model, rm(list = mat_to_remove))
+    def set_matrix_backend(self, backend):
+        '''
+        Convert the model matrices to the "sparse" or "dense" matrix backend, e.g. to
+        reduce the memory of many model variants held in one process.
+        Leontief solvers are refactorized with the new backend on next use.
 
-        if(model$specs$ModelType == "EEIO-IH"){
-        model <- hybridizeModelObjects(model)
-        }  
+        Argument:
+        backend:    "sparse" or "dense"
+        '''
+        if backend not in ["sparse", "dense"]:
+            logging.error(f"{backend} is not a valid matrix backend.")
+            return
+        convert = to_sparse_matrix if backend == "sparse" else to_dense_matrix
+        for name in sparse_matrices:
+            # Matrices that are not built yet get the backend when they are built
+            if name in self.__dict__:
+                self.__dict__[name] = convert(self.__dict__[name])
+        self.specs['MatrixBackend'] = backend
+        self.invalidate_derived_matrices()
 
-        logging::loginfo("Model build complete.")
-        return(model)
+    def construct_EEIO_matrices(self):
+        '''
+        Construct EEIO matrices based on loaded IO tables, built satellite tables,
+        and indicator tables.
+        Matrices are built in the order of matrix_dependencies; L and L_d are not materialized
+        (see get_leontief_solver()) and are only built when they are accessed.
+        After construction, a matrix that is dropped because one of its components was
+        replaced (see __setattr__()) is rebuilt on its next access.
         '''
+        for name in matrix_dependencies:
+            if name not in on_access_matrices and name not in self.__dict__:
+                self.build_matrix(name)
+        # NOTE: unlike useeior, the IO tables the matrices are built from (MakeTransactions,
+        # UseTransactions, U_n, ...) are kept on the model, since rebuilding a dropped matrix
+        # and the derived matrices (market shares, commodity mix) read them.
+        if self.specs.get('ModelType') == "EEIO-IH":
+            hybridization_functions.hybridize_model_objects(self)
+        self._lazy_matrices = True
+        logging.info("Model build complete.")
 
     def create_B_from_flow_data_and_output(self):
         '''Creates the B matrix from the flow data'''
@@ -277,4 +582,108 @@ class USEEIOModel:
         # Filter and resort model C flows and make it into a matrix
         C <- as.matrix(C[, B_flows])
         return(C)
-        '''
\ No newline at end of file
+        '''
+
+def _required_matrices(name, built):
+    # Model matrices needed to build name (including name) that are not in built, in build order
+    needed = set()
+    pending = [name]
+    while pending:
+        matrix = pending.pop()
+        if matrix in matrix_dependencies and matrix not in needed and matrix not in built:
+            needed.add(matrix)
+            pending.extend(matrix_dependencies[matrix])
+    return([matrix for matrix in matrix_dependencies if matrix in needed])
+
+def _matrix_product(left, right, sparse):
+    # Product of two labeled model matrices, with the sparse backend if sparse
+    product = utility_functions.matrix_values(left) @ utility_functions.matrix_values(right)
+    if sparse:
+        return(to_sparse_matrix(product, index=left.index, columns=right.columns))
+    if scipy.sparse.issparse(product):
+        product = product.toarray()
+    return(pd.DataFrame(np.asarray(product), index=left.index, columns=right.columns))
+
+def _build_tbs(model):
+    # Combine data into a single totals by sector df
+    tbs = pd.concat(list(model.SatelliteTables['totals_by_sector'].values()), ignore_index=True)
+    # Set common year for flow when more than one year exists
+    return(satellite_functions.set_common_year_for_flow(tbs))
+
+def _build_use(model, domestic):
+    if model.specs['CommodityorIndustryType'] == "Industry":
+        final_demand = model.DomesticFinalDemandbyCommodity if domestic else model.FinalDemandbyCommodity
+    else:
+        final_demand = model.DomesticFinalDemand if domestic else model.FinalDemand
+    use = model.DomesticUseTransactions if domestic else model.UseTransactions
+    U = pd.concat([pd.concat([use, final_demand], axis=1), model.UseValueAdded]).fillna(0)
+    return(to_sparse_matrix(U) if io_functions.use_sparse_matrices(model) else U)
+
+def _build_direct_requirements(model, domestic):
+    U_n = model.U_d_n if domestic else model.U_n
+    name = "A_d" if domestic else "A"
+    if model.specs['CommodityorIndustryType'] == "Commodity":
+        logging.info(f"Building commodity-by-commodity {name} matrix...")
+        A = _matrix_product(U_n, model.V_n, io_functions.use_sparse_matrices(model))
+    else:
+        logging.info(f"Building industry-by-industry {name} matrix...")
+        A = _matrix_product(model.V_n, U_n, io_functions.use_sparse_matrices(model))
+    if model.specs['ModelType'] == "EEIO-IH":
+        # hybridize_A_Matrix() reads the non-hybrid matrix from the model
+        model.__dict__[name] = A
+        A = hybridization_functions.hybridize_A_Matrix(model, domestic=domestic)
+    return(A)
+
+def _build_flow_matrix(model):
+    # Generate B matrix (direct emissions and resource use per dollar)
+    B = model.create_B_from_flow_data_and_output()
+    if model.specs['ModelType'] == "EEIO-IH":
+        model.__dict__['B'] = B
+        B = hybridization_functions.hybridize_B_matrix(model)
+    return(to_sparse_matrix(B) if io_functions.use_sparse_matrices(model) else B)
+
+def _build_characterization_matrix(model):
+    # Generate C matrix (characterization factors for model indicators)
+    C = model.create_C_from_factors_and_B_flows(model.Indicators['factors'], model.B.index)
+    return(to_sparse_matrix(C) if io_functions.use_sparse_matrices(model) else C)
+
+# Builders of the model matrices in matrix_dependencies
+matrix_builders = {
+    "SatelliteTables": load_satellites.load_sat_tables,
+    "Indicators": load_indicators.load_indicators,
+    "TbS": _build_tbs,
+    # Generate coefficients
+    "CbS": lambda model: model.generate_cbs_from_tbs_and_model(),
+    "V": lambda model: to_sparse_matrix(model.MakeTransactions) if io_functions.use_sparse_matrices(model)
+                       else model.MakeTransactions.astype(float),
+    # The normalized tables are copies of the derived matrices cached on the model, so the model
+    # matrices can be modified like any other model component
+    "C_m": lambda model: io_functions.generate_commodity_mix_matrix(model).copy(), # normalized t(Make)
+    "V_n": lambda model: io_functions.generate_market_shares_from_make(model).copy(), # normalized Make
+    "U": lambda model: _build_use(model, domestic=False), # Use
+    "U_d": lambda model: _build_use(model, domestic=True), # DomesticUse
+    "U_n": lambda model: io_functions.generate_direct_requirements_from_use(model, domestic=False).copy(), # normalized Use
+    "U_d_n": lambda model: io_functions.generate_direct_requirements_from_use(model, domestic=True).copy(), # normalized DomesticUse
+    "q": lambda model: model.CommodityOutput,
+    "x": lambda model: model.IndustryOutput,
+    "mu": lambda model: model.InternationalTradeAdjustment,
+    "A": lambda model: _build_direct_requirements(model, domestic=False),
+    "A_d": lambda model: _build_direct_requirements(model, domestic=True),
+    # Total requirements matrices as Leontief inverses of A and A_d
+    "L": lambda model: model.get_leontief_solver().inverse(),
+    "L_d": lambda model: model.get_leontief_solver(domestic=True).inverse(),
+    "B": _build_flow_matrix,
+    "C": _build_characterization_matrix,
+    # Direct impacts per dollar
+    "D": lambda model: _matrix_product(model.C, model.B, io_functions.use_sparse_matrices(model)),
+    # Total emissions/resource use per dollar, B L and B L_d without forming L or L_d
+    "M": lambda model: model.get_leontief_solver().left_multiply(model.B),
+    "M_d": lambda model: model.get_leontief_solver(domestic=True).left_multiply(model.B),
+    # Total impacts per dollar, impact category x sector
+    "N": lambda model: _matrix_product(model.C, model.M, False),
+    "N_d": lambda model: _matrix_product(model.C, model.M_d, False),
+    # Year over model IO year price ratio
+    "Rho": adjust_price.calculate_model_io_year_by_year_price_ratio,
+    # Producer over purchaser price ratio
+    "Phi": adjust_price.calculate_producer_by_purchaser_price_ratio,
+}
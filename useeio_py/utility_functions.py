@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 '''General utility functions for use across the package'''
 
+import logging
+import sys
+import collections
+import threading
+import time
+import weakref
 import pandas as pd
 import numpy as np
+import scipy.sparse
 import importlib.resources
 
 
@@ -49,30 +56,8 @@ def aggregate_matrix(matrix, from_level, to_level, model):
 
     return:     An aggregated matrix
     '''
-    # Determine the columns within MasterCrosswalk that will be used in aggregation
-    from_code = f"BEA_{from_level}"
-    to_code = f"BEA_{to_level}"
-    # Aggregate by rows
-    value_columns_1 = list(matrix.columns)
-    df_fromlevel = pd.merge(
-        matrix,
-        model.crosswalk[[from_code,to_code]].drop_duplicates(),
-        how='left',
-        left_index=True,
-        right_on=from_code
-    )
-    df_fromlevel_agg = df_fromlevel.groupby(to_code)[value_columns_1].agg('sum')
-    # aggregate by columns
-    value_columns_2 = list(df_fromlevel_agg.index)
-    df_fromlevel_agg = pd.merge(
-        np.transpose(df_fromlevel_agg),
-        model.crosswalk[[from_code,to_code]].drop_duplicates(),
-        how='left',
-        left_index=True,
-        right_on=from_code
-    )
-    matrix_fromlevel_agg = np.transpose(df_fromlevel_agg.groupby(to_code)[value_columns_2].agg('sum'))
-    return(matrix_fromlevel_agg)
+    crosswalk_index = get_crosswalk_index(model.crosswalk, f"BEA_{from_level}", f"BEA_{to_level}")
+    return(crosswalk_index.aggregate(matrix, rows = True, columns = True))
     '''
     # Determine the columns within MasterCrosswalk that will be used in aggregation
     #from_code <- paste0("BEA_", from_level)
@@ -98,6 +83,129 @@ def aggregate_matrix(matrix, from_level, to_level, model):
     return(matrix_fromlevel_agg)
     '''
 
+class CrosswalkIndex:
+    '''
+    Grouping of the codes of one crosswalk level (e.g. BEA_Summary) into the codes of another
+    level (e.g. BEA_Sector), precomputed once so that matrices can be aggregated with a sparse
+    0/1 aggregation matrix instead of merging with the crosswalk and grouping.
+    Codes that are not in the crosswalk are dropped from aggregated matrices, and aggregated
+    codes are sorted, as with a merge followed by groupby().sum().
+
+    Arguments:
+    crosswalk:  A crosswalk table, e.g. model.crosswalk.
+    from_code:  Column of the codes to aggregate from, e.g. "BEA_Summary" or "USEEIO".
+    to_code:    Column of the codes to aggregate to, e.g. "BEA_Sector".
+    '''
+    def __init__(self, crosswalk, from_code, to_code):
+        self.from_code = from_code
+        self.to_code = to_code
+        pairs = crosswalk[[from_code, to_code]].drop_duplicates().dropna()
+        self.from_codes, from_groups = np.unique(pairs[from_code].astype(str), return_inverse = True)
+        self.from_codes = pd.Index(self.from_codes)
+        self.to_codes, to_groups = np.unique(pairs[to_code].astype(str), return_inverse = True)
+        # from code x to code membership, a from code may belong to more than one to code
+        self.membership = scipy.sparse.csr_matrix(
+            (np.ones(len(pairs)), (from_groups.ravel(), to_groups.ravel())),
+            shape = (len(self.from_codes), len(self.to_codes)))
+        # Aggregation matrices by matrix labels, as the same labels are aggregated repeatedly
+        self._aggregation_matrices = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_aggregation_matrix(self, codes, location = False):
+        '''
+        Get the aggregation matrix S for a list of from-level codes, so that S @ matrix
+        aggregates the rows of a matrix labeled by those codes.
+
+        Arguments:
+        codes:      From-level codes, e.g. the index of a matrix.
+        location:   If True, codes have a location suffix (e.g. "1111A0/US") that is kept on
+                    the aggregated codes.
+
+        return: A tuple (S, to_codes): a scipy.sparse CSR matrix of shape (len(to_codes), len(codes))
+                and an Index of the aggregated codes.
+        '''
+        key = (location, tuple(codes))
+        with self._lock:
+            cached = self._aggregation_matrices.get(key)
+        if cached is not None:
+            return(cached)
+        codes = pd.Index(codes).astype(str)
+        if location:
+            base = codes.str.replace(r"/.*", "", regex = True)
+            locations = np.asarray(codes.str.replace(r"^[^/]*/", "", regex = True), dtype = object)
+        else:
+            base = codes
+        positions = self.from_codes.get_indexer(base)
+        matched = np.flatnonzero(positions != -1)
+        groups = self.membership[positions[matched]].tocoo()
+        rows = matched[groups.row]
+        labels = self.to_codes[groups.col].astype(object)
+        if location:
+            labels = labels + "/" + locations[rows]
+        to_codes, to_rows = np.unique(labels.astype(str), return_inverse = True)
+        S = scipy.sparse.csr_matrix((np.ones(len(rows)), (to_rows.ravel(), rows)), shape = (len(to_codes), len(codes)))
+        cached = (S, pd.Index(to_codes, name = self.to_code))
+        with self._lock:
+            self._aggregation_matrices[key] = cached
+            while len(self._aggregation_matrices) > 8:
+                self._aggregation_matrices.popitem(last = False)
+        return(cached)
+
+    def aggregate(self, matrix, rows = True, columns = False, location = False):
+        '''
+        Aggregate the rows and/or columns of a matrix from from-level to to-level codes.
+
+        Arguments:
+        matrix:     A dataframe labeled by from-level codes.
+        rows:       If True, aggregate the rows.
+        columns:    If True, aggregate the columns.
+        location:   If True, codes have a location suffix that is kept on the aggregated codes.
+
+        return: The aggregated dataframe. Sparse backend matrices stay sparse.
+        '''
+        values = matrix_values(matrix)
+        index, cols = matrix.index, matrix.columns
+        if rows:
+            S, index = self.get_aggregation_matrix(matrix.index, location)
+            values = S @ values
+        if columns:
+            S, cols = self.get_aggregation_matrix(matrix.columns, location)
+            values = values @ S.T
+        if is_sparse_matrix(matrix):
+            return(to_sparse_matrix(values, index, cols))
+        return(pd.DataFrame(np.asarray(values), index = index, columns = cols))
+
+# Crosswalk indices by crosswalk and level pair, see get_crosswalk_index()
+_crosswalk_indices = collections.OrderedDict()
+_crosswalk_indices_lock = threading.Lock()
+
+def get_crosswalk_index(crosswalk, from_code, to_code, maxsize = 32):
+    '''
+    Get the CrosswalkIndex of a crosswalk table for a (from, to) level pair. Indices are
+    built once per crosswalk table and level pair and reused while the table is alive;
+    crosswalk tables are treated as immutable (aggregation and disaggregation replace them).
+
+    Arguments:
+    crosswalk:  A crosswalk table, e.g. model.crosswalk.
+    from_code:  Column of the codes to aggregate from.
+    to_code:    Column of the codes to aggregate to.
+    maxsize:    Maximum number of indices kept.
+
+    return: A CrosswalkIndex.
+    '''
+    key = (id(crosswalk), from_code, to_code)
+    with _crosswalk_indices_lock:
+        cached = _crosswalk_indices.get(key)
+        if cached is not None and cached[0]() is crosswalk:
+            _crosswalk_indices.move_to_end(key)
+            return(cached[1])
+    crosswalk_index = CrosswalkIndex(crosswalk, from_code, to_code)
+    with _crosswalk_indices_lock:
+        _crosswalk_indices[key] = (weakref.ref(crosswalk), crosswalk_index)
+        while len(_crosswalk_indices) > maxsize:
+            _crosswalk_indices.popitem(last = False)
+    return(crosswalk_index)
+
 def calculate_output_ratio(model, output_type = "Commodity"):
     '''
     #' Generate Output Ratio table, flexible to Commodity/Industry output and model Commodity/Industry type
@@ -186,27 +294,48 @@ def compare_matrices(m1, m2, percentage_diff = False):
     return(m)
     '''
 
-def write_matrix_as_bin_file(matrix, path):
+def write_matrix_as_bin_file(matrix, path, block_bytes = 64 * 1024**2):
     '''
-    #' Write matrix as bin file
-    #' @param matrix A matrix to be written
-    #' @param path Path to write the bin file to
-    '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    Write a matrix as a bin file: the number of rows and columns as little-endian 32-bit
+    integers, followed by the values as little-endian doubles in column-major order.
+    Values are written in blocks of columns, so only one block is converted at a time.
+
+    Arguments:
+    matrix:         A matrix (array, dataframe or sparse matrix) to be written. Vectors are
+                    written as one-column matrices.
+    path:           Path to write the bin file to.
+    block_bytes:    Approximate size of the blocks of columns in bytes.
+    '''
+    values = matrix.tocsc() if scipy.sparse.issparse(matrix) else matrix_values(matrix)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    rows, cols = values.shape
+    block_cols = max(1, block_bytes // (8 * max(rows, 1)))
+    with open(path, "wb") as out:
+        np.array([rows, cols], dtype = "<i4").tofile(out)
+        for col in range(0, cols, block_cols):
+            block = values[:, col:col + block_cols]
+            if scipy.sparse.issparse(block):
+                block = block.toarray()
+            # Rows of the transposed block are the columns of the matrix
+            np.ascontiguousarray(block.T, dtype = "<f8").tofile(out)
+
+def read_matrix_from_bin_file(path, mmap = True):
     '''
-    out <- file(path, "wb")
-    rows <- dim(matrix)[1]
-    cols <- dim(matrix)[2]
-    writeBin(as.integer(rows), out, size = 4, endian = "little")
-    writeBin(as.integer(cols), out, size = 4, endian = "little")
-    for (col in 1:cols) {
-        for (row in 1:rows) {
-        writeBin(as.double(matrix[row, col]), out, size = 8, endian = "little")
-        }
-    }
-    close(out)
+    Read a matrix written by write_matrix_as_bin_file().
+
+    Arguments:
+    path:   Path of the bin file.
+    mmap:   If True, return a read-only np.memmap of the file, so values are only read from disk
+            when they are used. Columns are contiguous in the file, so column slices are cheap.
+
+    return: A (rows x cols) array of doubles.
     '''
+    rows, cols = np.fromfile(path, dtype = "<i4", count = 2)
+    if mmap:
+        return(np.memmap(path, dtype = "<f8", mode = "r", offset = 8, shape = (int(rows), int(cols)), order = "F"))
+    values = np.fromfile(path, dtype = "<f8", offset = 8)
+    return(values.reshape((int(rows), int(cols)), order = "F"))
 
 def download_data_commons_file(source, subdirectory, debug_url):
     '''
@@ -274,25 +403,15 @@ def map_fips5_to_location_names(fips_codes, fips_system):
     #' @param fipssystem A text value specifying FIPS System, can be FIPS_2015
     #' @return A vector of location names where matches are found
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    mapping_file <- "Crosswalk_FIPS.csv"
-    mapping <- utils::read.table(system.file("extdata", mapping_file, package = "useeior"),
-                                sep = ",", header = TRUE, stringsAsFactors = FALSE, 
-                                check.names = FALSE, quote = "")
+    mapping = get_named_dataset('useeio_py.inst.extdata', "Crosswalk_FIPS.csv", dtype = str, keep_default_na = False)
+    if fips_system not in mapping.columns:
+        fips_system = [col for col in mapping.columns if col.startswith("FIPS")][-1]
     # Add leading zeros to FIPS codes if necessary
-    if (!fipssystem%in%colnames(mapping)) {
-        fipssystem <- max(which(startsWith(colnames(mapping), "FIPS")))
-    }
-    mapping[, fipssystem] <- formatC(mapping[, fipssystem], width = 5, format = "d", flag = "0")
-    mapping <- mapping[mapping[, fipssystem]%in%fipscodes, ]
-    # Get locations based on fipscodes
-    locations <- stringr::str_replace_all(string = fipscodes,
-                                            pattern = setNames(as.vector(mapping$State),
-                                                            mapping[, fipssystem]))
-    return(locations)
-    '''
+    states = dict(zip(mapping[fips_system].str.zfill(5), mapping["State"]))
+    # Get locations based on fips_codes, keeping codes without a match
+    codes = pd.Series(fips_codes, dtype = object)
+    locations = codes.map(states).fillna(codes)
+    return(locations.to_numpy())
 
 def map_location_codes_to_names(codes, code_system):
     '''
@@ -301,14 +420,10 @@ def map_location_codes_to_names(codes, code_system):
     #' @param codesystem A text value specifying code system, e.g. FIPS.
     #' @return A vector of location names where matches are found.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    func_dict <- list("FIPS" = "mapFIPS5toLocationNames") # add more component for new location codes
-    func_to_eval <- func_dict[[codesystem]]
-    location_names <- do.call(eval(as.name(func_to_eval)), list(codes, codesystem))
+    func_dict = {"FIPS": map_fips5_to_location_names} # add more component for new location codes
+    func_to_eval = func_dict[code_system.split("_")[0]]
+    location_names = func_to_eval(codes, code_system)
     return(location_names)
-    '''
 
 def get_state_name_from_abb(abb):
     '''    
@@ -389,11 +504,124 @@ def get_state_name_from_abb(abb):
     abbrev_to_us_state = dict(map(reversed, us_state_to_abbrev.items()))
     return(abbrev_to_us_state[abb])
     
-#TODO: replace this function call with the importlib method. 
-# This function adds abstraction without reducing lines of code.
-def get_named_dataset(source, name):
+class ReferenceDataCache:
+    '''
+    Thread-safe, size-bounded LRU cache of packaged reference tables (parquet/CSV files),
+    shared by all model builds in a process.
+    The cache holds one frame per file and hands out copies: lazy copies when pandas
+    copy-on-write is enabled, otherwise deep copies, so callers can modify what they get.
+
+    Argument:
+    maxsize:    Maximum number of tables kept. The least recently used table is evicted first.
+    '''
+    def __init__(self, maxsize = 64):
+        self.maxsize = maxsize
+        self._tables = collections.OrderedDict()
+        self._lock = threading.RLock()
+        # Locks of the tables being read, so each table is read by one thread at a time
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        '''
+        Get a copy of the table cached under key, calling load() to read it on a miss.
+        Threads that miss on the same key at the same time wait for the first one to read it.
+        '''
+        with self._lock:
+            df = self._lookup(key)
+            if df is None:
+                key_lock = self._loading.setdefault(key, threading.Lock())
+        if df is None:
+            # Read outside of the cache lock so other tables can be served meanwhile
+            with key_lock:
+                with self._lock:
+                    df = self._lookup(key)
+                    if df is None:
+                        self.misses += 1
+                if df is None:
+                    try:
+                        df = load()
+                        with self._lock:
+                            self._tables[key] = df
+                            while len(self._tables) > self.maxsize:
+                                self._tables.popitem(last = False)
+                                self.evictions += 1
+                    finally:
+                        with self._lock:
+                            self._loading.pop(key, None)
+        return(df.copy(deep = pd.options.mode.copy_on_write is not True))
+
+    def _lookup(self, key):
+        # Cached table of key, counted as a hit, or None. Called with the cache lock held.
+        df = self._tables.get(key)
+        if df is not None:
+            self._tables.move_to_end(key)
+            self.hits += 1
+        return(df)
+
+    def clear(self):
+        '''Drop all cached tables and reset the statistics.'''
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def info(self):
+        '''
+        return: A dictionary with hits, misses, evictions, size and maxsize of the cache.
+        '''
+        with self._lock:
+            return({"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self._tables), "maxsize": self.maxsize})
+
+# Process-wide cache used by get_named_dataset()
+reference_data_cache = ReferenceDataCache()
+
+def get_named_dataset(source, name, **kwargs):
+    '''
+    Get a packaged reference table (parquet or CSV file) as a dataframe.
+    Tables are read once per process and served from reference_data_cache afterwards.
+
+    Arguments:
+    source: Package holding the file, e.g. 'useeio_py.data'.
+    name:   File name, ending in ".parquet" or ".csv".
+    kwargs: Further arguments for pd.read_parquet() or pd.read_csv().
+
+    return: A dataframe that the caller may modify.
+    '''
     file = importlib.resources.files(source).joinpath(name)
-    return(file)
+    if name.endswith(".parquet"):
+        read = lambda: pd.read_parquet(file, **kwargs)
+    else:
+        read = lambda: pd.read_csv(file, **kwargs)
+    key = (source, name, _get_hashable(kwargs))
+    try:
+        hash(key)
+    except TypeError:
+        # Arguments that can't be part of a cache key (e.g. arrays), read the file every time
+        return(read())
+    return(reference_data_cache.get(key, read))
+
+def _get_hashable(value):
+    # Hashable form of read_csv()/read_parquet() arguments, e.g. usecols lists or dtype dicts
+    if isinstance(value, dict):
+        return(tuple(sorted(((key, _get_hashable(item)) for key, item in value.items()), key = repr)))
+    if isinstance(value, (list, tuple)):
+        return(tuple(_get_hashable(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return(frozenset(_get_hashable(item) for item in value))
+    return(value)
+
+def get_named_dataset_cache_info():
+    '''
+    Get hit/miss statistics of the reference table cache used by get_named_dataset().
+
+    return: A dictionary with hits, misses, evictions, size and maxsize.
+    '''
+    return(reference_data_cache.info())
 
 def get_vector_of_codes(io_schema, io_level, col_name):
     '''
@@ -407,9 +635,7 @@ def get_vector_of_codes(io_schema, io_level, col_name):
     return:     A vector of codes.
     '''
     schema_info_file_name = f"{io_schema}_{io_level}_Schema_Info.csv"
-    #schema_info_file = importlib.resources.files('useeio_py.inst.extdata').joinpath(schema_info_file_name)
-    schema_info_file = get_named_dataset('useeio_py.inst.extdata', schema_info_file_name)
-    schema_info = pd.read_csv(schema_info_file, header = 0)
+    schema_info = get_named_dataset('useeio_py.inst.extdata', schema_info_file_name, header = 0)
     schema_info_out = (schema_info.filter(items = ["Code", col_name])
         .dropna()
         .filter(items = ['Code'])
@@ -443,7 +669,56 @@ def unlist(df):
     Combine all columns from DataFrame into single list
     '''
     return(np.concatenate(np.stack(pd.DataFrame(df).values, axis=1), axis=None))
-    
+
+
+def is_sparse_matrix(df):
+    '''
+    Check whether a model matrix uses the sparse backend, i.e. is a dataframe
+    with pandas sparse (SparseDtype) columns.
+    '''
+    return(isinstance(df, pd.DataFrame) and df.shape[1] > 0 and
+           all(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes))
+
+def to_sparse_matrix(matrix, index = None, columns = None):
+    '''
+    Convert a matrix to the sparse backend: a dataframe with sparse columns that keeps
+    the row and column labels but only stores nonzero values.
+
+    Arguments:
+    matrix:     A dataframe, numpy array or scipy.sparse matrix.
+    index:      Row labels, defaults to the index of matrix if it is a dataframe.
+    columns:    Column labels, defaults to the columns of matrix if it is a dataframe.
+
+    return:     A sparse dataframe.
+    '''
+    if isinstance(matrix, pd.DataFrame):
+        index = matrix.index if index is None else index
+        columns = matrix.columns if columns is None else columns
+        if is_sparse_matrix(matrix):
+            return(matrix)
+        matrix = matrix.to_numpy(dtype=float)
+    values = scipy.sparse.csc_matrix(matrix, dtype=float)
+    values.eliminate_zeros()
+    return(pd.DataFrame.sparse.from_spmatrix(values, index=index, columns=columns))
+
+def to_dense_matrix(df):
+    '''
+    Convert a sparse backend matrix back to a dense dataframe (e.g. for writing).
+    Dense matrices are returned unchanged.
+    '''
+    if is_sparse_matrix(df):
+        return(df.sparse.to_dense())
+    return(df)
+
+def matrix_values(df):
+    '''
+    Get the values of a model matrix for calculation: a scipy.sparse CSC matrix for
+    sparse backend matrices, otherwise a dense numpy array.
+    '''
+    if is_sparse_matrix(df):
+        return(df.sparse.to_coo().tocsc())
+    return(np.asarray(df, dtype=float))
+
 
 def set_tolerance_for_ras(t_r, t_c, relative_diff = None, absolute_diff = None):
     '''
@@ -455,78 +730,334 @@ def set_tolerance_for_ras(t_r, t_c, relative_diff = None, absolute_diff = None):
     #' @param absolute_diff A numeric value setting the mean absolute difference of the two numerical vectors.
     #' @return A numeric value of relative difference of t_r and t_c.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
-    if (!is.null(relative_diff)) {
-        t <- relative_diff
-    } else if (!is.null(absolute_diff)) {
-        t <- absolute_diff/max(abs(t_c), abs(t_r))
-    } else {
-        stop("Set relative_diff or absolute_diff first.")
-    }
+    if relative_diff is not None:
+        t = relative_diff
+    elif absolute_diff is not None:
+        t = absolute_diff / max(np.max(np.abs(t_c)), np.max(np.abs(t_r)))
+    else:
+        msg = "Set relative_diff or absolute_diff first."
+        logging.error(msg)
+        sys.exit(msg)
     return(t)
+
+def mean_relative_difference(target, current):
+    '''
+    Mean relative difference of two vectors as used by R's all.equal(): the mean absolute
+    difference divided by the mean absolute target, or the mean absolute difference if the
+    targets are all zero.
     '''
+    difference = np.mean(np.abs(target - current))
+    scale = np.mean(np.abs(target))
+    return(difference / scale if np.isfinite(scale) and scale > 0 else difference)
+
+def get_gras_factors(target, positive, negative = None):
+    '''
+    Solve the (G)RAS scaling factors of one margin: f*positive - negative/f = target for each
+    row (or column), where positive and negative are the sums of the positive and negative
+    entries scaled by the factors of the other margin. Without negative entries this is the
+    RAS ratio target/positive.
+    Rows (columns) that can't be scaled to their target, e.g. all-zero rows, keep factor 1.
+    '''
+    f = np.ones_like(target)
+    p = positive > 0
+    if negative is None:
+        f[p] = target[p] / positive[p]
+    else:
+        f[p] = (target[p] + np.sqrt(target[p]**2 + 4 * positive[p] * negative[p])) / (2 * positive[p])
+        n = ~p & (negative > 0) & (target < 0)
+        f[n] = -negative[n] / target[n]
+    return(f)
 
-def ras(m0, t_r, t_c, t, max_itr = 1E6):
+def ras(m0, t_r, t_c, t, max_itr = 1E6, time_budget = None, return_metrics = False):
     '''
     #' Generalized RAS procedure. Takes an initial matrix, a target row sum vector
     #' and target colsum vector. Iterates until all row sums of matrix equal to target row sum vector
     #' and colsums of matrix equal target col sum vector, within a tolerance.
-    #' @param m0 A matrix object.
+    #' Matrices with negative entries are balanced with GRAS (Junius & Oosterhaven 2003).
+    #' Row and column scaling factors are iterated with matrix-vector products on the
+    #' positive and negative parts of m0, and applied to a copy of m0 once at the end.
+    #' @param m0 A matrix object: a dataframe (dense or sparse backend), numpy array or scipy.sparse matrix.
     #' @param t_r A vector setting the target row sums of the matrix.
     #' @param t_c A vector setting the target column sums of the matrix.
     #' @param t A numeric value setting the tolerance of RAS.
     #' @param max_itr A numeric value setting the maximum number of iterations to try for convergence.
     #' Default is 1,000,000.
-    #' @return A RAS balanced matrix.
+    #' @param time_budget Maximum wall time in seconds, no limit if None.
+    #' @param return_metrics If True, also return a dictionary of convergence metrics: converged,
+    #' iterations, seconds, stop_reason ("converged", "max_itr" or "time_budget") and the history of
+    #' row_residuals and column_residuals (mean relative differences to the targets).
+    #' @return A RAS balanced matrix of the same type as m0, and the metrics if return_metrics.
+    '''
+    m = matrix_values(m0) if isinstance(m0, pd.DataFrame) else m0
+    m = scipy.sparse.csr_matrix(m, dtype = float) if scipy.sparse.issparse(m) else np.asarray(m, dtype = float)
+    t_r = np.asarray(t_r, dtype = float).ravel()
+    t_c = np.asarray(t_c, dtype = float).ravel()
+    r, s, metrics = ras_factors(m, t_r, t_c, t, max_itr, time_budget)
+    if metrics['converged']:
+        logging.info(f"RAS converged after {metrics['iterations']} iterations.")
+    else:
+        logging.warning(f"RAS stopped by {metrics['stop_reason']} after {metrics['iterations']} iterations "
+                        f"without converging (row residual {metrics['row_residuals'][-1]:.3g}, "
+                        f"column residual {metrics['column_residuals'][-1]:.3g}).")
+    m = apply_ras_factors(m, r, s)
+    if isinstance(m0, pd.DataFrame):
+        m = to_sparse_matrix(m, m0.index, m0.columns) if is_sparse_matrix(m0) \
+            else pd.DataFrame(m, index = m0.index, columns = m0.columns)
+    return((m, metrics) if return_metrics else m)
+
+def ras_factors(m, t_r, t_c, t, max_itr = 1E6, time_budget = None, r = None, s = None):
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    Iterate the (G)RAS row and column scaling factors of a matrix.
+
+    Arguments:
+    m:              A numpy array or scipy.sparse CSR matrix of floats.
+    t_r:            Target row sums.
+    t_c:            Target column sums.
+    t:              Tolerance, for the mean relative differences of row and column sums to targets.
+    max_itr:        Maximum number of iterations.
+    time_budget:    Maximum wall time in seconds, no limit if None.
+    r, s:           Initial row and column factors (e.g. from a previous solution), all 1 if None.
+
+    return: A tuple (r, s, metrics) of the row factors, column factors and convergence metrics
+            (see ras()).
+    '''
+    start = time.perf_counter()
+    if scipy.sparse.issparse(m):
+        positive = m.maximum(0).tocsr()
+        negative = (-m).maximum(0).tocsr() if m.data.min(initial = 0) < 0 else None
+    else:
+        negative = np.maximum(-m, 0) if m.min(initial = 0) < 0 else None
+        positive = m if negative is None else np.maximum(m, 0)
+    positive_t = positive.T
+    negative_t = None if negative is None else negative.T
+    r = np.ones(len(t_r)) if r is None else np.array(r, dtype = float)
+    s = np.ones(len(t_c)) if s is None else np.array(s, dtype = float)
+
+    def reciprocal(factors):
+        with np.errstate(divide = "ignore"):
+            return(np.where(factors > 0, 1 / factors, 0))
+
+    def sums(matrix, factors):
+        return(None if matrix is None else matrix @ factors)
+
+    # Sums of the scaled positive/negative entries by column (pc, nc) and by row (p, n)
+    pc, nc = positive_t @ r, sums(negative_t, reciprocal(r))
+    p, n = positive @ s, sums(negative, reciprocal(s))
+    metrics = {"converged": False, "iterations": 0, "seconds": 0.0, "stop_reason": None,
+               "row_residuals": [], "column_residuals": []}
+    i = 0
+    while True:
+        rows = r * p - (0 if n is None else n * reciprocal(r))
+        cols = s * pc - (0 if nc is None else nc * reciprocal(s))
+        metrics['row_residuals'].append(float(mean_relative_difference(t_r, rows)))
+        metrics['column_residuals'].append(float(mean_relative_difference(t_c, cols)))
+        if metrics['row_residuals'][-1] <= t and metrics['column_residuals'][-1] <= t:
+            metrics['converged'] = True
+            metrics['stop_reason'] = "converged"
+            break
+        if i >= max_itr:
+            metrics['stop_reason'] = "max_itr"
+            break
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            metrics['stop_reason'] = "time_budget"
+            break
+        # Adjust rowwise, then colwise
+        r = get_gras_factors(t_r, p, n)
+        pc, nc = positive_t @ r, sums(negative_t, reciprocal(r))
+        s = get_gras_factors(t_c, pc, nc)
+        p, n = positive @ s, sums(negative, reciprocal(s))
+        i += 1
+    metrics['iterations'] = i
+    metrics['seconds'] = time.perf_counter() - start
+    return(r, s, metrics)
+
+def apply_ras_factors(m, r, s):
     '''
-    m <- m0
-    c_r <- as.vector(rowSums(m0))
-    c_c <- as.vector(colSums(m0))
-    # Check row and column conditions
-    row_condition <- all.equal(t_r, c_r, tolerance = t)
-    col_condition <- all.equal(t_c, c_c, tolerance = t)
-    i <- 0
-    while(!isTRUE(row_condition) | !isTRUE(col_condition)) {
-        if(i>max_itr){
-        break
-        }
-        # Adjust rowwise
-        c_r <- as.vector(rowSums(m))
-        # Replace 0 with 1 in c_r
-        c_r[c_r==0] <- 1
-        r_ratio <- t_r/c_r
-        m <- diag(r_ratio) %*% m
-        # Adjust colwise
-        c_c <- as.vector(colSums(m))
-        # Replace 0 with 1 in c_c
-        c_c[c_c==0] <- 1
-        c_ratio <- t_c/c_c
-        m <- m %*% diag(c_ratio)
-        # Check row and column conditions
-        row_condition <- all.equal(t_r, c_r, tolerance = t)
-        col_condition <- all.equal(t_c, c_c, tolerance = t)
-        i <- i + 1
-        
-        if(i %% (max_itr/1000)==0){
-        # Print on the screen some message
-        cat(paste0("iteration: ", i/max_itr*100, "%\n"))
-        }
-        if(i %% (max_itr/10) ==0)
-        {
-        readline(prompt="Press [enter] to continue")#pause
-        }
-    }
-    dimnames(m) <- dimnames(m0)
-    print(paste("RAS converged after", i, "iterations."))
-    return(m)
+    Scale a copy of a matrix by (G)RAS factors: positive entries by r_i*s_j and negative
+    entries by 1/(r_i*s_j), broadcasting the factors instead of multiplying by diagonal matrices.
+
+    Arguments:
+    m:  A numpy array or scipy.sparse CSR matrix of floats.
+    r:  Row factors.
+    s:  Column factors.
+
+    return: The scaled matrix, of the same type as m.
+    '''
+    if scipy.sparse.issparse(m):
+        m = m.copy()
+        factors = np.repeat(r, np.diff(m.indptr)) * s[m.indices]
+        m.data *= np.where(m.data < 0, 1 / factors, factors)
+        return(m)
+    factors = r[:, None] * s[None, :]
+    if m.min(initial = 0) >= 0:
+        return(m * factors)
+    with np.errstate(divide = "ignore"):
+        return(np.where(m < 0, m / factors, m * factors))
+
+def ras_batch(m0s, t_rs, t_cs, t, max_itr = 1E6, time_budget = None, warm_start = True,
+              r = None, s = None, return_metrics = False):
+    '''
+    Balance a stack of matrices (e.g. the same table for several years or regions) with
+    (G)RAS. With initial factors, or without warm_start, the slices are iterated together in
+    one vectorized loop and dropped from it as they converge. With warm_start and no initial
+    factors, the slices are balanced in order, each starting from the converged factors of
+    the previous slice, so a series that drifts from year to year stays close to its start.
+
+    Arguments:
+    m0s:            A 3-d array (slices x rows x columns) or a list of equally shaped matrices
+                    (dataframes or arrays). Sparse matrices are densified.
+    t_rs:           Target row sums, slices x rows.
+    t_cs:           Target column sums, slices x columns.
+    t:              Tolerance, see ras().
+    max_itr:        Maximum number of iterations, per slice.
+    time_budget:    Maximum wall time in seconds for the whole stack, no limit if None.
+    warm_start:     If True and no initial factors are given, start each slice from the
+                    factors of the last slice before it that converged.
+    r, s:           Initial row and column factors, per slice (slices x rows, slices x columns)
+                    or shared by all slices, e.g. the factors of a previous batch.
+    return_metrics: If True, also return a dictionary of convergence metrics: converged and
+                    iterations per slice, failed (indices of slices that did not converge),
+                    seconds, stop_reason, row_residuals and column_residuals (one array of
+                    per-slice residuals per iteration, NaN for slices no longer iterated) and
+                    the final factors r and s.
+
+    return: The balanced matrices, as a 3-d array or a list of dataframes like m0s, and the
+            metrics if return_metrics.
+    '''
+    start = time.perf_counter()
+    frames = m0s if isinstance(m0s, list) and all(isinstance(m, pd.DataFrame) for m in m0s) else None
+    m = np.stack([to_dense_matrix(x).to_numpy(dtype = float) if isinstance(x, pd.DataFrame)
+                  else (x.toarray() if scipy.sparse.issparse(x) else np.asarray(x, dtype = float))
+                  for x in m0s])
+    t_rs = np.asarray(t_rs, dtype = float).reshape(m.shape[0], m.shape[1])
+    t_cs = np.asarray(t_cs, dtype = float).reshape(m.shape[0], m.shape[2])
+    k = m.shape[0]
+    if r is None and s is None and warm_start and k > 1:
+        r, s, metrics = chain_ras_factors(m, t_rs, t_cs, t, max_itr, time_budget, start)
+    else:
+        r = np.broadcast_to(np.ones(m.shape[1]) if r is None else np.asarray(r, dtype = float), (k, m.shape[1])).copy()
+        s = np.broadcast_to(np.ones(m.shape[2]) if s is None else np.asarray(s, dtype = float), (k, m.shape[2])).copy()
+        r, s, metrics = batch_ras_factors(m, t_rs, t_cs, t, max_itr, time_budget, r, s, start)
+    metrics['failed'] = [int(j) for j in np.flatnonzero(~metrics['converged'])]
+    metrics['seconds'] = time.perf_counter() - start
+    metrics['r'] = r
+    metrics['s'] = s
+    if metrics['failed']:
+        logging.warning(f"RAS did not converge for slices {metrics['failed']} ({metrics['stop_reason']}).")
+    else:
+        logging.info(f"RAS converged for {k} slices after {metrics['iterations'].max()} iterations.")
+
+    factors = r[:, :, None] * s[:, None, :]
+    if m.min(initial = 0) >= 0:
+        m = m * factors
+    else:
+        with np.errstate(divide = "ignore"):
+            m = np.where(m < 0, m / factors, m * factors)
+    if frames is not None:
+        m = [pd.DataFrame(m[j], index = frames[j].index, columns = frames[j].columns) for j in range(k)]
+    return((m, metrics) if return_metrics else m)
+
+def chain_ras_factors(m, t_rs, t_cs, t, max_itr, time_budget, start):
     '''
+    Iterate the (G)RAS factors of a stack of matrices slice by slice, starting each slice from
+    the factors of the last slice before it that converged. See ras_batch() for the arguments
+    and metrics; start is the perf_counter() time the time budget counts from.
 
-def apply_ras(m0, t_r, t_c, relative_diff, absolute_diff, max_itr):
+    return: A tuple (r, s, metrics) of the row factors (slices x rows), column factors
+            (slices x columns) and convergence metrics.
+    '''
+    k = m.shape[0]
+    r = np.ones((k, m.shape[1]))
+    s = np.ones((k, m.shape[2]))
+    metrics = {"converged": np.zeros(k, dtype = bool), "iterations": np.zeros(k, dtype = int),
+               "stop_reason": "converged"}
+    row_residuals, column_residuals = [], []
+    r_start = s_start = None
+    for j in range(k):
+        budget = None if time_budget is None else max(0.0, time_budget - (time.perf_counter() - start))
+        r[j], s[j], slice_metrics = ras_factors(m[j], t_rs[j], t_cs[j], t, max_itr, budget, r_start, s_start)
+        metrics['converged'][j] = slice_metrics['converged']
+        metrics['iterations'][j] = slice_metrics['iterations']
+        if slice_metrics['converged']:
+            r_start, s_start = r[j], s[j]
+        else:
+            metrics['stop_reason'] = slice_metrics['stop_reason']
+        row_residuals.append(slice_metrics['row_residuals'])
+        column_residuals.append(slice_metrics['column_residuals'])
+    # Residuals by iteration, one entry per slice
+    iterations = max(len(residuals) for residuals in row_residuals)
+    for key, history in (("row_residuals", row_residuals), ("column_residuals", column_residuals)):
+        padded = np.full((iterations, k), np.nan)
+        for j, residuals in enumerate(history):
+            padded[:len(residuals), j] = residuals
+        metrics[key] = list(padded)
+    return(r, s, metrics)
+
+def batch_ras_factors(m, t_rs, t_cs, t, max_itr, time_budget, r, s, start):
+    '''
+    Iterate the (G)RAS factors of all slices of a stack of matrices together in one vectorized
+    loop, from initial factors r (slices x rows) and s (slices x columns). See ras_batch() for
+    the other arguments and the metrics; start is the perf_counter() time the time budget
+    counts from.
+
+    return: A tuple (r, s, metrics) of the row factors, column factors and convergence metrics.
+    '''
+    k = m.shape[0]
+    negative = np.maximum(-m, 0) if m.min(initial = 0) < 0 else None
+    positive = m if negative is None else np.maximum(m, 0)
+
+    def reciprocal(factors):
+        with np.errstate(divide = "ignore"):
+            return(np.where(factors > 0, 1 / factors, 0))
+
+    def row_sums(matrix, factors):
+        return(None if matrix is None else np.matmul(matrix, factors[:, :, None])[:, :, 0])
+
+    def col_sums(matrix, factors):
+        return(None if matrix is None else np.matmul(factors[:, None, :], matrix)[:, 0, :])
+
+    def residuals(target, current):
+        difference = np.mean(np.abs(target - current), axis = 1)
+        scale = np.mean(np.abs(target), axis = 1)
+        return(np.where(scale > 0, difference / np.where(scale > 0, scale, 1), difference))
+
+    metrics = {"converged": np.zeros(k, dtype = bool), "iterations": np.zeros(k, dtype = int),
+               "stop_reason": None, "row_residuals": [], "column_residuals": []}
+    # Slices still being balanced. Factors of converged slices are frozen; their sums are
+    # still computed, which is cheaper than copying the remaining slices out of the stack.
+    active = np.ones(k, dtype = bool)
+    pc, nc = col_sums(positive, r), col_sums(negative, reciprocal(r))
+    p, n = row_sums(positive, s), row_sums(negative, reciprocal(s))
+    i = 0
+    while True:
+        rows = r * p - (0 if n is None else n * reciprocal(r))
+        cols = s * pc - (0 if nc is None else nc * reciprocal(s))
+        row_residuals = np.where(active, residuals(t_rs, rows), np.nan)
+        column_residuals = np.where(active, residuals(t_cs, cols), np.nan)
+        metrics['row_residuals'].append(row_residuals)
+        metrics['column_residuals'].append(column_residuals)
+        done = active & (row_residuals <= t) & (column_residuals <= t)
+        metrics['converged'] |= done
+        metrics['iterations'][active] = i
+        active &= ~done
+        if not active.any():
+            metrics['stop_reason'] = "converged"
+            break
+        if i >= max_itr:
+            metrics['stop_reason'] = "max_itr"
+            break
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            metrics['stop_reason'] = "time_budget"
+            break
+        # Adjust rowwise, then colwise
+        r = np.where(active[:, None], get_gras_factors(t_rs, p, n), r)
+        pc, nc = col_sums(positive, r), col_sums(negative, reciprocal(r))
+        s = np.where(active[:, None], get_gras_factors(t_cs, pc, nc), s)
+        p, n = row_sums(positive, s), row_sums(negative, reciprocal(s))
+        i += 1
+    return(r, s, metrics)
+
+def apply_ras(m0, t_r, t_c, relative_diff = None, absolute_diff = None, max_itr = 1E6, time_budget = None, return_metrics = False):
     '''
     #' Integrate pre-adjustment of t_r, t_c and t (tolerance level) with RAS function.
     #' @param m0 A matrix object.
@@ -536,23 +1067,21 @@ def apply_ras(m0, t_r, t_c, relative_diff, absolute_diff, max_itr):
     #' @param absolute_diff A numeric value setting the mean absolute difference of the two numerical vectors.
     #' @param max_itr A numeric value setting the maximum number of iterations to try for convergence.
     #' Default is 1,000,000.
+    #' @param time_budget Maximum wall time in seconds, no limit if None.
+    #' @param return_metrics If True, also return the convergence metrics of ras().
     #' @return A RAS balanced matrix.
     '''
-    logging.debug("Function not implemented")
-    sys.exit()
-    '''
+    t_r = np.asarray(t_r, dtype = float).ravel()
+    t_c = np.asarray(t_c, dtype = float).ravel()
     # Adjust t_c/t_r, make sum(t_c)==sum(t_r)
-    if (sum(t_c) > sum(t_r)) {
-        t_r <- (t_r/sum(t_r))*sum(t_c)
-    } else {
-        t_c <- (t_c/sum(t_c))*sum(t_r)
-    }
+    if t_c.sum() > t_r.sum():
+        t_r = (t_r / t_r.sum()) * t_c.sum()
+    else:
+        t_c = (t_c / t_c.sum()) * t_r.sum()
     # Generate t for RAS
-    t <- setToleranceforRAS(t_r, t_c, relative_diff, absolute_diff)
+    t = set_tolerance_for_ras(t_r, t_c, relative_diff, absolute_diff)
     # Apply RAS
-    m <- RAS(m0, t_r, t_c, t, max_itr)
-    return(m)
-    '''
+    return(ras(m0, t_r, t_c, t, max_itr, time_budget, return_metrics))
 
 def remove_extra_spaces(s):
     '''
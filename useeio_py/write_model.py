@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 '''Functions for exporting the model to disc'''
 
+import logging
+import sys
+import os
 import pandas as pd
 import numpy as np
+from . import utility_functions
 
 
 # The list of matrices to write out
@@ -31,15 +35,33 @@ def write_model_for_api(model, base_dir):
 
 def write_model_matrices(model, to_format, output_folder):
     '''
-    #' Write model matrices as .csv or .bin files to output folder.
-    #' @param model A complete EEIO model: a list with USEEIO model components and attributes.
-    #' @param to_format A string specifying the format of write-to file, can be "csv" or "bin".
-    #' @param outputfolder A directory to write matrices out to
-    #' @description Writes model matrices as .csv or .bin files to output folder.
-    #' @export
-    '''
-    logging.debug("Function not implemented")
-    sys.exit()
+    Write model matrices as .csv or .bin files to output folder.
+    Sparse backend matrices are converted to dense matrices as they are written.
+    Bin files can be opened without loading them with utility_functions.read_matrix_from_bin_file().
+
+    Arguments:
+    model:          A complete EEIO model: a list with USEEIO model components and attributes.
+    to_format:      A string specifying the format of write-to file, can be "csv" or "bin".
+    output_folder:  A directory to write matrices out to
+    '''
+    if to_format == "csv":
+        model_folder = os.path.join(output_folder, model.specs['Model'], "matrices")
+        os.makedirs(model_folder, exist_ok=True)
+        for matrix in matrices:
+            df = get_model_matrix(model, matrix)
+            if df is not None:
+                df.to_csv(os.path.join(model_folder, f"{matrix}.csv"), na_rep="", encoding="UTF-8")
+    elif to_format == "bin":
+        model_folder = output_folder
+        os.makedirs(model_folder, exist_ok=True)
+        for matrix in matrices:
+            df = get_model_matrix(model, matrix)
+            if df is not None:
+                utility_functions.write_matrix_as_bin_file(df, os.path.join(model_folder, f"{matrix}.bin"))
+        # Write x (Industry Output) or q (Commodity Output) to .bin files
+        utility_functions.write_matrix_as_bin_file(np.asarray(model.q), os.path.join(model_folder, "q.bin"))
+        utility_functions.write_matrix_as_bin_file(np.asarray(model.x), os.path.join(model_folder, "x.bin"))
+    logging.info(f"Model matrices written to {model_folder}.")
     '''
     if (to_format=="csv") {
         modelfolder <- file.path(outputfolder, model$specs$Model, "matrices")
@@ -161,6 +183,25 @@ def generate_model_identifier(model):
 
 ###All functions below here are internal
 
+def get_model_matrix(model, name):
+    '''
+    Get a model matrix as a dense dataframe for writing.
+    L and L_d are materialized from the model's factorized Leontief solvers when they
+    are not stored on the model.
+
+    Arguments:
+    model:  A complete EEIO model: a list with USEEIO model components and attributes.
+    name:   Name of the matrix, e.g. "A" or "L_d".
+
+    return: A dense dataframe, or None if the model has no such matrix.
+    '''
+    if hasattr(model, name):
+        return(utility_functions.to_dense_matrix(getattr(model, name)))
+    if name in ["L", "L_d"]:
+        return(model.get_leontief_solver(domestic = name == "L_d").inverse())
+    logging.warning(f"Model has no {name} matrix to write.")
+    return(None)
+
 def set_write_dirs(base_dir, model = None):
     '''
     #' Sets directories to write model output data to